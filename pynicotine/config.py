@@ -100,7 +100,8 @@ class Config:
                 "ipblocklist": {},
                 "autojoin": ["nicotine"],
                 "autoaway": 15,
-                "private_chatrooms": False
+                "private_chatrooms": False,
+                "peerpoolsize": 100
             },
 
             "transfers": {
@@ -126,6 +127,15 @@ class Config:
                 "usecustomban": False,
                 "limitby": True,
                 "customban": "Banned, don't bother retrying",
+                "requestlimits": {
+                    "UserInfoRequest": (1, 10),
+                    "GetSharedFileList": (3, 300),
+                    "FolderContentsRequest": (30, 60),
+                    "FileSearchRequest": (10, 60),
+                    "PlaceInQueueRequest": (60, 60)
+                },
+                "requestautoban": False,
+                "requestbanlimit": 100,
                 "queuelimit": 10000,
                 "filelimit": 1000,
                 "friendsonly": False,
@@ -666,6 +676,36 @@ class Config:
             except Exception:
                 pass
 
+    def read_peer_addresses(self):
+        """ Returns the peer addresses saved by write_peer_addresses, as a dict of
+        username: (ip, port, behindfw, last_seen) """
+
+        try:
+            with open(os.path.join(self.data_dir, 'peeraddresses.pickle'), 'rb') as handle:
+                return RestrictedUnpickler(handle).load()
+
+        except FileNotFoundError:
+            pass
+
+        except Exception as inst:
+            log.add_warning(_("Something went wrong while reading your peer address cache: %(error)s"), {'error': str(inst)})
+
+        return {}
+
+    def write_peer_addresses(self, addresses):
+
+        realfile = os.path.join(self.data_dir, 'peeraddresses.pickle')
+        tmpfile = realfile + '.tmp'
+
+        try:
+            with open(tmpfile, 'wb') as handle:
+                pickle.dump(addresses, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmpfile, realfile)
+
+        except Exception as inst:
+            log.add_warning(_("Something went wrong while writing your peer address cache: %(error)s"), {'error': str(inst)})
+
     def write_configuration(self):
 
         external_sections = [
@@ -47,6 +47,7 @@ from pynicotine.gtkgui.dirchooser import save_file
 from pynicotine.gtkgui.downloads import Downloads
 from pynicotine.gtkgui.dialogs import option_dialog
 from pynicotine.gtkgui.fastconfigure import FastConfigureAssistant
+from pynicotine.gtkgui.mainloopqueue import MainLoopQueue
 from pynicotine.gtkgui.notifications import Notifications
 from pynicotine.gtkgui.nowplaying import NowPlaying
 from pynicotine.gtkgui.privatechat import PrivateChats
@@ -114,6 +115,10 @@ class NicotineFrame:
         except (ImportError, ValueError):
             self.gspell = False
 
+        # Network events are processed on the main loop, which owns the core and
+        # the GUI. Events that arrive in the meantime are handled in one batch.
+        self.network_events = MainLoopQueue()
+
         self.np = NetworkEventProcessor(
             self,
             self.network_callback,
@@ -657,7 +662,7 @@ class NicotineFrame:
 
     def network_callback(self, msgs):
         if len(msgs) > 0:
-            GLib.idle_add(self.on_network_event, msgs)
+            self.network_events.add(self.on_network_event, (msgs,), {})
 
     def conn_close(self, conn, addr):
 
@@ -2274,6 +2279,7 @@ class NicotineFrame:
         if ip not in ipignorelist:
             ipignorelist[ip] = ""
             self.np.config.write_configuration()
+            self.np.update_ip_ignore_list()
 
             if self.settingswindow is not None:
                 self.settingswindow.pages["Ignore List"].set_settings(self.np.config.sections)
@@ -2292,6 +2298,7 @@ class NicotineFrame:
         if ip not in ipignorelist or self.np.config.sections["server"]["ipignorelist"][ip] != user:
             self.np.config.sections["server"]["ipignorelist"][ip] = user
             self.np.config.write_configuration()
+            self.np.update_ip_ignore_list()
 
             if self.settingswindow is not None:
                 self.settingswindow.pages["Ignore List"].set_settings(self.np.config.sections)
@@ -2305,6 +2312,7 @@ class NicotineFrame:
             if ip is not None:
                 del ipignorelist[ip]
                 self.np.config.write_configuration()
+                self.np.update_ip_ignore_list()
 
                 if self.settingswindow is not None:
                     self.settingswindow.pages["Ignore List"].set_settings(self.np.config.sections)
@@ -2323,6 +2331,7 @@ class NicotineFrame:
         if ip in ipignorelist:
             del ipignorelist[ip]
             self.np.config.write_configuration()
+            self.np.update_ip_ignore_list()
 
             if self.settingswindow is not None:
                 self.settingswindow.pages["Ignore List"].set_settings(self.np.config.sections)
@@ -2339,6 +2348,7 @@ class NicotineFrame:
         if ip not in self.np.config.sections["server"]["ipblocklist"] or self.np.config.sections["server"]["ipblocklist"][ip] != user:
             self.np.config.sections["server"]["ipblocklist"][ip] = user
             self.np.config.write_configuration()
+            self.np.update_ip_block_list()
 
             if self.settingswindow is not None:
                 self.settingswindow.pages["Ban List"].set_settings(self.np.config.sections)
@@ -2350,6 +2360,7 @@ class NicotineFrame:
             if ip is not None:
                 del self.np.config.sections["server"]["ipblocklist"][ip]
                 self.np.config.write_configuration()
+                self.np.update_ip_block_list()
 
                 if self.settingswindow is not None:
                     self.settingswindow.pages["Ban List"].set_settings(self.np.config.sections)
@@ -2369,6 +2380,7 @@ class NicotineFrame:
         if ip in self.np.config.sections["server"]["ipblocklist"]:
             del self.np.config.sections["server"]["ipblocklist"][ip]
             self.np.config.write_configuration()
+            self.np.update_ip_block_list()
 
             if self.settingswindow is not None:
                 self.settingswindow.pages["Ban List"].set_settings(self.np.config.sections)
@@ -2377,6 +2389,7 @@ class NicotineFrame:
         if user in self.np.config.sections["server"]["banlist"]:
             self.np.config.sections["server"]["banlist"].remove(user)
             self.np.config.write_configuration()
+            self.np.update_user_access()
 
     def ignore_user(self, user):
         if user not in self.np.config.sections["server"]["ignorelist"]:
@@ -2797,6 +2810,10 @@ class NicotineFrame:
 
         self.np.queue.put(slskmessages.SetUploadLimit(uselimit, uploadlimit, limitby))
         self.np.queue.put(slskmessages.SetDownloadLimit(config["transfers"]["downloadlimit"]))
+        self.np.queue.put(slskmessages.SetPeerPoolSize(config["server"]["peerpoolsize"]))
+        self.np.update_ip_block_list()
+        self.np.update_ip_ignore_list()
+        self.np.update_user_access()
         self.np.toggle_respond_distributed(None, settings=True)
 
         if self.search_notebook:
@@ -2970,6 +2987,8 @@ class NicotineFrame:
         if self.np.transfers is not None:
             self.np.transfers.save_downloads()
 
+        self.np.save_peer_addresses()
+
         # Cleaning up the trayicon
         if self.tray_app.trayicon:
             self.tray_app.destroy_trayicon()
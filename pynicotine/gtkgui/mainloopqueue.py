@@ -0,0 +1,69 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The core and the widgets are only touched from the GTK main loop, which owns
+them. Other threads, such as the network thread, hand their work to the main
+loop through a MainLoopQueue, which runs it in order and in batches.
+"""
+
+import threading
+
+from collections import deque
+
+from gettext import gettext as _
+
+from gi.repository import GLib
+
+from pynicotine.logfacility import log
+
+
+class MainLoopQueue:
+    """ A queue of calls made from other threads. All calls queued since the
+    last time the main loop got to them run in a single idle callback. """
+
+    def __init__(self):
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def add(self, func, args, kwargs):
+
+        with self._lock:
+            self._pending.append((func, args, kwargs))
+
+            if not self._scheduled:
+                self._scheduled = True
+                GLib.idle_add(self._flush)
+
+    def _flush(self):
+
+        with self._lock:
+            pending = self._pending
+            self._pending = deque()
+            self._scheduled = False
+
+        for func, args, kwargs in pending:
+            try:
+                func(*args, **kwargs)
+            except Exception as error:
+                # Don't let a broken handler drop the rest of the batch
+                log.add_warning(_("Exception in callback %s: %s"), (func, error))
+
+        return False
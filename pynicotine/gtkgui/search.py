@@ -302,6 +302,7 @@ class Searches(IconNotebook):
         if counter > self.maxstoredresults:
             # Ignore tab
             search[5] = True
+            self.frame.np.queue.put(slskmessages.DropSearchResults(search[0]))
             return
 
         search[2].add_user_results(msg, username, country)
@@ -1315,6 +1316,7 @@ class Search:
     def on_ignore(self, widget):
 
         self.searches.searches[self.id][5] = True  # ignored
+        self.frame.np.queue.put(slskmessages.DropSearchResults(self.id))
 
         self.searches.wish_list.remove_wish(self.text)
         widget.set_sensitive(False)
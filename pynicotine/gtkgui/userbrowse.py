@@ -80,7 +80,7 @@ class UserBrowse:
         self.search_position = 0
         self.selected_files = []
 
-        self.shares = []
+        self.shares = {}
 
         # Iters for current DirStore
         self.directories = {}
@@ -362,9 +362,9 @@ class UserBrowse:
 
         return True
 
-    def make_new_model(self, list):
+    def make_new_model(self, shares):
 
-        self.shares = list
+        self.shares = shares
         self.selected_folder = None
         self.selected_files = []
         self.directories.clear()
@@ -372,11 +372,15 @@ class UserBrowse:
         self.dir_store.clear()
 
         # Compute the number of shared dirs and total size
-        self.totalsize = 0
-        for dir, files in self.shares:
-            for filedata in files:
-                if filedata[2] < maxsize:
-                    self.totalsize += filedata[2]
+        if isinstance(self.shares, slskmessages.FileListIndex):
+            # Already summed up when the file list was received
+            self.totalsize = self.shares.totalsize
+        else:
+            self.totalsize = 0
+            for files in self.shares.values():
+                for filedata in files:
+                    if filedata[2] < maxsize:
+                        self.totalsize += filedata[2]
 
         self.AmountShared.set_text(_("Shared: %s") % human_size(self.totalsize))
         self.NumDirectories.set_text(_("Dirs: %s") % len(self.shares))
@@ -407,7 +411,7 @@ class UserBrowse:
 
         # If there is no share
 
-        if self.shares == []:
+        if not self.shares:
 
             # Set the model of the treeviex
             self.FolderTreeView.set_model(self.dir_store)
@@ -461,7 +465,7 @@ class UserBrowse:
         # For each shared dir we will complete the dictionnary
         dictdir = {}
 
-        for dirshares, f in self.shares:
+        for dirshares in self.shares:
 
             # Split the path
             s = dirshares.split(dirseparator)
@@ -492,15 +496,9 @@ class UserBrowse:
         self.file_store.clear()
         self.files.clear()
 
-        found_dir = False
+        files = self.shares.get(directory)
 
-        for d, f in self.shares:
-            if d == directory:
-                found_dir = True
-                files = f
-                break
-
-        if not found_dir:
+        if files is None:
             return
 
         for file in files:
@@ -541,7 +539,7 @@ class UserBrowse:
             import pickle as mypickle
             import bz2
             sharesfile = bz2.BZ2File(os.path.join(sharesdir, clean_file(self.user)), 'w')
-            mypickle.dump(self.shares, sharesfile, protocol=mypickle.HIGHEST_PROTOCOL)
+            mypickle.dump(list(self.shares.items()), sharesfile, protocol=mypickle.HIGHEST_PROTOCOL)
             sharesfile.close()
             log.add(_("Saved list of shared files for user '%(user)s' to %(dir)s"), {'user': self.user, 'dir': sharesdir})
 
@@ -565,7 +563,7 @@ class UserBrowse:
         self.make_new_model(msg.list)
 
     def load_shares(self, list):
-        self.make_new_model(list)
+        self.make_new_model(dict(list))
 
     def update_gauge(self, msg):
 
@@ -661,11 +659,10 @@ class UserBrowse:
         # Check if folder already exists on system
         ldir = self.frame.np.transfers.folder_destination(self.user, ldir)
 
-        for d, f in self.shares:
+        # Find the wanted directory
+        f = self.shares.get(folder)
 
-            # Find the wanted directory
-            if d != folder:
-                continue
+        if f is not None:
 
             priorityfiles = []
             normalfiles = []
@@ -707,7 +704,7 @@ class UserBrowse:
         if not recurse:
             return
 
-        for subdir, subf in self.shares:
+        for subdir in self.shares:
             if dir in subdir and dir != subdir:
                 self.download_directory(subdir, os.path.join(ldir, ""))
 
@@ -715,27 +712,19 @@ class UserBrowse:
 
         folder = self.selected_folder
 
-        for d, f in self.shares:
+        # Find the wanted directory
+        for file in self.shares.get(folder, []):
 
-            # Find the wanted directory
-            if d != folder:
+            # Find the wanted file
+            if file[1] not in self.selected_files:
                 continue
 
-            for file in f:
-
-                # Find the wanted file
-                if file[1] not in self.selected_files:
-                    continue
-
-                path = "\\".join([folder, file[1]])
-                size = file[2]
-                h_bitrate, bitrate, h_length = get_result_bitrate_length(size, file[4])
-
-                # Get the file
-                self.frame.np.transfers.get_file(self.user, path, prefix, size=size, bitrate=h_bitrate, length=h_length, checkduplicate=True)
+            path = "\\".join([folder, file[1]])
+            size = file[2]
+            h_bitrate, bitrate, h_length = get_result_bitrate_length(size, file[4])
 
-            # We have found the wanted directory: we can break out of the loop
-            break
+            # Get the file
+            self.frame.np.transfers.get_file(self.user, path, prefix, size=size, bitrate=h_bitrate, length=h_length, checkduplicate=True)
 
     def on_download_files_to(self, widget):
 
@@ -796,23 +785,18 @@ class UserBrowse:
         realpath = self.frame.np.shares.virtual2real(folder)
         ldir = folder.split("\\")[-1]
 
-        for d, f in self.shares:
-
-            # Find the wanted directory
-            if d != folder:
-                continue
-
-            for file in f:
-                filename = "\\".join([folder, file[1]])
-                realfilename = "\\".join([realpath, file[1]])
-                size = file[2]
-                self.frame.np.transfers.push_file(user, filename, realfilename, ldir, size=size)
-                self.frame.np.transfers.check_upload_queue()
+        # Find the wanted directory
+        for file in self.shares.get(folder, []):
+            filename = "\\".join([folder, file[1]])
+            realfilename = "\\".join([realpath, file[1]])
+            size = file[2]
+            self.frame.np.transfers.push_file(user, filename, realfilename, ldir, size=size)
+            self.frame.np.transfers.check_upload_queue()
 
         if not recurse:
             return
 
-        for subdir, subf in self.shares:
+        for subdir in self.shares:
             if folder in subdir and folder != subdir:
                 self.upload_directory_to(user, subdir, recurse)
 
@@ -863,7 +847,7 @@ class UserBrowse:
 
         self.search_list = []
 
-        for directory, files in self.shares:
+        for directory, files in self.shares.items():
 
             if self.query in directory.lower():
                 if directory not in self.search_list:
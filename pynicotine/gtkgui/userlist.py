@@ -471,6 +471,7 @@ class UserList:
 
         self.frame.np.config.sections["server"]["userlist"] = user_list
         self.frame.np.config.write_configuration()
+        self.frame.np.update_user_access()
 
     def save_columns(self):
 
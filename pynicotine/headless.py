@@ -0,0 +1,238 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module runs the Nicotine+ core (network, shares, transfers and plugins)
+without GTK. Network events are dispatched from a plain queue in the main
+thread instead of the GLib main loop, and the parts of the core that only
+exist to update widgets are left out.
+"""
+
+import queue
+import signal
+
+from gettext import gettext as _
+
+from pynicotine import slskmessages
+from pynicotine.logfacility import log
+from pynicotine.pynicotine import NetworkEventProcessor
+
+
+class HeadlessTransferView:
+    """ Stands in for the download and upload views, which Transfers
+    updates unconditionally """
+
+    def __init__(self, np):
+        self.np = np
+
+    def update(self, transfer=None, forceupdate=False):
+        pass
+
+    def remove_specific(self, transfer, cleartreeviewonly=False):
+        pass
+
+    def clear_by_user(self, user):
+        pass
+
+    def new_transfer_notification(self):
+        pass
+
+    def download_large_folder(self, username, folder, numfiles, conn, file_list):
+        # Nobody is around to confirm, download the folder right away
+        self.np.transfers.folder_contents_response(conn, file_list)
+
+
+class HeadlessApp:
+    """ Acts as the UI callback and plugin frame of the core when running
+    without a GUI """
+
+    # Seconds to wait for network events before checking if we should quit
+    POLL_INTERVAL = 1
+
+    def __init__(self, data_dir, config, plugins, bindip=None, port=None):
+
+        self.away = 0
+        self.notifications = None
+        self.privatechats = None
+        self.chatrooms = None
+        self.running = False
+        self.events = queue.Queue(0)
+
+        self.np = NetworkEventProcessor(
+            self,
+            self.network_callback,
+            self.set_status_text,
+            bindip,
+            port,
+            data_dir,
+            config,
+            plugins
+        )
+
+        self.transferview = HeadlessTransferView(self.np)
+
+    """ Event Loop """
+
+    def network_callback(self, msgs):
+        if len(msgs) > 0:
+            self.events.put(msgs)
+
+    def on_network_event(self, msgs):
+        for i in msgs:
+            if i.__class__ in self.np.events:
+                self.np.events[i.__class__](i)
+            else:
+                log.add("No handler for class %s %s", (i.__class__, dir(i)))
+
+    def on_signal(self, signum, frame):
+        self.running = False
+
+    def run(self, argv=None):
+
+        config = self.np.config.sections
+
+        if not config["server"]["login"]:
+            log.add(_("No username is configured, please set one up in the configuration file first"))
+            return
+
+        signal.signal(signal.SIGINT, self.on_signal)
+        signal.signal(signal.SIGTERM, self.on_signal)
+
+        if config["transfers"]["rescanonstartup"]:
+
+            if not config["transfers"]["friendsonly"] and config["transfers"]["shared"]:
+                log.add(_("Rescanning started"))
+                self.np.shares.rescan_shares()
+
+            if config["transfers"]["enablebuddyshares"]:
+                log.add(_("Rescanning Buddy Shares started"))
+                self.np.shares.rescan_buddy_shares()
+
+        self.running = True
+        self.on_connect(None)
+
+        while self.running:
+            try:
+                msgs = self.events.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+
+            self.on_network_event(msgs)
+
+        self.quit()
+
+    def quit(self):
+
+        log.add(_("Quitting Nicotine+"))
+
+        self.np.protothread.abort()
+        self.np.stop_timers()
+
+        if self.np.transfers is not None:
+            self.np.transfers.save_downloads()
+
+        self.np.save_peer_addresses()
+
+        self.np.config.write_configuration()
+
+    """ Network Callbacks """
+
+    def on_connect(self, widget):
+
+        if self.np.active_server_conn is not None:
+            return
+
+        server = self.np.config.sections["server"]["server"]
+        self.set_status_text(_("Connecting to %(host)s:%(port)s"), {'host': server[0], 'port': server[1]})
+        self.np.queue.put(slskmessages.ServerConn(None, server))
+
+        if self.np.servertimer is not None:
+            self.np.servertimer.cancel()
+            self.np.servertimer = None
+
+    def init_interface(self, msg):
+        return None, None, None, None, None, self.transferview, self.transferview, None
+
+    def conn_close(self, conn, addr):
+        pass
+
+    def connect_error(self, conn):
+        pass
+
+    def popup_message(self, popup):
+        log.add("%s: %s", (popup.title, popup.message))
+
+    def set_status_text(self, msg, msg_args=None, should_log=True):
+        if msg and should_log:
+            log.add(msg, msg_args)
+
+    def set_socket_status(self, status):
+        pass
+
+    def get_user_status(self, msg):
+        pass
+
+    def get_user_stats(self, msg):
+        pass
+
+    def has_user_flag(self, user, flag):
+        pass
+
+    def on_block_user(self, user):
+        pass
+
+    def on_un_block_user(self, user):
+        pass
+
+    def on_ignore_user(self, user):
+        pass
+
+    def on_un_ignore_user(self, user):
+        pass
+
+    def global_recommendations(self, msg):
+        pass
+
+    def recommendations(self, msg):
+        pass
+
+    def item_recommendations(self, msg):
+        pass
+
+    def similar_users(self, msg):
+        pass
+
+    def user_ip_is_ignored(self, user):
+        for ip, username in self.np.config.sections["server"]["ipignorelist"].items():
+            if user == username:
+                return True
+        return False
+
+    """ Scanning """
+
+    def set_scan_progress(self, sharestype, value):
+        pass
+
+    def show_scan_progress(self, sharestype):
+        pass
+
+    def hide_scan_progress(self, sharestype):
+        pass
+
+    def rescan_finished(self, sharestype):
+        log.add(_("Rescanning finished"))
@@ -42,11 +42,18 @@ class Logger(object):
         4    - Message Contents
         5    - Transfers
         6    - Connection, Bandwidth and Usage Statistics
+
+        msg_args can also be a function returning the arguments, for
+        arguments that are expensive to build. It is only called if the
+        message is logged.
         """
 
         if level not in self.log_levels:
             return
 
+        if callable(msg_args):
+            msg_args = msg_args()
+
         if msg_args:
             msg = msg % msg_args
 
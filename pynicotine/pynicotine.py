@@ -34,8 +34,8 @@ import datetime
 import os
 import queue
 import shutil
-import threading
 import time
+from collections import OrderedDict
 from gettext import gettext as _
 from socket import socket
 
@@ -46,8 +46,10 @@ from pynicotine.config import Config
 from pynicotine.geoip.ip2location import IP2Location
 from pynicotine.logfacility import log
 from pynicotine.pluginsystem import PluginHandler
+from pynicotine.scheduler import scheduler
 from pynicotine.shares import Shares
 from pynicotine.slskmessages import new_id
+from pynicotine.utils import IPAddressList
 from pynicotine.utils import clean_file
 from pynicotine.utils import unescape
 
@@ -58,12 +60,15 @@ class PeerConnection:
     to something. addr is (ip, port) address, conn is a socket object, msgs is
     a list of outgoing pending messages, token is a reverse-handshake
     number (protocol feature), init is a PeerInit protocol message. (read
-    slskmessages docstrings for explanation of these)
+    slskmessages docstrings for explanation of these) guessed is True if addr
+    is an address saved in an earlier session, which the server didn't confirm.
+    replies holds the replies received on a guessed connection until it does.
     """
 
-    __slots__ = "addr", "username", "conn", "msgs", "token", "init", "type", "conntimer", "tryaddr"
+    __slots__ = "addr", "username", "conn", "msgs", "token", "init", "type", "conntimer", "tryaddr", "guessed", \
+                "replies"
 
-    def __init__(self, addr=None, username=None, conn=None, msgs=None, token=None, init=None, conntimer=None, tryaddr=None):
+    def __init__(self, addr=None, username=None, conn=None, msgs=None, token=None, init=None, conntimer=None, tryaddr=None, guessed=False):
         self.addr = addr
         self.username = username
         self.conn = conn
@@ -73,6 +78,119 @@ class PeerConnection:
         self.type = init.type
         self.conntimer = conntimer
         self.tryaddr = tryaddr
+        self.guessed = guessed
+        self.replies = None
+
+
+class PeerConnections:
+    """
+    The PeerConnection objects we know of, in the order they were added. They
+    are indexed by socket, username, token, address and type, to find the
+    connection a message belongs to without going through all of them.
+    Indexed attributes of a PeerConnection must be changed through set_conn,
+    set_token and set_addr, to keep the indexes up to date.
+    """
+
+    __slots__ = "_conns", "_indexes"
+
+    INDEXED_ATTRIBUTES = ("conn", "username", "token", "addr", "type")
+
+    def __init__(self):
+        self._conns = OrderedDict()
+        self._indexes = {attribute: {} for attribute in self.INDEXED_ATTRIBUTES}
+
+    def __iter__(self):
+        # Iterate over a copy, connections are often removed while iterating
+        return iter(list(self._conns))
+
+    def __len__(self):
+        return len(self._conns)
+
+    def __contains__(self, peerconn):
+        return peerconn in self._conns
+
+    def _add_to_index(self, attribute, peerconn):
+
+        value = getattr(peerconn, attribute)
+
+        if value is not None:
+            self._indexes[attribute].setdefault(value, []).append(peerconn)
+
+    def _remove_from_index(self, attribute, peerconn):
+
+        value = getattr(peerconn, attribute)
+
+        if value is None:
+            return
+
+        index = self._indexes[attribute]
+        peerconns = index[value]
+        peerconns.remove(peerconn)
+
+        if not peerconns:
+            del index[value]
+
+    def _find(self, attribute, value):
+        return tuple(self._indexes[attribute].get(value, ()))
+
+    def _set(self, peerconn, attribute, value):
+
+        if peerconn not in self._conns:
+            setattr(peerconn, attribute, value)
+            return
+
+        self._remove_from_index(attribute, peerconn)
+        setattr(peerconn, attribute, value)
+        self._add_to_index(attribute, peerconn)
+
+    def append(self, peerconn):
+
+        self._conns[peerconn] = None
+
+        for attribute in self.INDEXED_ATTRIBUTES:
+            self._add_to_index(attribute, peerconn)
+
+    def remove(self, peerconn):
+
+        if peerconn not in self._conns:
+            raise ValueError("PeerConnections.remove(x): x not in list")
+
+        del self._conns[peerconn]
+
+        for attribute in self.INDEXED_ATTRIBUTES:
+            self._remove_from_index(attribute, peerconn)
+
+    def set_conn(self, peerconn, conn):
+        self._set(peerconn, "conn", conn)
+
+    def set_token(self, peerconn, token):
+        self._set(peerconn, "token", token)
+
+    def set_addr(self, peerconn, addr):
+        self._set(peerconn, "addr", addr)
+
+    def get_username(self, conn):
+        """ Returns the username of the peer connected through socket conn, or None """
+
+        for peerconn in self._find("conn", conn):
+            return peerconn.username
+
+        return None
+
+    def by_conn(self, conn):
+        return self._find("conn", conn)
+
+    def by_username(self, username):
+        return self._find("username", username)
+
+    def by_token(self, token):
+        return self._find("token", token)
+
+    def by_addr(self, addr):
+        return self._find("addr", addr)
+
+    def by_type(self, type):
+        return self._find("type", type)
 
 
 class Timeout:
@@ -102,9 +220,115 @@ class RespondToDistributedSearchesTimeout(Timeout):
     pass
 
 
+class DownloadQueueTimeout(Timeout):
+    pass
+
+
+class RequestAdmission:
+    """
+    Admission control for peer requests that are expensive to answer. Each
+    user gets a token bucket per request type, sized by the "requestlimits"
+    setting: a request type maps to (number of requests, per number of
+    seconds). Requests that find their bucket empty are turned away and
+    counted per request type, and per user over the last REJECTION_PERIOD
+    seconds.
+    """
+
+    __slots__ = "config", "buckets", "rejected_users", "rejected_types"
+
+    # Number of buckets at which we forget the ones that are full again
+    MAX_BUCKETS = 2000
+
+    # Seconds after which the rejected requests of a user are forgotten
+    REJECTION_PERIOD = 3600
+
+    def __init__(self, config):
+        self.config = config
+        self.buckets = {}
+        self.rejected_users = {}
+        self.rejected_types = {}
+
+    def admit(self, user, request_type):
+        """ Returns True if a request of request_type (a message class name)
+        from user may be processed """
+
+        limit = self.config.sections["transfers"]["requestlimits"].get(request_type)
+
+        if not limit:
+            return True
+
+        count, period = limit
+        curtime = time.monotonic()
+        key = (user, request_type)
+        bucket = self.buckets.get(key)
+
+        if bucket is None or bucket.capacity != count or bucket.rate != count / period:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                self.prune(curtime)
+
+            bucket = self.buckets[key] = slskproto.TokenBucket(count / period, capacity=count)
+            bucket.lastrefill = curtime
+
+        if bucket.get_tokens(curtime) >= 1:
+            bucket.consume(1)
+            return True
+
+        rejected, since = self.rejected_users.get(user, (0, curtime))
+
+        if curtime - since >= self.REJECTION_PERIOD:
+            rejected, since = 0, curtime
+
+        elif not rejected and len(self.rejected_users) >= self.MAX_BUCKETS:
+            self.prune(curtime)
+
+        self.rejected_users[user] = (rejected + 1, since)
+        self.rejected_types[request_type] = self.rejected_types.get(request_type, 0) + 1
+        return False
+
+    def recent_rejections(self, user):
+        """ Returns the number of requests from user turned away in the
+        current rejection period """
+
+        rejected, since = self.rejected_users.get(user, (0, 0))
+
+        if time.monotonic() - since >= self.REJECTION_PERIOD:
+            return 0
+
+        return rejected
+
+    def prune(self, curtime):
+        """ Drops buckets that refilled completely, they are no different
+        from new ones, and rejection counts of past periods """
+
+        for key, bucket in list(self.buckets.items()):
+            if bucket.get_tokens(curtime) >= bucket.capacity:
+                del self.buckets[key]
+
+        for user, (rejected, since) in list(self.rejected_users.items()):
+            if curtime - since >= self.REJECTION_PERIOD:
+                del self.rejected_users[user]
+
+
 class NetworkEventProcessor:
     """ This class contains handlers for various messages from the networking thread """
 
+    # Seconds to remember the result of check_user for a user and IP address
+    USER_ACCESS_TTL = 300
+
+    # Maximum number of remembered check_user results
+    USER_ACCESS_MAX = 5000
+
+    # Seconds to keep using a saved peer address after the server last confirmed it
+    PEER_ADDRESS_TTL = 3600
+
+    # Requests that may be sent to a saved peer address before the server
+    # confirms it. Whoever holds the address now gets them, so they must not
+    # start transfers or reveal anything only the user should see.
+    SAVED_ADDRESS_REQUESTS = (slskmessages.UserInfoRequest, slskmessages.GetSharedFileList)
+
+    # Maximum number of peer addresses saved between sessions
+    PEER_ADDRESS_MAX = 1000
+
     def __init__(self, ui_callback, network_callback, setstatus, bindip, port, data_dir, config, plugins):
 
         self.ui_callback = ui_callback
@@ -132,7 +356,7 @@ class NetworkEventProcessor:
         self.config.read_config()
         log.set_log_levels(self.config.sections["logging"]["debugmodes"])
 
-        self.peerconns = []
+        self.peerconns = PeerConnections()
         self.watchedusers = []
         self.ipblock_requested = {}
         self.ipignore_requested = {}
@@ -140,6 +364,8 @@ class NetworkEventProcessor:
         self.private_message_queue = {}
         self.users = {}
         self.user_addr_requested = set()
+        self.peer_addresses = self.config.read_peer_addresses()
+        self.user_info = None
         self.queue = queue.Queue(0)
         self.shares = Shares(self, self.config, self.queue, self.ui_callback)
         self.pluginhandler = PluginHandler(self.ui_callback, plugins, self.config)
@@ -159,6 +385,7 @@ class NetworkEventProcessor:
 
         self.queue.put(slskmessages.SetUploadLimit(uselimit, uploadlimit, limitby))
         self.queue.put(slskmessages.SetDownloadLimit(self.config.sections["transfers"]["downloadlimit"]))
+        self.queue.put(slskmessages.SetPeerPoolSize(self.config.sections["server"]["peerpoolsize"]))
 
         if self.config.sections["transfers"]["geoblock"]:
             panic = self.config.sections["transfers"]["geopanic"]
@@ -167,6 +394,11 @@ class NetworkEventProcessor:
         else:
             self.queue.put(slskmessages.SetGeoBlock(None))
 
+        self.user_access = {}
+        self.update_ip_block_list()
+        self.update_ip_ignore_list()
+        self.update_user_access()
+
         self.active_server_conn = None
         self.waitport = None
         self.chatrooms = None
@@ -184,15 +416,14 @@ class NetworkEventProcessor:
 
         self.has_parent = False
 
-        self.requested_info = {}
+        self.request_admission = RequestAdmission(self.config)
         self.requested_folders = {}
         self.speed = 0
 
         self.respond_distributed = True
         responddistributedtimeout = RespondToDistributedSearchesTimeout(self.network_callback)
-        self.respond_distributed_timer = threading.Timer(60, responddistributedtimeout.timeout)
-        self.respond_distributed_timer.setDaemon(True)
-        self.respond_distributed_timer.start()
+        self.respond_distributed_timer = scheduler.schedule(60, responddistributedtimeout.timeout)
+        self.download_queue_timer = None
 
         # Callback handlers for messages
         self.events = {
@@ -277,6 +508,7 @@ class NetworkEventProcessor:
             ConnectToPeerTimeout: self.connect_to_peer_timeout,
             RespondToDistributedSearchesTimeout: self.toggle_respond_distributed,
             transfers.TransferTimeout: self.transfer_timeout,
+            DownloadQueueTimeout: self.download_queue_timeout,
             str: self.notify,
             slskmessages.PopupMessage: self.popup_message,
             slskmessages.SetCurrentConnectionCount: self.set_current_connection_count,
@@ -309,6 +541,44 @@ class NetworkEventProcessor:
             slskmessages.UnknownPeerMessage: self.dummy_message,
         }
 
+        for msgclass in (slskmessages.UserInfoRequest, slskmessages.GetSharedFileList, slskmessages.FolderContentsRequest,
+                         slskmessages.FileSearchRequest, slskmessages.PlaceInQueueRequest):
+            self.events[msgclass] = self.admit_request(self.events[msgclass])
+
+    def admit_request(self, handler):
+        """ Puts admission control in front of the handler of an expensive
+        peer request """
+
+        def admitted_handler(msg):
+            user = self.peerconns.get_username(msg.conn.conn)
+
+            if user is not None and not self.request_admission.admit(user, msg.__class__.__name__):
+                self.reject_request(user, msg)
+                return
+
+            handler(msg)
+
+        return admitted_handler
+
+    def reject_request(self, user, msg):
+
+        request_type = msg.__class__.__name__
+
+        log.add_conn(_("Ignoring %(type)s from %(user)s, too many requests (%(num)i ignored in total)"), {
+            'type': request_type,
+            'user': user,
+            'num': self.request_admission.rejected_types[request_type]
+        })
+
+        if not self.config.sections["transfers"]["requestautoban"] or user in self.banned_users:
+            return
+
+        if self.request_admission.recent_rejections(user) >= self.config.sections["transfers"]["requestbanlimit"]:
+            log.add(_("Banning %s for making too many requests"), user)
+
+            if self.transfers is not None:
+                self.transfers.ban_user(user)
+
     def process_request_to_peer(self, user, message, window=None, address=None):
         """
         Sends message to a peer and possibly sets up a window to display
@@ -318,8 +588,8 @@ class NetworkEventProcessor:
         conn = None
 
         if message.__class__ is not slskmessages.FileRequest:
-            for i in self.peerconns:
-                if i.username == user and i.type == 'P':
+            for i in self.peerconns.by_username(user):
+                if i.type == 'P' and (not i.guessed or message.__class__ in self.SAVED_ADDRESS_REQUESTS):
                     conn = i
                     break
 
@@ -351,6 +621,7 @@ class NetworkEventProcessor:
             addr = None
             behindfw = None
             token = None
+            guessed = False
 
             if user in self.users:
                 addr = self.users[user].addr
@@ -359,13 +630,22 @@ class NetworkEventProcessor:
                 self.users[user] = UserAddr(status=-1, addr=address)
                 addr = address
 
+            if firewalled and addr is None and message.__class__ in self.SAVED_ADDRESS_REQUESTS:
+                # Try the address we saved in an earlier session right away,
+                # we only ask the server for it if connecting fails
+                saved = self.get_saved_peer_address(user)
+
+                if saved is not None:
+                    addr, behindfw = saved
+                    guessed = behindfw is None
+
             if firewalled:
                 if addr is None:
                     if user not in self.user_addr_requested:
                         self.queue.put(slskmessages.GetPeerAddress(user))
                         self.user_addr_requested.add(user)
                 elif behindfw is None:
-                    self.queue.put(slskmessages.OutConn(None, addr))
+                    self.queue.put(slskmessages.OutConn(None, addr, init))
                 else:
                     firewalled = 0
 
@@ -373,16 +653,13 @@ class NetworkEventProcessor:
                 token = new_id()
                 self.queue.put(slskmessages.ConnectToPeer(token, user, message_type))
 
-            conn = PeerConnection(addr=addr, username=user, msgs=[message], token=token, init=init)
+            conn = PeerConnection(addr=addr, username=user, msgs=[message], token=token, init=init, guessed=guessed)
             self.peerconns.append(conn)
 
             if token is not None:
                 timeout = 120.0
-                conntimeout = ConnectToPeerTimeout(self.peerconns[-1], self.network_callback)
-                timer = threading.Timer(timeout, conntimeout.timeout)
-                timer.setDaemon(True)
-                self.peerconns[-1].conntimer = timer
-                timer.start()
+                conntimeout = ConnectToPeerTimeout(conn, self.network_callback)
+                conn.conntimer = scheduler.schedule(timeout, conntimeout.timeout)
 
         if message.__class__ is slskmessages.TransferRequest and self.transfers is not None:
 
@@ -400,9 +677,7 @@ class NetworkEventProcessor:
         elif 0 < self.server_timeout_value < 600:
             self.server_timeout_value = self.server_timeout_value * 2
 
-        self.servertimer = threading.Timer(self.server_timeout_value, self.server_timeout)
-        self.servertimer.setDaemon(True)
-        self.servertimer.start()
+        self.servertimer = scheduler.schedule(self.server_timeout_value, self.server_timeout)
 
         self.set_status(_("The server seems to be down or not responding, retrying in %i seconds"), (self.server_timeout_value))
 
@@ -422,9 +697,20 @@ class NetworkEventProcessor:
         if self.respond_distributed_timer is not None:
             self.respond_distributed_timer.cancel()
 
+        if self.download_queue_timer is not None:
+            self.download_queue_timer.cancel()
+
         if self.transfers is not None:
             self.transfers.abort_transfers()
 
+    def start_download_queue_timer(self):
+
+        if self.download_queue_timer is not None:
+            self.download_queue_timer.cancel()
+
+        downloadqueuetimeout = DownloadQueueTimeout(self.network_callback)
+        self.download_queue_timer = scheduler.schedule(60.0, downloadqueuetimeout.timeout)
+
     def connect_to_server(self, msg):
         self.ui_callback.on_connect(None)
 
@@ -441,12 +727,17 @@ class NetworkEventProcessor:
         except AttributeError:
             return vars(obj)
 
+    def log_contents(self, msg):
+        """ Logs the variables of a message. They are only collected when
+        message contents are being logged, which is rarely the case """
+        log.add_msg_contents("%s %s", lambda: (msg.__class__, self.contents(msg)))
+
     def popup_message(self, msg):
         self.set_status(_(msg.title))
         self.ui_callback.popup_message(msg)
 
     def dummy_message(self, msg):
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def set_current_connection_count(self, msg):
         self.ui_callback.set_socket_status(msg.msg)
@@ -474,26 +765,29 @@ class NetworkEventProcessor:
 
             addr = msg.connobj.addr
 
-            for i in self.peerconns:
+            for i in self.peerconns.by_addr(addr):
 
-                if i.addr == addr and i.conn is None:
+                if i.conn is None:
 
-                    if i.token is None:
+                    if i.token is None and i.guessed:
+                        self.retry_peer_address(i.username, addr)
 
-                        i.token = new_id()
+                    elif i.token is None:
+
+                        self.peerconns.set_token(i, new_id())
                         self.queue.put(slskmessages.ConnectToPeer(i.token, i.username, i.type))
 
                         if i.username in self.users:
                             self.users[i.username].behindfw = "yes"
 
+                        self.remember_peer_address(i.username, addr, "yes")
+
                         for j in i.msgs:
                             if j.__class__ is slskmessages.TransferRequest and self.transfers is not None:
                                 self.transfers.got_connect_error(j.req, j.direction)
 
                         conntimeout = ConnectToPeerTimeout(i, self.network_callback)
-                        timer = threading.Timer(120.0, conntimeout.timeout)
-                        timer.setDaemon(True)
-                        timer.start()
+                        timer = scheduler.schedule(120.0, conntimeout.timeout)
 
                         if i.conntimer is not None:
                             i.conntimer.cancel()
@@ -515,10 +809,10 @@ class NetworkEventProcessor:
 
                     break
             else:
-                log.add_msg_contents("%s %s %s", (msg.err, msg.__class__, self.contents(msg)))
+                log.add_msg_contents("%s %s %s", lambda: (msg.err, msg.__class__, self.contents(msg)))
 
         else:
-            log.add_msg_contents("%s %s %s", (msg.err, msg.__class__, self.contents(msg)))
+            log.add_msg_contents("%s %s %s", lambda: (msg.err, msg.__class__, self.contents(msg)))
 
             self.closed_connection(msg.connobj.conn, msg.connobj.addr, msg.err)
 
@@ -560,6 +854,7 @@ class NetworkEventProcessor:
             self.queue.put(slskmessages.SetWaitPort(self.waitport))
 
     def peer_init(self, msg):
+        self.forget_other_peer_addresses(msg.user, msg.conn.addr)
         self.peerconns.append(
             PeerConnection(
                 addr=msg.conn.addr,
@@ -596,6 +891,9 @@ class NetworkEventProcessor:
             self.active_server_conn = None
             self.watchedusers = []
 
+            if self.download_queue_timer is not None:
+                self.download_queue_timer.cancel()
+
             if self.transfers is not None:
                 self.transfers.abort_transfers()
                 self.transfers.save_downloads()
@@ -605,21 +903,20 @@ class NetworkEventProcessor:
             self.pluginhandler.server_disconnect_notification(userchoice)
 
         else:
-            for i in self.peerconns:
-                if i.conn == conn:
-                    log.add_conn(self.conn_close_template, self.contents(i))
+            for i in self.peerconns.by_conn(conn):
+                log.add_conn(self.conn_close_template, lambda: self.contents(i))
 
-                    if i.conntimer is not None:
-                        i.conntimer.cancel()
+                if i.conntimer is not None:
+                    i.conntimer.cancel()
 
-                    if self.transfers is not None:
-                        self.transfers.conn_close(conn, addr, i.username, error)
+                if self.transfers is not None:
+                    self.transfers.conn_close(conn, addr, i.username, error)
 
-                    if i == self.get_parent_conn():
-                        self.parent_conn_closed()
+                if i == self.get_parent_conn():
+                    self.parent_conn_closed()
 
-                    self.peerconns.remove(i)
-                    break
+                self.peerconns.remove(i)
+                break
             else:
                 log.add_conn(
                     self.conn_remove_template, {
@@ -635,6 +932,9 @@ class NetworkEventProcessor:
             self.transfers = transfers.Transfers(self.peerconns, self.queue, self, self.users,
                                                  self.network_callback, self.ui_callback.notifications, self.pluginhandler)
 
+            # Check for failed downloads every minute
+            self.start_download_queue_timer()
+
             if msg.ip is not None:
                 self.ipaddress = msg.ip
 
@@ -657,7 +957,10 @@ class NetworkEventProcessor:
             self.queue.put(slskmessages.AcceptChildren(0))
 
             self.queue.put(slskmessages.NotifyPrivileges(1, self.config.sections["server"]["login"]))
-            self.privatechat.login()
+
+            if self.privatechat is not None:
+                self.privatechat.login()
+
             self.queue.put(slskmessages.CheckPrivileges())
             self.queue.put(slskmessages.PrivateRoomToggle(self.config.sections["server"]["private_chatrooms"]))
         else:
@@ -675,7 +978,7 @@ class NetworkEventProcessor:
         if msg.token is not None:
             pass
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def user_privileged(self, msg):
         if self.transfers is not None:
@@ -688,18 +991,12 @@ class NetworkEventProcessor:
             # Until I know the syntax, sending this message is probably a bad idea
             self.queue.put(slskmessages.AckNotifyPrivileges(msg.token))
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def p_message_user(self, msg):
 
-        conn = msg.conn.conn
-        user = None
-
         # Get peer's username
-        for i in self.peerconns:
-            if i.conn is conn:
-                user = i.username
-                break
+        user = self.peerconns.get_username(msg.conn.conn)
 
         if user is None:
             # No peer connection
@@ -714,7 +1011,7 @@ class NetworkEventProcessor:
         if self.privatechat is not None:
             self.privatechat.show_message(msg, text, status=0)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def message_user(self, msg):
 
@@ -730,14 +1027,14 @@ class NetworkEventProcessor:
 
             self.queue.put(slskmessages.MessageAcked(msg.msgid))
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def user_joined_room(self, msg):
 
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.user_joined_room(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def public_room_message(self, msg):
 
@@ -745,7 +1042,7 @@ class NetworkEventProcessor:
             self.chatrooms.roomsctrl.public_room_message(msg, msg.msg)
             self.pluginhandler.public_room_message_notification(msg.room, msg.user, msg.msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def join_room(self, msg):
 
@@ -753,73 +1050,73 @@ class NetworkEventProcessor:
 
             self.chatrooms.roomsctrl.join_room(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_users(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_users(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_owned(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_owned(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_add_user(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_add_user(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_remove_user(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_remove_user(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_operator_added(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_operator_added(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_operator_removed(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_operator_removed(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_add_operator(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_add_operator(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_remove_operator(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_remove_operator(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_added(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_added(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_removed(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_removed(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_disown(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.private_room_disown(msg)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def private_room_toggle(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.toggle_private_rooms(msg.enabled)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def leave_room(self, msg):
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.leave_room(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def private_message_queue_add(self, msg, text):
 
@@ -843,35 +1140,7 @@ class NetworkEventProcessor:
         if address is None:
             return True
 
-        ips = self.config.sections["server"]["ipignorelist"]
-        s_address = address.split(".")
-
-        for ip in ips:
-
-            # No Wildcard in IP
-            if "*" not in ip:
-                if address == ip:
-                    return True
-                continue
-
-            # Wildcard in IP
-            parts = ip.split(".")
-            seg = 0
-
-            for part in parts:
-                # Stop if there's no wildcard or matching string number
-                if part not in (s_address[seg], "*"):
-                    break
-
-                seg += 1
-
-                # Last time around
-                if seg == 4:
-                    # Wildcard blocked
-                    return True
-
-        # Not blocked
-        return False
+        return address in self.ipignorelist
 
     def say_chat_room(self, msg):
 
@@ -882,7 +1151,7 @@ class NetworkEventProcessor:
                 self.chatrooms.roomsctrl.say_chat_room(msg, msg.msg)
                 self.pluginhandler.incoming_public_chat_notification(msg.room, msg.user, msg.msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def add_user(self, msg):
 
@@ -901,7 +1170,7 @@ class NetworkEventProcessor:
         if msg.files is not None:
             self.get_user_stats(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def privileged_users(self, msg):
 
@@ -912,13 +1181,13 @@ class NetworkEventProcessor:
             self.queue.put(slskmessages.AddUser(self.config.sections["server"]["login"]))
             self.pluginhandler.server_connect_notification()
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def add_to_privileged(self, msg):
         if self.transfers is not None:
             self.transfers.add_to_privileged(msg.user)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def check_privileges(self, msg):
 
@@ -947,29 +1216,29 @@ class NetworkEventProcessor:
 
     def child_depth(self, msg):
         # TODO: Implement me
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def branch_level(self, msg):
         # TODO: Implement me
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def branch_root(self, msg):
         # TODO: Implement me
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def distrib_child_depth(self, msg):
         # TODO: Implement me
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def distrib_branch_root(self, msg):
         # TODO: Implement me
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def wishlist_interval(self, msg):
         if self.search is not None:
             self.search.wish_list.set_interval(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def get_user_status(self, msg):
 
@@ -988,7 +1257,7 @@ class NetworkEventProcessor:
                 if self.transfers is not None:
                     self.transfers.add_to_privileged(msg.user)
                 else:
-                    log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+                    self.log_contents(msg)
 
         self.ui_callback.get_user_status(msg)
 
@@ -1010,14 +1279,14 @@ class NetworkEventProcessor:
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.get_user_status(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def user_interests(self, msg):
 
         if self.userinfo is not None:
             self.userinfo.show_interests(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def get_user_stats(self, msg):
 
@@ -1035,7 +1304,7 @@ class NetworkEventProcessor:
         if self.userlist is not None:
             self.userlist.get_user_stats(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
         stats = {
             'avgspeed': msg.avgspeed,
@@ -1050,14 +1319,14 @@ class NetworkEventProcessor:
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.user_left_room(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def get_peer_address(self, msg):
 
         user = msg.user
 
-        for i in self.peerconns:
-            if i.username == user and i.addr is None:
+        for i in self.peerconns.by_username(user):
+            if i.addr is None:
                 if msg.port != 0 or i.tryaddr == 10:
                     if i.tryaddr == 10:
                         log.add_conn(
@@ -1076,10 +1345,10 @@ class NetworkEventProcessor:
                     if user in self.user_addr_requested:
                         self.user_addr_requested.remove(user)
 
-                    i.addr = (msg.ip, msg.port)
+                    self.peerconns.set_addr(i, (msg.ip, msg.port))
                     i.tryaddr = None
 
-                    self.queue.put(slskmessages.OutConn(None, i.addr))
+                    self.queue.put(slskmessages.OutConn(None, i.addr, i.init))
 
                     for j in i.msgs:
                         if j.__class__ is slskmessages.TransferRequest and self.transfers is not None:
@@ -1103,6 +1372,11 @@ class NetworkEventProcessor:
         else:
             self.users[user] = UserAddr(addr=(msg.ip, msg.port))
 
+        if msg.port != 0:
+            self.remember_peer_address(user, (msg.ip, msg.port), self.users[user].behindfw)
+
+        self.confirm_peer_address(user, msg.ip, msg.port)
+
         if user in self.ipblock_requested:
 
             if self.ipblock_requested[user]:
@@ -1160,9 +1434,9 @@ class NetworkEventProcessor:
 
         addr = msg.addr
 
-        for i in self.peerconns:
+        for i in self.peerconns.by_addr(addr):
 
-            if i.addr == addr and i.conn is None:
+            if i.conn is None:
                 conn = msg.conn
 
                 if i.token is None:
@@ -1171,7 +1445,17 @@ class NetworkEventProcessor:
                 else:
                     self.queue.put(slskmessages.PierceFireWall(conn, i.token))
 
-                i.conn = conn
+                self.peerconns.set_conn(i, conn)
+
+                if i.token is None and not i.guessed:
+                    # Direct connections to the address the server gave us work, keep it for later.
+                    self.remember_peer_address(i.username, addr)
+
+                elif i.guessed and i.username not in self.user_addr_requested:
+                    # Connecting to a saved address doesn't tell us who is there now,
+                    # ask the server before showing any replies
+                    self.queue.put(slskmessages.GetPeerAddress(i.username))
+                    self.user_addr_requested.add(i.username)
 
                 for j in i.msgs:
 
@@ -1193,10 +1477,10 @@ class NetworkEventProcessor:
                 i.msgs = []
                 break
 
-        log.add_conn("%s %s", (msg.__class__, self.contents(msg)))
+        log.add_conn("%s %s", lambda: (msg.__class__, self.contents(msg)))
 
     def inc_conn(self, msg):
-        log.add_conn("%s %s", (msg.__class__, self.contents(msg)))
+        log.add_conn("%s %s", lambda: (msg.__class__, self.contents(msg)))
 
     def connect_to_peer(self, msg):
         user = msg.user
@@ -1215,25 +1499,146 @@ class NetworkEventProcessor:
                 init=init
             )
         )
-        log.add_conn("%s %s", (msg.__class__, self.contents(msg)))
+        log.add_conn("%s %s", lambda: (msg.__class__, self.contents(msg)))
+
+    def remember_peer_address(self, user, addr, behindfw=None):
+        """ Saves the address of a user for connecting to them in later sessions """
+
+        self.peer_addresses[user] = (addr[0], addr[1], behindfw, time.time())
+
+    def get_saved_peer_address(self, user):
+        """ Returns the saved (ip, port) address and firewall state of a user,
+        or None if we haven't seen the user at an address recently """
+
+        try:
+            ip, port, behindfw, last_seen = self.peer_addresses[user]
+        except KeyError:
+            return None
+
+        if last_seen + self.PEER_ADDRESS_TTL < time.time():
+            del self.peer_addresses[user]
+            return None
+
+        return (ip, port), behindfw
+
+    def retry_peer_address(self, user, addr):
+        """ Called when we couldn't connect to a user at their saved address.
+        Forgets it, and asks the server for the current address of the user. """
+
+        self.peer_addresses.pop(user, None)
+
+        for i in self.peerconns.by_addr(addr):
+            if i.conn is None and i.token is None and i.username == user:
+                i.guessed = False
+                self.peerconns.set_addr(i, None)
+
+        if user not in self.user_addr_requested:
+            self.queue.put(slskmessages.GetPeerAddress(user))
+            self.user_addr_requested.add(user)
+
+    def hold_unconfirmed_reply(self, msg):
+        """ Returns True if msg arrived on a connection to a saved address the server
+        hasn't confirmed yet. Someone else may be using the address now, so the
+        reply is held until confirm_peer_address is called. """
+
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            if i.guessed:
+                if i.replies is None:
+                    i.replies = []
+
+                i.replies.append(msg)
+                return True
+
+        return False
+
+    def confirm_peer_address(self, user, ip, port):
+        """ Called when the server tells us the address of a user. Replies held on
+        connections to a saved address are shown if the address still belongs to
+        the user, otherwise they are dropped and the connection is closed. """
+
+        self.user_addr_requested.discard(user)
+
+        for i in self.peerconns.by_username(user):
+            if not i.guessed or i.conn is None:
+                continue
+
+            replies = i.replies or ()
+            i.replies = None
+
+            if port == 0 or i.addr[0] != ip:
+                log.add_conn(_("Saved address of user %(user)s belongs to someone else now, ignoring replies from it"), {
+                    'user': user
+                })
+                self.queue.put(slskmessages.ConnClose(i.conn))
+                continue
+
+            i.guessed = False
+
+            for reply in replies:
+                self.events[reply.__class__](reply)
+
+    def forget_other_peer_addresses(self, user, addr):
+        """ Called when user connects to us from addr. Addresses we saved for
+        other users at the same IP address now lead to someone else, or to a
+        shared IP address, so they are no longer used. """
+
+        if addr is None:
+            return
+
+        for saved_user, address in list(self.peer_addresses.items()):
+            if address[0] == addr[0] and saved_user != user:
+                del self.peer_addresses[saved_user]
+
+    def save_peer_addresses(self):
+        """ Writes the most recently seen peer addresses to disk. Called from
+        the thread that processes network events, which owns peer_addresses. """
+
+        addresses = sorted(self.peer_addresses.items(), key=lambda item: item[1][3], reverse=True)
+        expiry = time.time() - self.PEER_ADDRESS_TTL
+
+        self.config.write_peer_addresses(
+            {user: address for user, address in addresses[:self.PEER_ADDRESS_MAX] if address[3] > expiry}
+        )
 
     def check_user(self, user, addr):
         """
         Check if this user is banned, geoip-blocked, and which shares
         it is allowed to access based on transfer and shares settings.
+        Results are remembered per user and IP address until the settings
+        involved change, see update_user_access.
         """
 
-        if user in self.config.sections["server"]["banlist"]:
+        key = (user, addr)
+        curtime = time.time()
+
+        try:
+            expiry, result = self.user_access[key]
+
+            if expiry > curtime:
+                return result
+
+        except KeyError:
+            if len(self.user_access) >= self.USER_ACCESS_MAX:
+                self.user_access.clear()
+
+        result = self._check_user(user, addr)
+        self.user_access[key] = (curtime + self.USER_ACCESS_TTL, result)
+
+        return result
+
+    def _check_user(self, user, addr):
+
+        if user in self.banned_users:
             if self.config.sections["transfers"]["usecustomban"]:
                 return 0, "Banned (%s)" % self.config.sections["transfers"]["customban"]
             else:
                 return 0, "Banned"
 
-        if user in [i[0] for i in self.config.sections["server"]["userlist"]] and self.config.sections["transfers"]["enablebuddyshares"]:
-            # For sending buddy-only shares
-            return 2, ""
+        if user in self.buddies:
+            if self.config.sections["transfers"]["enablebuddyshares"]:
+                # For sending buddy-only shares
+                return 2, ""
 
-        if user in [i[0] for i in self.config.sections["server"]["userlist"]]:
             return 1, ""
 
         if self.config.sections["transfers"]["friendsonly"]:
@@ -1291,10 +1696,9 @@ class NetworkEventProcessor:
 
             if isinstance(peerconn, socket):
 
-                for i in self.peerconns:
-                    if i.conn == peerconn:
-                        self.peerconns.remove(i)
-                        break
+                for i in self.peerconns.by_conn(peerconn):
+                    self.peerconns.remove(i)
+                    break
             else:
                 try:
                     self.peerconns.remove(peerconn)
@@ -1302,42 +1706,70 @@ class NetworkEventProcessor:
                     pass
 
     def user_info_reply(self, msg):
+
+        if self.hold_unconfirmed_reply(msg):
+            return
+
         conn = msg.conn.conn
 
-        for i in self.peerconns:
-            if i.conn is conn and self.userinfo is not None:
+        for i in self.peerconns.by_conn(conn):
+            if self.userinfo is not None:
                 # probably impossible to do this
                 if i.username != self.config.sections["server"]["login"]:
                     self.userinfo.show_info(i.username, msg)
                     break
 
+    def get_user_info(self):
+        """ Returns the description and picture we show to other users, and the
+        UserInfoReply header they are packed into. The picture is only read
+        again if the file or the settings changed. """
+
+        descr = self.config.sections["userinfo"]["descr"]
+        userpic = self.config.sections["userinfo"]["pic"]
+
+        try:
+            stat = os.stat(userpic)
+            picstate = (stat.st_mtime, stat.st_size)
+
+        except Exception:
+            picstate = None
+
+        key = (descr, userpic, picstate)
+
+        if self.user_info is not None and self.user_info[0] == key:
+            return self.user_info[1]
+
+        pic = None
+
+        if picstate is not None:
+            try:
+                with open(userpic, 'rb') as f:
+                    pic = f.read()
+
+            except Exception:
+                pass
+
+        reply = slskmessages.UserInfoReply(None, unescape(descr), pic)
+        self.user_info = (key, (reply.descr, reply.pic, reply.make_header()))
+
+        return self.user_info[1]
+
     def user_info_request(self, msg):
 
         user = ip = port = None
         conn = msg.conn.conn
 
         # Get peer's username, ip and port
-        for i in self.peerconns:
-            if i.conn is conn:
-                user = i.username
-                if i.addr is not None:
-                    ip, port = i.addr
-                break
+        for i in self.peerconns.by_conn(conn):
+            user = i.username
+            if i.addr is not None:
+                ip, port = i.addr
+            break
 
         if user is None:
             # No peer connection
             return
 
-        request_time = time.time()
-
-        if user in self.requested_info:
-            if not request_time > 10 + self.requested_info[user]:
-                # Ignoring request, because it's 10 or less seconds since the
-                # last one by this user
-                return
-
-        self.requested_info[user] = request_time
-
         # Check address is spoofed, if possible
         if user == self.config.sections["server"]["login"]:
 
@@ -1365,20 +1797,11 @@ class NetworkEventProcessor:
                 }
             )
 
-            log.add_warning("%s %s", (msg.__class__, self.contents(msg)))
+            log.add_warning("%s %s", lambda: (msg.__class__, self.contents(msg)))
 
             return
 
-        try:
-            userpic = self.config.sections["userinfo"]["pic"]
-
-            with open(userpic, 'rb') as f:
-                pic = f.read()
-
-        except Exception:
-            pic = None
-
-        descr = unescape(self.config.sections["userinfo"]["descr"])
+        descr, pic, header = self.get_user_info()
 
         if self.transfers is not None:
             totalupl = self.transfers.get_total_uploads_allowed()
@@ -1390,7 +1813,7 @@ class NetworkEventProcessor:
             else:
                 uploadallowed = 0
 
-            self.queue.put(slskmessages.UserInfoReply(conn, descr, pic, totalupl, queuesize, slotsavail, uploadallowed))
+            self.queue.put(slskmessages.UserInfoReply(conn, descr, pic, totalupl, queuesize, slotsavail, uploadallowed, header))
 
         log.add(
             _("%(user)s is making a UserInfo request"), {
@@ -1399,10 +1822,14 @@ class NetworkEventProcessor:
         )
 
     def shared_file_list(self, msg):
+
+        if self.hold_unconfirmed_reply(msg):
+            return
+
         conn = msg.conn.conn
 
-        for i in self.peerconns:
-            if i.conn is conn and self.userbrowse is not None:
+        for i in self.peerconns.by_conn(conn):
+            if self.userbrowse is not None:
                 if i.username != self.config.sections["server"]["login"]:
                     self.userbrowse.show_info(i.username, msg)
                     break
@@ -1423,14 +1850,14 @@ class NetworkEventProcessor:
             self.search.show_result(msg, msg.user, country)
             self.close_peer_connection(conn)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def pierce_fire_wall(self, msg):
         token = msg.token
 
-        for i in self.peerconns:
+        for i in self.peerconns.by_token(token):
 
-            if i.token == token and i.conn is None:
+            if i.conn is None:
                 conn = msg.conn.conn
 
                 if i.conntimer is not None:
@@ -1438,7 +1865,7 @@ class NetworkEventProcessor:
 
                 i.init.conn = conn
                 self.queue.put(i.init)
-                i.conn = conn
+                self.peerconns.set_conn(i, conn)
 
                 for j in i.msgs:
 
@@ -1460,29 +1887,27 @@ class NetworkEventProcessor:
                 i.msgs = []
                 break
 
-        log.add_conn("%s %s", (msg.__class__, self.contents(msg)))
+        log.add_conn("%s %s", lambda: (msg.__class__, self.contents(msg)))
 
     def cant_connect_to_peer(self, msg):
         token = msg.token
 
-        for i in self.peerconns:
-
-            if i.token == token:
+        for i in self.peerconns.by_token(token):
 
-                if i.conntimer is not None:
-                    i.conntimer.cancel()
+            if i.conntimer is not None:
+                i.conntimer.cancel()
 
-                if i == self.get_parent_conn():
-                    self.parent_conn_closed()
+            if i == self.get_parent_conn():
+                self.parent_conn_closed()
 
-                self.peerconns.remove(i)
+            self.peerconns.remove(i)
 
-                log.add_conn(_("Can't connect to %s (either way), giving up"), i.username)
+            log.add_conn(_("Can't connect to %s (either way), giving up"), i.username)
 
-                for j in i.msgs:
-                    if j.__class__ in [slskmessages.TransferRequest, slskmessages.FileRequest] and self.transfers is not None:
-                        self.transfers.got_cant_connect(j.req)
-                break
+            for j in i.msgs:
+                if j.__class__ in [slskmessages.TransferRequest, slskmessages.FileRequest] and self.transfers is not None:
+                    self.transfers.got_cant_connect(j.req)
+            break
 
     def connect_to_peer_timeout(self, msg):
         conn = msg.conn
@@ -1505,31 +1930,38 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.transfer_timeout(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
+
+    def download_queue_timeout(self, msg):
+        if self.transfers is not None:
+            self.transfers.check_download_queue()
+            self.start_download_queue_timer()
+        else:
+            self.log_contents(msg)
 
     def file_download(self, msg):
         if self.transfers is not None:
             self.transfers.file_download(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def file_upload(self, msg):
         if self.transfers is not None:
             self.transfers.file_upload(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def file_request(self, msg):
         if self.transfers is not None:
             self.transfers.file_request(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def file_error(self, msg):
         if self.transfers is not None:
             self.transfers.file_error(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def transfer_request(self, msg):
         """ Peer code: 40 """
@@ -1537,7 +1969,7 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.transfer_request(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def transfer_response(self, msg):
         """ Peer code: 41 """
@@ -1545,7 +1977,7 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.transfer_response(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def queue_upload(self, msg):
         """ Peer code: 43 """
@@ -1553,7 +1985,7 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.queue_upload(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def queue_failed(self, msg):
         """ Peer code: 50 """
@@ -1561,7 +1993,7 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.queue_failed(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def place_in_queue_request(self, msg):
         """ Peer code: 51 """
@@ -1569,12 +2001,12 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.place_in_queue_request(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def upload_queue_notification(self, msg):
         """ Peer code: 52 """
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
         self.transfers.upload_queue_notification(msg)
 
     def upload_failed(self, msg):
@@ -1583,7 +2015,7 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.upload_failed(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def place_in_queue(self, msg):
         """ Peer code: 44 """
@@ -1591,24 +2023,23 @@ class NetworkEventProcessor:
         if self.transfers is not None:
             self.transfers.place_in_queue(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def get_shared_file_list(self, msg):
         """ Peer code: 4 """
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
         user = ip = port = None
         conn = msg.conn.conn
 
         # Get peer's username, ip and port
-        for i in self.peerconns:
-            if i.conn is conn:
-                user = i.username
-                if i.addr is not None:
-                    if len(i.addr) != 2:
-                        break
-                    ip, port = i.addr
-                break
+        for i in self.peerconns.by_conn(conn):
+            user = i.username
+            if i.addr is not None:
+                if len(i.addr) != 2:
+                    break
+                ip, port = i.addr
+            break
 
         if user is None:
             # No peer connection
@@ -1673,11 +2104,10 @@ class NetworkEventProcessor:
         checkuser = None
         reason = ""
 
-        for i in self.peerconns:
-            if i.conn is conn:
-                username = i.username
-                checkuser, reason = self.check_user(username, None)
-                break
+        for i in self.peerconns.by_conn(conn):
+            username = i.username
+            checkuser, reason = self.check_user(username, None)
+            break
 
         if not username:
             return
@@ -1686,27 +2116,20 @@ class NetworkEventProcessor:
             return
 
         if checkuser == 1:
-            shares = self.config.sections["transfers"]["sharedfilesstreams"]
+            sharestype = "normal"
         elif checkuser == 2:
-            shares = self.config.sections["transfers"]["bsharedfilesstreams"]
+            sharestype = "buddy"
         else:
             self.queue.put(slskmessages.TransferResponse(conn, 0, reason=reason, req=0))
-            shares = {}
+            sharestype = None
 
-        if checkuser:
-            if msg.dir in shares:
-                self.queue.put(slskmessages.FolderContentsResponse(conn, msg.dir, shares[msg.dir]))
-            elif msg.dir.rstrip('\\') in shares:
-                self.queue.put(slskmessages.FolderContentsResponse(conn, msg.dir, shares[msg.dir.rstrip('\\')]))
-            else:
-                if checkuser == 2:
-                    shares = self.config.sections["transfers"]["sharedfilesstreams"]
-                    if msg.dir in shares:
-                        self.queue.put(slskmessages.FolderContentsResponse(conn, msg.dir, shares[msg.dir]))
-                    elif msg.dir.rstrip("\\") in shares:
-                        self.queue.put(slskmessages.FolderContentsResponse(conn, msg.dir, shares[msg.dir.rstrip("\\")]))
+        if sharestype is not None:
+            payload = self.shares.get_compressed_folder(msg.dir, sharestype)
+
+            if payload is not None:
+                self.queue.put(slskmessages.FolderContentsResponse(conn, msg.dir, built=payload))
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def folder_contents_response(self, msg):
         """ Peer code: 37 """
@@ -1728,16 +2151,13 @@ class NetworkEventProcessor:
                             folder = j
 
             if many:
-                for i in self.peerconns:
-                    if i.conn is conn:
-                        username = i.username
-                        break
+                username = self.peerconns.get_username(conn)
 
                 self.transfers.downloadsview.download_large_folder(username, folder, numfiles, conn, file_list)
             else:
                 self.transfers.folder_contents_response(conn, file_list)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def room_list(self, msg):
         """ Server code: 64 """
@@ -1746,7 +2166,7 @@ class NetworkEventProcessor:
             self.chatrooms.roomsctrl.set_room_list(msg)
             self.set_status("")
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def global_user_list(self, msg):
         """ Server code: 67 """
@@ -1754,7 +2174,7 @@ class NetworkEventProcessor:
         if self.globallist is not None:
             self.globallist.set_global_users_list(msg)
         else:
-            log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+            self.log_contents(msg)
 
     def peer_transfer(self, msg):
         if self.userinfo is not None and msg.msg is slskmessages.UserInfoReply:
@@ -1774,29 +2194,28 @@ class NetworkEventProcessor:
             peermsg.tunneledaddr = msg.addr
             self.network_callback([peermsg])
         else:
-            log.add_msg_contents(_("Unknown tunneled message: %s"), (self.contents(msg)))
+            log.add_msg_contents(_("Unknown tunneled message: %s"), lambda: self.contents(msg))
 
     def file_search_request(self, msg):
         """ Peer code: 8 """
         conn = msg.conn.conn
 
-        for i in self.peerconns:
-            if i.conn == conn:
-                user = i.username
-                self.shares.process_search_request(msg.searchterm, user, msg.searchid, direct=1)
-                break
+        for i in self.peerconns.by_conn(conn):
+            user = i.username
+            self.shares.process_search_request(msg.searchterm, user, msg.searchid, direct=1)
+            break
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def search_request(self, msg):
         """ Server code: 93 """
 
         self.shares.process_search_request(msg.searchterm, msg.user, msg.searchid, direct=0)
         self.pluginhandler.search_request_notification(msg.searchterm, msg.user, msg.searchid)
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def room_search_request(self, msg):
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
         self.shares.process_search_request(msg.searchterm, msg.room, msg.searchid, direct=0)
 
     def toggle_respond_distributed(self, msg, settings=False):
@@ -1822,9 +2241,7 @@ class NetworkEventProcessor:
                 self.respond_distributed = not self.respond_distributed
 
             responddistributedtimeout = RespondToDistributedSearchesTimeout(self.network_callback)
-            self.respond_distributed_timer = threading.Timer(self.config.sections["searches"]["distrib_ignore"], responddistributedtimeout.timeout)
-            self.respond_distributed_timer.setDaemon(True)
-            self.respond_distributed_timer.start()
+            self.respond_distributed_timer = scheduler.schedule(self.config.sections["searches"]["distrib_ignore"], responddistributedtimeout.timeout)
         else:
             # Always respond
             self.respond_distributed = True
@@ -1851,12 +2268,11 @@ class NetworkEventProcessor:
 
                 self.process_request_to_peer(user, slskmessages.DistribConn(), None, addr)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def get_parent_conn(self):
-        for i in self.peerconns:
-            if i.type == 'D':
-                return i
+        for i in self.peerconns.by_type('D'):
+            return i
 
         return None
 
@@ -1875,16 +2291,15 @@ class NetworkEventProcessor:
 
         if not self.has_parent:
 
-            for i in self.peerconns[:]:
-                if i.type == 'D':
-                    """ We previously attempted to connect to all potential parents. Since we now
-                    have a parent, stop connecting to the others. """
+            for i in self.peerconns.by_type('D'):
+                """ We previously attempted to connect to all potential parents. Since we now
+                have a parent, stop connecting to the others. """
 
-                    if i.conn != msg.conn.conn:
-                        if i.conn is not None:
-                            self.queue.put(slskmessages.ConnClose(i.conn))
+                if i.conn != msg.conn.conn:
+                    if i.conn is not None:
+                        self.queue.put(slskmessages.ConnClose(i.conn))
 
-                        self.peerconns.remove(i)
+                    self.peerconns.remove(i)
 
             parent = self.get_parent_conn()
 
@@ -1895,7 +2310,7 @@ class NetworkEventProcessor:
             else:
                 self.parent_conn_closed()
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def global_recommendations(self, msg):
         """ Server code: 56 """
@@ -1923,7 +2338,7 @@ class NetworkEventProcessor:
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.ticker_set(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def room_ticker_add(self, msg):
         """ Server code: 114 """
@@ -1931,7 +2346,7 @@ class NetworkEventProcessor:
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.ticker_add(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
 
     def room_ticker_remove(self, msg):
         """ Server code: 115 """
@@ -1939,7 +2354,26 @@ class NetworkEventProcessor:
         if self.chatrooms is not None:
             self.chatrooms.roomsctrl.ticker_remove(msg)
 
-        log.add_msg_contents("%s %s", (msg.__class__, self.contents(msg)))
+        self.log_contents(msg)
+
+    def update_ip_block_list(self):
+        """ Gives the networking thread an updated list of blocked IP addresses """
+
+        self.queue.put(slskmessages.SetIPBlockList(list(self.config.sections["server"]["ipblocklist"])))
+
+    def update_ip_ignore_list(self):
+        """ Compiles the list of ignored IP addresses, for fast lookups """
+
+        self.ipignorelist = IPAddressList(self.config.sections["server"]["ipignorelist"])
+
+    def update_user_access(self):
+        """ Compiles the buddy and ban lists for fast lookups, and forgets the
+        results of check_user. Call this whenever these lists, or the sharing
+        and geoblocking settings, change. """
+
+        self.buddies = {i[0] for i in self.config.sections["server"]["userlist"]}
+        self.banned_users = set(self.config.sections["server"]["banlist"])
+        self.user_access.clear()
 
     def update_debug_log_options(self):
         """ Gives the logger updated logging settings """
@@ -0,0 +1,112 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Connection, transfer and server timeouts used to start a threading.Timer
+each, which meant one thread per pending peer connection. This module keeps
+all of them in a heap instead, and runs them from a single thread.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from gettext import gettext as _
+
+from pynicotine.logfacility import log
+
+
+class TimerHandle:
+    """ Returned by Scheduler.schedule(), can be cancelled like a
+    threading.Timer """
+
+    __slots__ = ("callback", "args", "cancelled")
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """ Runs callbacks after a delay. Callbacks run one at a time in the
+    scheduler thread, so they should return quickly. Anything that touches
+    core state should only post a message to the network event queue. """
+
+    def __init__(self):
+
+        self._timers = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay, callback, *args):
+
+        handle = TimerHandle(callback, args)
+
+        with self._condition:
+            # The counter keeps timers due at the same time in FIFO order
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._counter), handle))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="Scheduler", daemon=True)
+                self._thread.start()
+
+            self._condition.notify()
+
+        return handle
+
+    def _next_due(self):
+
+        with self._condition:
+            while True:
+                if not self._timers:
+                    self._condition.wait()
+                    continue
+
+                when, count, handle = self._timers[0]
+
+                if handle.cancelled:
+                    heapq.heappop(self._timers)
+                    continue
+
+                delay = when - time.monotonic()
+
+                if delay <= 0:
+                    heapq.heappop(self._timers)
+                    return handle
+
+                self._condition.wait(delay)
+
+    def _run(self):
+
+        while True:
+            handle = self._next_due()
+
+            try:
+                handle.callback(*handle.args)
+            except Exception as error:
+                # Don't let a broken callback stop the other timers
+                log.add_warning(_("Exception in callback %s: %s"), (handle.callback, error))
+
+
+scheduler = Scheduler()
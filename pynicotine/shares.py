@@ -30,6 +30,7 @@ import sys
 import taglib
 import _thread
 
+from collections import OrderedDict
 from gettext import gettext as _
 
 from pynicotine import slskmessages
@@ -47,12 +48,16 @@ if sys.platform == "win32":
 
 class Shares:
 
+    # Number of compressed folder contents kept for FolderContentsRequests
+    FOLDER_CACHE_SIZE = 200
+
     def __init__(self, np, config, queue, ui_callback=None):
         self.np = np
         self.ui_callback = ui_callback
         self.config = config
         self.queue = queue
         self.translatepunctuation = str.maketrans(dict.fromkeys(string.punctuation, ' '))
+        self.compressed_folders = OrderedDict()
 
         self.convert_shares()
         self.load_shares(
@@ -178,7 +183,12 @@ class Shares:
 
                 except Exception as e:
                     log.add_warning(_("Can't save %s: %s") % (filename, e))
-                    return
+                    break
+
+        if streams is not None:
+            # Only clear cached folders once the new streams are stored, otherwise
+            # requests in the meantime would cache folders from the old streams again
+            self.compressed_folders.clear()
 
     def clear_shares(self):
 
@@ -204,6 +214,50 @@ class Shares:
         elif sharestype == "buddy":
             self.compressed_shares_buddy = m
 
+    def get_compressed_folder(self, folder, sharestype):
+        """ Returns the compressed FolderContentsResponse payload for a folder in
+        our normal or buddy shares, or None if we don't share it. Buddies can
+        also request folders that are only in the normal shares. The payloads
+        of recently requested folders are cached. """
+
+        key = (folder, sharestype)
+        payload = self.compressed_folders.get(key)
+
+        if payload is not None:
+            self.compressed_folders.move_to_end(key)
+            return payload
+
+        streams = [self.config.sections["transfers"]["sharedfilesstreams"]]
+
+        if sharestype == "buddy":
+            streams.insert(0, self.config.sections["transfers"]["bsharedfilesstreams"])
+
+        for stream in streams:
+            for name in (folder, folder.rstrip('\\')):
+                if name in stream:
+                    payload = slskmessages.FolderContentsResponse(None, folder, stream[name]).make_network_message()
+                    break
+
+            if payload is not None:
+                break
+        else:
+            return None
+
+        self.compressed_folders[key] = payload
+
+        if len(self.compressed_folders) > self.FOLDER_CACHE_SIZE:
+            self.compressed_folders.popitem(last=False)
+
+        return payload
+
+    def forget_compressed_folder(self, folder):
+        """ Drops the cached FolderContentsResponse payloads of a folder whose
+        contents changed """
+
+        for sharestype in ("normal", "buddy"):
+            self.compressed_folders.pop((folder, sharestype), None)
+            self.compressed_folders.pop((folder + '\\', sharestype), None)
+
     def close_shares(self):
         for db in [
             "sharedfiles", "sharedfilesstreams", "wordindex",
@@ -425,6 +479,7 @@ class Shares:
             self.add_file_to_index(index, file, vdir, fileinfo, wordindex, fileindex)
 
             sharedmtimes[vdir] = os.path.getmtime(rdir)
+            self.forget_compressed_folder(vdir)
             self.newnormalshares = True
 
         if config["transfers"]["enablebuddyshares"]:
@@ -469,6 +524,7 @@ class Shares:
             self.add_file_to_index(index, file, vdir, fileinfo, bwordindex, bfileindex)
 
             bsharedmtimes[vdir] = os.path.getmtime(rdir)
+            self.forget_compressed_folder(vdir)
             self.newbuddyshares = True
 
     def get_folder_mtimes(self, folder):
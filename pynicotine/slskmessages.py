@@ -24,9 +24,11 @@ import socket
 import struct
 import zlib
 
+from collections.abc import Mapping
 from gettext import gettext as _
 from itertools import count
 from itertools import islice
+from sys import maxsize
 
 from pynicotine.logfacility import log
 from pynicotine.utils import debug
@@ -176,6 +178,27 @@ class SetDownloadLimit(InternalMessage):
         self.limit = limit
 
 
+class SetIPBlockList(InternalMessage):
+    """ Sent by the GUI thread to indicate changes in the list of blocked IP addresses"""
+
+    def __init__(self, ips):
+        self.ips = ips
+
+
+class SetPeerPoolSize(InternalMessage):
+    """ Sent by the GUI thread to indicate changes in the number of idle peer connections to keep open"""
+
+    def __init__(self, size):
+        self.size = size
+
+
+class DropSearchResults(InternalMessage):
+    """ Sent by the GUI thread when it no longer wants results for one of our searches"""
+
+    def __init__(self, token):
+        self.token = token
+
+
 class SetGeoBlock(InternalMessage):
     """ Sent by the GUI thread to indicate changes in GeoIP blocking"""
 
@@ -202,51 +225,285 @@ class PopupMessage:
         self.message = message
 
 
+""" Field types for the declarative message layout in SlskMessage.pack_fields and
+SlskMessage.unpack_fields. Integers are little-endian. """
+
+UINT8 = "B"
+INT32 = "i"
+UINT32 = "I"
+UINT64 = "Q"
+PORT = "H2x"  # 32-bit integer, of which only the lower 16 bits are read
+STRING = "string"  # 32-bit length, followed by the string
+IP = "ip"  # IPv4 address in reverse byte order
+OPTIONAL = "optional"  # The remaining fields may be missing at the end of a message
+
+UINT16_STRUCT = struct.Struct("<H")
+INT32_STRUCT = struct.Struct("<i")
+UINT32_STRUCT = struct.Struct("<I")
+UINT64_STRUCT = struct.Struct("<Q")
+
+
+def unpack_string(message, start=0, printerror=True, rawbytes=False):
+    """ Returns the position after a length-prefixed string in message, and the
+    string itself. The string is decoded, unless rawbytes is True. """
+
+    if len(message) - start >= 4:
+        length = UINT32_STRUCT.unpack_from(message, start)[0]
+    else:
+        length = UINT32_STRUCT.unpack(bytes(message[start:start + 4]).ljust(4, b'\0'))[0]
+
+    start += 4
+    string = message[start:start + length]
+
+    if rawbytes is False:
+        try:
+            string = string.decode('utf-8')
+        except Exception:
+            # Older clients (Soulseek NS)
+
+            try:
+                string = string.decode('iso-8859-1')
+            except Exception as error:
+                if printerror:
+                    log.add_warning("Error trying to decode string '%s': %s", (string, error))
+
+    return length + start, string
+
+
+class MessageCodec:
+    """ Packs and unpacks a message according to a list of (attribute, field type)
+    pairs. Consecutive fixed-size fields are handled by a single precompiled
+    struct. """
+
+    __slots__ = "steps"
+
+    # Compiled codecs, by the id of their field list
+    codecs = {}
+
+    def __init__(self, fields):
+
+        self.steps = []
+        attributes = []
+        field_types = []
+
+        for field in fields:
+            if field is OPTIONAL:
+                self._add_struct(attributes, field_types)
+                self.steps.append((OPTIONAL, None, None, None))
+                continue
+
+            attribute, field_type = field
+
+            if field_type in (STRING, IP):
+                self._add_struct(attributes, field_types)
+                self.steps.append((field_type, None, attribute, None))
+                continue
+
+            attributes.append(attribute)
+            field_types.append(field_type)
+
+        self._add_struct(attributes, field_types)
+
+        # When packing, optional fields are left out from the first one that is None
+        for index, step in enumerate(self.steps[:-1]):
+            if step[0] is OPTIONAL:
+                next_attribute = self.steps[index + 1][2]
+
+                if isinstance(next_attribute, tuple):
+                    next_attribute = next_attribute[0]
+
+                self.steps[index] = (OPTIONAL, None, next_attribute, None)
+
+    def _add_struct(self, attributes, field_types):
+
+        if not field_types:
+            return
+
+        self.steps.append((None, struct.Struct("<" + "".join(field_types)), tuple(attributes), tuple(field_types)))
+        attributes.clear()
+        field_types.clear()
+
+    @classmethod
+    def get(cls, fields):
+
+        codec = cls.codecs.get(id(fields))
+
+        if codec is None:
+            codec = cls.codecs[id(fields)] = cls(fields)
+
+        return codec
+
+    def pack(self, msg_obj):
+
+        msg = bytearray()
+
+        for step_type, step_struct, attribute, field_types in self.steps:
+            if step_type is None:
+                values = [getattr(msg_obj, name) for name in attribute]
+
+                try:
+                    msg.extend(step_struct.pack(*values))
+
+                except struct.error:
+                    # Invalid value, let pack_object report it
+                    for value, field_type in zip(values, field_types):
+                        msg.extend(msg_obj.pack_object(
+                            value, unsignedint=(field_type == UINT32), unsignedlonglong=(field_type == UINT64)))
+
+            elif step_type is STRING:
+                value = getattr(msg_obj, attribute)
+
+                if isinstance(value, str):
+                    value = value.encode("utf-8", "replace")
+
+                if isinstance(value, bytes):
+                    msg.extend(INT32_STRUCT.pack(len(value)))
+                    msg.extend(value)
+                else:
+                    msg.extend(msg_obj.pack_object(value))
+
+            elif step_type is IP:
+                msg.extend(socket.inet_aton(getattr(msg_obj, attribute))[::-1])
+
+            elif attribute is None or getattr(msg_obj, attribute, None) is None:
+                break
+
+        return msg
+
+    def unpack(self, msg_obj, message, pos=0):
+
+        for step_type, step_struct, attribute, field_types in self.steps:
+            if step_type is None:
+                values = step_struct.unpack_from(message, pos)
+                pos += step_struct.size
+
+                for name, value in zip(attribute, values):
+                    setattr(msg_obj, name, value)
+
+            elif step_type is STRING:
+                pos, value = unpack_string(message, pos)
+                setattr(msg_obj, attribute, value)
+
+            elif step_type is IP:
+                setattr(msg_obj, attribute, socket.inet_ntoa(bytes(message[pos:pos + 4])[::-1]))
+                pos += 4
+
+            elif pos >= len(message):
+                break
+
+        return pos
+
+
+class FileListIndex(Mapping):
+    """ Read-only mapping of directory names to lists of files, as sent in
+    SharedFileList and FolderContentsResponse messages. Only the position of each
+    directory in the message is read up front; the files of a directory are decoded
+    when it's looked up. A file is a (code, name, size, ext, attrs) tuple. """
+
+    __slots__ = ("message", "offsets", "totalsize", "end")
+
+    def __init__(self, message, pos=0):
+
+        self.message = message
+        self.offsets = {}
+        self.totalsize = 0
+
+        ndir = UINT32_STRUCT.unpack_from(message, pos)[0]
+        pos += 4
+
+        for i in range(ndir):
+            pos, directory = unpack_string(message, pos)
+            nfiles = UINT32_STRUCT.unpack_from(message, pos)[0]
+            pos += 4
+
+            self.offsets[directory] = (pos, nfiles)
+
+            for j in range(nfiles):
+                # Skip the code and file name
+                pos += 5 + UINT32_STRUCT.unpack_from(message, pos + 1)[0]
+
+                size = UINT64_STRUCT.unpack_from(message, pos)[0]
+                pos += 8
+
+                if size < maxsize:
+                    self.totalsize += size
+
+                # Skip the extension and attributes
+                pos += 4 + UINT32_STRUCT.unpack_from(message, pos)[0]
+                pos += 4 + 8 * UINT32_STRUCT.unpack_from(message, pos)[0]
+
+        self.end = pos
+
+    def __getitem__(self, directory):
+
+        pos, nfiles = self.offsets[directory]
+        message = self.message
+        files = []
+
+        for j in range(nfiles):
+            code = message[pos]
+            pos, name = unpack_string(message, pos + 1, printerror=False)
+            size = UINT64_STRUCT.unpack_from(message, pos)[0]
+            pos, ext = unpack_string(message, pos + 8, printerror=False)
+            numattr = UINT32_STRUCT.unpack_from(message, pos)[0]
+            pos += 4
+
+            # Attributes are (number, value) pairs, we only keep the values
+            attrs = list(UINT32_STRUCT.unpack_from(message, pos + 8 * k + 4)[0] for k in range(numattr))
+            pos += 8 * numattr
+
+            files.append((code, name, size, ext, attrs))
+
+        return files
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __repr__(self):
+        return "<%s: %i directories>" % (self.__class__.__name__, len(self.offsets))
+
+
 class SlskMessage:
     """ This is a parent class for all protocol messages. """
 
+    """ Fields the message consists of when we send it (pack_fields) and when we
+    receive it (unpack_fields), as a tuple of (attribute, field type) pairs. Messages
+    with a more complex layout implement make_network_message and
+    parse_network_message instead. """
+
+    pack_fields = None
+    unpack_fields = None
+
     def get_object(self, message, type, start=0, getintasshort=False, getsignedint=False, getunsignedlonglong=False, printerror=True, rawbytes=False):
         """ Returns object of specified type, extracted from message (which is
         a binary array). start is an offset."""
-        intsize = struct.calcsize("<I")
+        intsize = 4
         try:
             if type is int:
                 if getintasshort:
 
                     # little-endian unsigned short integer (2 bytes)
-                    return intsize + start, struct.unpack("<H", message[start:start + struct.calcsize("<H")])[0]
+                    return intsize + start, UINT16_STRUCT.unpack_from(message, start)[0]
                 elif getsignedint:
 
                     # little-endian signed integer (4 bytes)
-                    return intsize + start, struct.unpack("<i", message[start:start + intsize])[0]
+                    return intsize + start, INT32_STRUCT.unpack_from(message, start)[0]
                 elif getunsignedlonglong:
 
                     # little-endian unsigned long long (8 bytes)
                     try:
-                        return struct.calcsize("<Q") + start, struct.unpack("<Q", message[start:start + struct.calcsize("<Q")])[0]
+                        return 8 + start, UINT64_STRUCT.unpack_from(message, start)[0]
                     except Exception:
-                        return intsize + start, struct.unpack("<I", message[start:start + intsize])[0]
+                        return intsize + start, UINT32_STRUCT.unpack_from(message, start)[0]
                 else:
 
                     # little-endian unsigned integer (4 bytes)
-                    return intsize + start, struct.unpack("<I", message[start:start + intsize])[0]
+                    return intsize + start, UINT32_STRUCT.unpack_from(message, start)[0]
             elif type is bytes:
-                length = struct.unpack("<I", message[start:start + intsize].ljust(intsize, b'\0'))[0]
-                string = message[start + intsize:start + length + intsize]
-
-                if rawbytes is False:
-                    try:
-                        string = string.decode('utf-8')
-                    except Exception:
-                        # Older clients (Soulseek NS)
-
-                        try:
-                            string = string.decode('iso-8859-1')
-                        except Exception as error:
-                            if printerror:
-                                log.add_warning("Error trying to decode string '%s': %s", (string, error))
-
-                return length + intsize + start, string
+                return unpack_string(message, start, printerror, rawbytes)
             else:
                 return start, None
         except struct.error as error:
@@ -259,29 +516,36 @@ class SlskMessage:
         binary array."""
         if isinstance(object, int):
             if unsignedint:
-                return struct.pack("<I", object)
+                return UINT32_STRUCT.pack(object)
             elif unsignedlonglong:
-                return struct.pack("<Q", object)
+                return UINT64_STRUCT.pack(object)
             else:
-                return struct.pack("<i", object)
+                return INT32_STRUCT.pack(object)
         elif isinstance(object, bytes):
-            return struct.pack("<i", len(object)) + object
+            return INT32_STRUCT.pack(len(object)) + object
         elif isinstance(object, str):
             encoded = object.encode("utf-8", 'replace')
-            return struct.pack("<i", len(encoded)) + encoded
+            return INT32_STRUCT.pack(len(encoded)) + encoded
 
         log.add_warning(_("Warning: unknown object type %(obj_type)s in message %(msg_type)s"), {'obj_type': type(object), 'msg_type': self.__class__})
         return b""
 
     def make_network_message(self):
         """ Returns binary array, that can be sent over the network"""
-        log.add_warning(_("Empty message made, class %s"), self.__class__)
-        return None
+        if self.pack_fields is None:
+            log.add_warning(_("Empty message made, class %s"), self.__class__)
+            return None
+
+        return MessageCodec.get(self.pack_fields).pack(self)
 
     def parse_network_message(self, message):
         """ Extracts information from the message and sets up fields
         in an object"""
-        log.add_warning(_("Can't parse incoming messages, class %s"), self.__class__)
+        if self.unpack_fields is None:
+            log.add_warning(_("Can't parse incoming messages, class %s"), self.__class__)
+            return
+
+        MessageCodec.get(self.unpack_fields).unpack(self, message)
 
     def strrev(self, str):
         strlist = list(str)
@@ -362,32 +626,30 @@ class SetWaitPort(ServerMessage):
     """ We send this to the server to indicate the port number that we
     listen on (2234 by default). """
 
+    pack_fields = (("port", INT32),)
+
     def __init__(self, port=None):
         self.port = port
 
     def __repr__(self):
         return 'SetWaitPort({})'.format(self.port)
 
-    def make_network_message(self):
-        return self.pack_object(self.port)
-
 
 class GetPeerAddress(ServerMessage):
     """ Server code: 3 """
     """ We send this to the server to ask for a peer's address
     (IP address and port), given the peer's username. """
 
+    pack_fields = (("user", STRING),)
+    unpack_fields = (
+        ("user", STRING),
+        ("ip", IP),
+        ("port", PORT)
+    )
+
     def __init__(self, user=None):
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-        pos, self.port = self.get_object(message, int, pos, 1)
-
 
 class AddUser(ServerMessage):
     """ Server code: 5 """
@@ -395,6 +657,8 @@ class AddUser(ServerMessage):
     stats have changed, the server sends a GetUserStats response message
     with the new user stats. """
 
+    pack_fields = (("user", STRING),)
+
     def __init__(self, user=None):
         self.user = user
         self.status = None
@@ -405,9 +669,6 @@ class AddUser(ServerMessage):
         self.country = None
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
     def parse_network_message(self, message):
         pos, self.user = self.get_object(message, bytes)
         pos, self.userexists = pos + 1, message[pos]
@@ -428,50 +689,47 @@ class RemoveUser(ServerMessage):
     """ Used when we no longer want to be kept updated about a
     user's stats. """
 
+    pack_fields = (("user", STRING),)
+
     def __init__(self, user=None):
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
 
 class GetUserStatus(ServerMessage):
     """ Server code: 7 """
     """ The server tells us if a user has gone away or has returned. """
 
+    pack_fields = (("user", STRING),)
+    unpack_fields = (
+        ("user", STRING),
+        ("status", UINT32),
+        OPTIONAL,
+        ("privileged", UINT8)
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.status = self.get_object(message, int, pos)
-        # Exception handler is for Soulfind compatibility
-        try:
-            pos, self.privileged = pos + 1, message[pos]
-        except Exception:
-            pass
-
 
 class SayChatroom(ServerMessage):
     """ Server code: 13 """
     """ Either we want to say something in the chatroom, or someone else did. """
 
+    pack_fields = (
+        ("room", STRING),
+        ("msg", STRING)
+    )
+    unpack_fields = (
+        ("room", STRING),
+        ("user", STRING),
+        ("msg", STRING)
+    )
+
     def __init__(self, room=None, msg=None):
         self.room = room
         self.msg = msg
 
-    def make_network_message(self):
-        return self.pack_object(self.room) + self.pack_object(self.msg)
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
 class JoinRoom(ServerMessage):
     """ Server code: 14 """
@@ -539,15 +797,12 @@ class LeaveRoom(ServerMessage):
     """ Server code: 15 """
     """ We send this to the server when we want to leave a room. """
 
+    pack_fields = (("room", STRING),)
+    unpack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
-
 
 class UserJoinedRoom(ServerMessage):
     """ Server code: 16 """
@@ -570,9 +825,10 @@ class UserLeftRoom(ServerMessage):
     """ Server code: 17 """
     """ The server tells us someone has just left a room we're in. """
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.username = self.get_object(message, bytes, pos)
+    unpack_fields = (
+        ("room", STRING),
+        ("username", STRING)
+    )
 
 
 class ConnectToPeer(ServerMessage):
@@ -583,45 +839,40 @@ class ConnectToPeer(ServerMessage):
     to go the other way around (direct connection has failed).
     """
 
+    pack_fields = (
+        ("token", UINT32),
+        ("user", STRING),
+        ("type", STRING)
+    )
+    unpack_fields = (
+        ("user", STRING),
+        ("type", STRING),
+        ("ip", IP),
+        ("port", PORT),
+        ("token", UINT32),
+        OPTIONAL,
+        ("privileged", UINT8)
+    )
+
     def __init__(self, token=None, user=None, type=None):
         self.token = token
         self.user = user
         self.type = type
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.token, unsignedint=True))
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.type))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.type = self.get_object(message, bytes, pos)
-        pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-        pos, self.port = self.get_object(message, int, pos, 1)
-        pos, self.token = self.get_object(message, int, pos)
-
-        if len(message[pos:]) > 0:
-            pos, self.privileged = pos + 1, message[pos]
-
 
 class MessageUser(ServerMessage):
     """ Server code: 22 """
     """ Chat phrase sent to someone or received by us in private. """
 
+    pack_fields = (
+        ("user", STRING),
+        ("msg", STRING)
+    )
+
     def __init__(self, user=None, msg=None):
         self.user = user
         self.msg = msg
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.msg))
-
-        return msg
-
     def parse_network_message(self, message):
         pos, self.msgid = self.get_object(message, int)
         pos, self.timestamp = self.get_object(message, int, pos)
@@ -640,12 +891,11 @@ class MessageAcked(ServerMessage):
     If we don't send it, the server will keep sending the chat phrase to us.
     """
 
+    pack_fields = (("msgid", UINT32),)
+
     def __init__(self, msgid=None):
         self.msgid = msgid
 
-    def make_network_message(self):
-        return self.pack_object(self.msgid, unsignedint=True)
-
 
 class FileSearch(ServerMessage):
     """ Server code: 26 """
@@ -656,24 +906,22 @@ class FileSearch(ServerMessage):
     search results.
     """
 
+    pack_fields = (
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+    unpack_fields = (
+        ("user", STRING),
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+
     def __init__(self, requestid=None, text=None):
         self.searchid = requestid
         self.searchterm = text
         if text:
             self.searchterm = ' '.join((x for x in text.split() if x != '-'))
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.searchid, unsignedint=True))
-        msg.extend(self.pack_object(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
 
 class SetStatus(ServerMessage):
     """ Server code: 28 """
@@ -686,23 +934,18 @@ class SetStatus(ServerMessage):
     2 = Online
     """
 
+    pack_fields = (("status", INT32),)
+
     def __init__(self, status=None):
         self.status = status
 
-    def make_network_message(self):
-        return self.pack_object(self.status)
-
 
 class ServerPing(ServerMessage):
     """ Server code: 32 """
     """ We test if the server responds. DEPRECATED """
 
-    def make_network_message(self):
-        return b""
-
-    def parse_network_message(self, message):
-        # Empty message
-        pass
+    pack_fields = ()
+    unpack_fields = ()
 
 
 class SendSpeed(ServerMessage):
@@ -710,34 +953,30 @@ class SendSpeed(ServerMessage):
     """ We used to send this after a finished download to let the server update
     the speed statistics for a user. DEPRECATED """
 
+    pack_fields = (
+        ("user", STRING),
+        ("speed", UINT32)
+    )
+
     def __init__(self, user=None, speed=None):
         self.user = user
         self.speed = speed
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.speed, unsignedint=True))
-
-        return msg
-
 
 class SharedFoldersFiles(ServerMessage):
     """ Server code: 35 """
     """ We send this to server to indicate the number of folder and files
     that we share. """
 
+    pack_fields = (
+        ("folders", UINT32),
+        ("files", UINT32)
+    )
+
     def __init__(self, folders=None, files=None):
         self.folders = folders
         self.files = files
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.folders, unsignedint=True))
-        msg.extend(self.pack_object(self.files, unsignedint=True))
-
-        return msg
-
 
 class GetUserStats(ServerMessage):
     """ Server code: 36 """
@@ -746,13 +985,12 @@ class GetUserStats(ServerMessage):
     stats can also be requested by sending a GetUserStats message to the
     server, but AddUser should be used instead. """
 
+    pack_fields = (("user", STRING),)
+
     def __init__(self, user=None):
         self.user = user
         self.country = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
     def parse_network_message(self, message):
         pos, self.user = self.get_object(message, bytes)
         pos, self.avgspeed = self.get_object(message, int, pos, getsignedint=True)
@@ -766,9 +1004,10 @@ class QueuedDownloads(ServerMessage):
     """ The server sends this to indicate if someone has download slots available
     or not. DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.slotsfull = self.get_object(message, int, pos)
+    unpack_fields = (
+        ("user", STRING),
+        ("slotsfull", UINT32)
+    )
 
 
 class Relogged(ServerMessage):
@@ -776,9 +1015,7 @@ class Relogged(ServerMessage):
     """ The server sends this if someone else logged in under our nickname,
     and then disconnects us. """
 
-    def parse_network_message(self, message):
-        # Empty message
-        pass
+    unpack_fields = ()
 
 
 class UserSearch(ServerMessage):
@@ -787,59 +1024,54 @@ class UserSearch(ServerMessage):
     The ticket/search id is a random number generated by the client and is
     used to track the search results. """
 
+    pack_fields = (
+        ("suser", STRING),
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+    unpack_fields = (
+        ("user", STRING),
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+
     def __init__(self, user=None, requestid=None, text=None):
         self.suser = user
         self.searchid = requestid
         self.searchterm = text
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.suser))
-        msg.extend(self.pack_object(self.searchid, unsignedint=True))
-        msg.extend(self.pack_object(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
 
 class AddThingILike(ServerMessage):
     """ Server code: 51 """
     """ We send this to the server when we add an item to our likes list. """
 
+    pack_fields = (("thing", STRING),)
+
     def __init__(self, thing=None):
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
 
 class RemoveThingILike(ServerMessage):
     """ Server code: 52 """
     """ We send this to the server when we remove an item from our likes list. """
 
+    pack_fields = (("thing", STRING),)
+
     def __init__(self, thing=None):
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
 
 class Recommendations(ServerMessage):
     """ Server code: 54 """
     """ The server sends us a list of personal recommendations and a number
     for each. """
 
+    pack_fields = ()
+
     def __init__(self):
         self.recommendations = None
         self.unrecommendations = None
 
-    def make_network_message(self):
-        return b""
-
     def parse_network_message(self, message):
         self.unpack_recommendations(message)
 
@@ -874,15 +1106,13 @@ class UserInterests(ServerMessage):
     """ We ask the server for a user's liked and hated interests. The server
     responds with a list of interests. """
 
+    pack_fields = (("user", STRING),)
+
     def __init__(self, user=None):
         self.user = user
         self.likes = None
         self.hates = None
 
-    def make_network_message(self):
-        # Request a users' interests
-        return self.pack_object(self.user)
-
     def parse_network_message(self, message, pos=0):
         # Receive a users' interests
         pos, self.user = self.get_object(message, bytes, pos)
@@ -904,39 +1134,35 @@ class PlaceInLineResponse(ServerMessage):
     """ Server sends this to indicate change in place in queue while we're
     waiting for files from other peer. DEPRECATED """
 
+    pack_fields = (
+        ("user", STRING),
+        ("req", UINT32),
+        ("place", UINT32)
+    )
+    unpack_fields = (
+        ("user", STRING),
+        ("req", UINT32),
+        ("place", UINT32)
+    )
+
     def __init__(self, user=None, req=None, place=None):
         self.req = req
         self.user = user
         self.place = place
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.req, unsignedint=True))
-        msg.extend(self.pack_object(self.place, unsignedint=True))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.req = self.get_object(message, int, pos)
-        pos, self.place = self.get_object(message, int, pos)
-
 
 class RoomAdded(ServerMessage):
     """ Server code: 62 """
     """ The server tells us a new room has been added. """
 
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
+    unpack_fields = (("room", STRING),)
 
 
 class RoomRemoved(ServerMessage):
     """ Server code: 63 """
     """ The server tells us a room has been removed. """
 
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
+    unpack_fields = (("room", STRING),)
 
 
 class RoomList(ServerMessage):
@@ -945,8 +1171,7 @@ class RoomList(ServerMessage):
     them. Soulseek has a room size requirement of about 50 users when
     first connecting. Refreshing the list will download all rooms. """
 
-    def make_network_message(self):
-        return b""
+    pack_fields = ()
 
     def parse_network_message(self, message):
         pos, numrooms = self.get_object(message, int)
@@ -1000,8 +1225,7 @@ class AdminMessage(ServerMessage):
     """ Server code: 66 """
     """ A global message from the server admin has arrived. """
 
-    def parse_network_message(self, message):
-        self.msg = self.get_object(message, bytes)[1]
+    unpack_fields = (("msg", STRING),)
 
 
 class GlobalUserList(JoinRoom):
@@ -1019,21 +1243,19 @@ class TunneledMessage(ServerMessage):
     """ Server code: 68 """
     """ DEPRECATED """
 
+    pack_fields = (
+        ("user", STRING),
+        ("req", UINT32),
+        ("code", UINT32),
+        ("msg", STRING)
+    )
+
     def __init__(self, user=None, req=None, code=None, msg=None):
         self.user = user
         self.req = req
         self.code = code
         self.msg = msg
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.req, unsignedint=True))
-        msg.extend(self.pack_object(self.code, unsignedint=True))
-        msg.extend(self.pack_object(self.msg))
-
-        return msg
-
     def parse_network_message(self, message):
         pos, self.user = self.get_object(message, bytes)
         pos, self.code = self.get_object(message, int, pos)
@@ -1068,12 +1290,11 @@ class HaveNoParent(ServerMessage):
     If not, the server eventually sends us a PossibleParents message with a
     list of 10 possible parents to connect to. """
 
+    pack_fields = (("noparent", UINT8),)
+
     def __init__(self, noparent=None):
         self.noparent = noparent
 
-    def make_network_message(self):
-        return bytes([self.noparent])
-
 
 class SearchParent(ServerMessage):
     """ Server code: 73 """
@@ -1090,48 +1311,42 @@ class ParentMinSpeed(ServerMessage):
     """ Server code: 83 """
     """ UNUSED """
 
-    def parse_network_message(self, message):
-        pos, self.num = self.get_object(message, int)
+    unpack_fields = (("num", UINT32),)
 
 
 class ParentSpeedRatio(ParentMinSpeed):
     """ Server code: 84 """
     """ UNUSED """
 
-    def parse_network_message(self, message):
-        pos, self.num = self.get_object(message, int)
+    unpack_fields = (("num", UINT32),)
 
 
 class ParentInactivityTimeout(ServerMessage):
     """ Server code: 86 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
+    unpack_fields = (("seconds", UINT32),)
 
 
 class SearchInactivityTimeout(ServerMessage):
     """ Server code: 87 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
+    unpack_fields = (("seconds", UINT32),)
 
 
 class MinParentsInCache(ServerMessage):
     """ Server code: 88 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.num = self.get_object(message, int)
+    unpack_fields = (("num", UINT32),)
 
 
 class DistribAliveInterval(ServerMessage):
     """ Server code: 90 """
     """ DEPRECATED """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
+    unpack_fields = (("seconds", UINT32),)
 
 
 class AddToPrivileged(ServerMessage):
@@ -1139,8 +1354,7 @@ class AddToPrivileged(ServerMessage):
     """ The server sends us the username of a new privileged user, which we
     add to our list of global privileged users. """
 
-    def parse_network_message(self, message):
-        l2, self.user = self.get_object(message, bytes)
+    unpack_fields = (("user", STRING),)
 
 
 class CheckPrivileges(ServerMessage):
@@ -1148,23 +1362,21 @@ class CheckPrivileges(ServerMessage):
     """ We ask the server how much time we have left of our privileges.
     The server responds with the remaining time, in seconds. """
 
-    def make_network_message(self):
-        return b""
-
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
+    pack_fields = ()
+    unpack_fields = (("seconds", UINT32),)
 
 
 class SearchRequest(ServerMessage):
     """ Server code: 93 """
     """ The server sends us search requests from other users. """
 
-    def parse_network_message(self, message):
-        pos, self.code = 1, message[0]
-        pos, self.something = self.get_object(message, int, pos)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
+    unpack_fields = (
+        ("code", UINT8),
+        ("something", UINT32),
+        ("user", STRING),
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
 
 
 class AcceptChildren(ServerMessage):
@@ -1172,12 +1384,11 @@ class AcceptChildren(ServerMessage):
     """ We tell the server if we want to accept child nodes.
     TODO: actually use this somewhere """
 
+    pack_fields = (("enabled", UINT8),)
+
     def __init__(self, enabled=None):
         self.enabled = enabled
 
-    def make_network_message(self):
-        return bytes([self.enabled])
-
 
 class PossibleParents(ServerMessage):
     """ Server code: 102 """
@@ -1203,20 +1414,18 @@ class WishlistSearch(FileSearch):
 class WishlistInterval(ServerMessage):
     """ Server code: 104 """
 
-    def parse_network_message(self, message):
-        pos, self.seconds = self.get_object(message, int)
+    unpack_fields = (("seconds", UINT32),)
 
 
 class SimilarUsers(ServerMessage):
     """ Server code: 110 """
     """ The server sends us a list of similar users related to our interests. """
 
+    pack_fields = ()
+
     def __init__(self):
         self.users = None
 
-    def make_network_message(self):
-        return b""
-
     def parse_network_message(self, message):
         self.users = {}
         pos, num = self.get_object(message, int)
@@ -1232,13 +1441,12 @@ class ItemRecommendations(GlobalRecommendations):
     item, which is usually present in the like/dislike list or an existing
     recommendation list. """
 
+    pack_fields = (("thing", STRING),)
+
     def __init__(self, thing=None):
         GlobalRecommendations.__init__(self)
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
     def parse_network_message(self, message):
         pos, self.thing = self.get_object(message, bytes)
         self.unpack_recommendations(message, pos)
@@ -1249,13 +1457,12 @@ class ItemSimilarUsers(ServerMessage):
     """ The server sends us a list of similar users related to a specific item,
     which is usually present in the like/dislike list or recommendation list. """
 
+    pack_fields = (("thing", STRING),)
+
     def __init__(self, thing=None):
         self.thing = thing
         self.users = None
 
-    def make_network_message(self):
-        return self.pack_object(self.thing)
-
     def parse_network_message(self, message):
         self.users = []
         pos, self.thing = self.get_object(message, bytes)
@@ -1293,16 +1500,17 @@ class RoomTickerAdd(ServerMessage):
     Tickers are customizable, user-specific messages that appear in a
     banner at the top of a chat room. """
 
+    unpack_fields = (
+        ("room", STRING),
+        ("user", STRING),
+        ("msg", STRING)
+    )
+
     def __init__(self):
         self.room = None
         self.user = None
         self.msg = None
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
 class RoomTickerRemove(ServerMessage):
     """ Server code: 115 """
@@ -1311,14 +1519,15 @@ class RoomTickerRemove(ServerMessage):
     Tickers are customizable, user-specific messages that appear in a
     banner at the top of a chat room. """
 
+    unpack_fields = (
+        ("room", STRING),
+        ("user", STRING)
+    )
+
     def __init__(self, room=None):
         self.user = None
         self.room = room
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-
 
 class RoomTickerSet(ServerMessage):
     """ Server code: 116 """
@@ -1328,17 +1537,15 @@ class RoomTickerSet(ServerMessage):
     Tickers are customizable, user-specific messages that appear in a
     banner at the top of a chat room. """
 
+    pack_fields = (
+        ("room", STRING),
+        ("msg", STRING)
+    )
+
     def __init__(self, room=None, msg=""):
         self.room = room
         self.msg = msg
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.room))
-        msg.extend(self.pack_object(self.msg))
-
-        return msg
-
 
 class AddThingIHate(AddThingILike):
     """ Server code: 117 """
@@ -1355,24 +1562,22 @@ class RemoveThingIHate(RemoveThingILike):
 class RoomSearch(ServerMessage):
     """ Server code: 120 """
 
+    pack_fields = (
+        ("room", STRING),
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+    unpack_fields = (
+        ("room", STRING),
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+
     def __init__(self, room=None, requestid=None, text=""):
         self.room = room
         self.searchid = requestid
         self.searchterm = ' '.join([x for x in text.split() if x != '-'])
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.room))
-        msg.extend(self.pack_object(self.searchid, unsignedint=True))
-        msg.extend(self.pack_object(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.searchid = self.get_object(message, int, pos)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
     def __repr__(self):
         return "RoomSearch(room=%s, requestid=%s, text=%s)" % (self.room, self.searchid, self.searchterm)
 
@@ -1382,24 +1587,22 @@ class SendUploadSpeed(ServerMessage):
     """ We send this after a finished upload to let the server update the speed
     statistics for ourselves. """
 
+    pack_fields = (("speed", UINT32),)
+
     def __init__(self, speed=None):
         self.speed = speed
 
-    def make_network_message(self):
-        return self.pack_object(self.speed, unsignedint=True)
-
 
 class UserPrivileged(ServerMessage):
     """ Server code: 122 """
     """ We ask the server whether a user is privileged or not. """
 
+    pack_fields = (("user", STRING),)
+
     def __init__(self, user=None):
         self.user = user
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_object(self.user)
-
     def parse_network_message(self, message):
         pos, self.user = self.get_object(message, bytes, 0)
         pos, self.privileged = pos + 1, bool(message[pos])
@@ -1410,73 +1613,63 @@ class GivePrivileges(ServerMessage):
     """ We give (part of) our privileges, specified in days, to another
     user on the network. """
 
+    pack_fields = (
+        ("user", STRING),
+        ("days", INT32)
+    )
+
     def __init__(self, user=None, days=None):
         self.user = user
         self.days = days
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.days))
-
-        return msg
-
 
 class NotifyPrivileges(ServerMessage):
     """ Server code: 124 """
     """ Server tells us something about privileges. """
 
+    pack_fields = (
+        ("token", INT32),
+        ("user", STRING)
+    )
+    unpack_fields = (
+        ("token", UINT32),
+        ("user", STRING)
+    )
+
     def __init__(self, token=None, user=None):
         self.token = token
         self.user = user
 
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-        pos, self.user = self.get_object(message, bytes, pos)
-
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.token))
-        msg.extend(self.pack_object(self.user))
-
-        return msg
-
 
 class AckNotifyPrivileges(ServerMessage):
     """ Server code: 125 """
 
+    pack_fields = (("token", UINT32),)
+    unpack_fields = (("token", UINT32),)
+
     def __init__(self, token=None):
         self.token = token
 
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-
-    def make_network_message(self):
-        return self.pack_object(self.token, unsignedint=True)
-
 
 class BranchLevel(ServerMessage):
     """ Server code: 126 """
     """ TODO: implement fully """
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
+    unpack_fields = (("value", UINT32),)
 
 
 class BranchRoot(ServerMessage):
     """ Server code: 127 """
     """ TODO: implement fully """
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
+    unpack_fields = (("user", STRING),)
 
 
 class ChildDepth(ServerMessage):
     """ Server code: 129 """
     """ TODO: implement fully """
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
+    unpack_fields = (("value", UINT32),)
 
 
 class PrivateRoomUsers(ServerMessage):
@@ -1517,21 +1710,19 @@ class PrivateRoomAddUser(ServerMessage):
     """ Server code: 134 """
     """ We send this to inform the server that we've added a user to a private room. """
 
+    pack_fields = (
+        ("room", STRING),
+        ("user", STRING)
+    )
+    unpack_fields = (
+        ("room", STRING),
+        ("user", STRING)
+    )
+
     def __init__(self, room=None, user=None):
         self.room = room
         self.user = user
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.room))
-        msg.extend(self.pack_object(self.user))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-
 
 class PrivateRoomRemoveUser(PrivateRoomAddUser):
     """ Server code: 135 """
@@ -1543,48 +1734,42 @@ class PrivateRoomDismember(ServerMessage):
     """ Server code: 136 """
     """ We send this to the server to remove our own membership of a private room. """
 
+    pack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
 
 class PrivateRoomDisown(ServerMessage):
     """ Server code: 137 """
     """ We send this to the server to stop owning a private room. """
 
+    pack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
 
 class PrivateRoomSomething(ServerMessage):
     """ Server code: 138 """
     """ UNKNOWN """
 
+    pack_fields = (("room", STRING),)
+    unpack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-
 
 class PrivateRoomAdded(ServerMessage):
     """ Server code: 139 """
     """ The server sends us this message when we are added to a private room. """
 
+    unpack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def parse_network_message(self, message):
-        self.room = self.get_object(message, bytes)[1]
-
 
 class PrivateRoomRemoved(PrivateRoomAdded):
     """ Server code: 140 """
@@ -1596,12 +1781,11 @@ class PrivateRoomToggle(ServerMessage):
     """ Server code: 141 """
     """ We send this when we want to enable or disable invitations to private rooms. """
 
+    pack_fields = (("enabled", UINT8),)
+
     def __init__(self, enabled=None):
         self.enabled = None if enabled is None else int(enabled)
 
-    def make_network_message(self):
-        return bytes([self.enabled])
-
     def parse_network_message(self, message):
         # When this is received, we store it in the config, and disable the appropriate menu item
         pos, self.enabled = 1, bool(int(message[0]))  # noqa: F841
@@ -1612,15 +1796,12 @@ class ChangePassword(ServerMessage):
     """ We send this to the server to change our password. We receive a
     response if our password changes. """
 
+    pack_fields = (("password", STRING),)
+    unpack_fields = (("password", STRING),)
+
     def __init__(self, password=None):
         self.password = password
 
-    def make_network_message(self):
-        return self.pack_object(self.password)
-
-    def parse_network_message(self, message):
-        pos, self.password = self.get_object(message, bytes)
-
 
 class PrivateRoomAddOperator(PrivateRoomAddUser):
     """ Server code: 143 """
@@ -1639,27 +1820,23 @@ class PrivateRoomOperatorAdded(ServerMessage):
     """ The server send us this message when we're given operator abilities
     in a private room. """
 
+    unpack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-
 
 class PrivateRoomOperatorRemoved(ServerMessage):
     """ Server code: 146 """
     """ The server send us this message when our operator abilities are removed
     in a private room. """
 
+    pack_fields = (("room", STRING),)
+    unpack_fields = (("room", STRING),)
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_object(self.room)
-
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-
 
 class PrivateRoomOwned(ServerMessage):
     """ Server code: 148 """
@@ -1684,8 +1861,7 @@ class JoinPublicRoom(ServerMessage):
     """ We ask the server to send us messages from all public rooms, also
     known as public chat. """
 
-    def make_network_message(self):
-        return b""
+    pack_fields = ()
 
 
 class LeavePublicRoom(ServerMessage):
@@ -1693,8 +1869,7 @@ class LeavePublicRoom(ServerMessage):
     """ We ask the server to stop sending us messages from all public rooms,
     also known as public chat. """
 
-    def make_network_message(self):
-        return b""
+    pack_fields = ()
 
 
 class PublicRoomMessage(ServerMessage):
@@ -1702,10 +1877,11 @@ class PublicRoomMessage(ServerMessage):
     """ The server sends this when a new message has been written in a public
     room (every single line written in every public room). """
 
-    def parse_network_message(self, message):
-        pos, self.room = self.get_object(message, bytes)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
+    unpack_fields = (
+        ("room", STRING),
+        ("user", STRING),
+        ("msg", STRING)
+    )
 
 
 class CantConnectToPeer(ServerMessage):
@@ -1715,28 +1891,16 @@ class CantConnectToPeer(ServerMessage):
     this. This message means a connection can't be established either way.
     """
 
+    pack_fields = (
+        ("token", UINT32),
+        ("user", STRING)
+    )
+    unpack_fields = (("token", UINT32),)
+
     def __init__(self, token=None, user=None):
         self.token = token
         self.user = user
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.token, unsignedint=True))
-        msg.extend(self.pack_object(self.user))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-
-# These are probably leftovers, not sure what to do with them
-
-
-# class CantCreateRoom(ServerMessage):
-    # """ Server tells us a new room cannot be created"""
-    # def parseNetworkMessage(self, message):
-        # self.room = self.getObject(message, types.StringType)[1]
-
 
 """
 Peer Messages
@@ -1752,16 +1916,13 @@ class PierceFireWall(PeerMessage):
     connection, if it has been asked by the other peer to do so. The token
     is taken from the ConnectToPeer server message. """
 
+    pack_fields = (("token", UINT32),)
+    unpack_fields = (("token", UINT32),)
+
     def __init__(self, conn, token=None):
         self.conn = conn
         self.token = token
 
-    def make_network_message(self):
-        return self.pack_object(self.token, unsignedint=True)
-
-    def parse_network_message(self, message):
-        pos, self.token = self.get_object(message, int)
-
 
 class PeerInit(PeerMessage):
     """ This message is sent by the peer that initiated a connection,
@@ -1769,40 +1930,34 @@ class PeerInit(PeerMessage):
     can be anything. Type is 'P' if it's anything but filetransfer,
     'F' otherwise. """
 
+    pack_fields = (
+        ("user", STRING),
+        ("type", STRING),
+        ("token", UINT32)
+    )
+    unpack_fields = (
+        ("user", STRING),
+        ("type", STRING),
+        ("token", UINT32)
+    )
+
     def __init__(self, conn, user=None, type=None, token=None):
         self.conn = conn
         self.user = user
         self.type = type
         self.token = token
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.user))
-        msg.extend(self.pack_object(self.type))
-        msg.extend(self.pack_object(self.token, unsignedint=True))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-        pos, self.type = self.get_object(message, bytes, pos)
-        pos, self.token = self.get_object(message, int, pos)
-
 
 class GetSharedFileList(PeerMessage):
     """ Peer code: 4 """
     """ We send this to a peer to ask for a list of shared files. """
 
+    pack_fields = ()
+    unpack_fields = ()
+
     def __init__(self, conn):
         self.conn = conn
 
-    def make_network_message(self):
-        return b""
-
-    def parse_network_message(self, message):
-        # Empty message
-        pass
-
 
 class SharedFileList(PeerMessage):
     """ Peer code: 5 """
@@ -1825,45 +1980,7 @@ class SharedFileList(PeerMessage):
             self.list = {}
 
     def _parse_network_message(self, message):
-        shares = []
-        pos, ndir = self.get_object(message, int)
-
-        for i in range(ndir):
-            pos, directory = self.get_object(message, bytes, pos)
-            pos, nfiles = self.get_object(message, int, pos)
-
-            files = []
-
-            for j in range(nfiles):
-                pos, code = pos + 1, message[pos]
-                pos, name = self.get_object(message, bytes, pos)
-                pos, size = self.get_object(message, int, pos, getunsignedlonglong=True, printerror=False)
-
-                if message[pos - 1] == '\xff':
-                    # Buggy SLSK?
-                    # Some file sizes will be huge if unpacked as a signed
-                    # LongType, namely somewhere in the area of 17179869 Terabytes.
-                    # It would seem these files are indeed big, but in the Gigabyte range.
-                    # The following will undo the damage (and if we fuck up it
-                    # doesn't matter, it can never be worse than reporting 17
-                    # exabytes for a single file)
-                    size = struct.unpack("Q", '\xff' * struct.calcsize("Q"))[0] - size
-
-                pos, ext = self.get_object(message, bytes, pos, printerror=False)
-                pos, numattr = self.get_object(message, int, pos, printerror=False)
-
-                attrs = []
-
-                for k in range(numattr):
-                    pos, attrnum = self.get_object(message, int, pos, printerror=False)
-                    pos, attr = self.get_object(message, int, pos, printerror=False)
-                    attrs.append(attr)
-
-                files.append((code, name, size, ext, attrs))
-
-            shares.append((directory, files))
-
-        self.list = shares
+        self.list = FileListIndex(message)
 
     def make_network_message(self, nozlib=0, rebuild=False):
         # Elaborate hack, to save CPU
@@ -1898,22 +2015,20 @@ class FileSearchRequest(PeerMessage):
     Alternatively, the peer sends this to tell us it is
     searching for a file. """
 
+    pack_fields = (
+        ("requestid", UINT32),
+        ("text", STRING)
+    )
+    unpack_fields = (
+        ("searchid", UINT32),
+        ("searchterm", STRING)
+    )
+
     def __init__(self, conn, requestid=None, text=None):
         self.conn = conn
         self.requestid = requestid
         self.text = text
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.requestid, unsignedint=True))
-        msg.extend(self.pack_object(self.text))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.searchid = self.get_object(message, int)
-        pos, self.searchterm = self.get_object(message, bytes, pos)
-
 
 class FileSearchResult(PeerMessage):
     """ Peer code: 9 """
@@ -1945,6 +2060,21 @@ class FileSearchResult(PeerMessage):
             log.add_warning(_("Exception during parsing %(area)s: %(exception)s"), {'area': 'FileSearchResult', 'exception': error})
             self.list = {}
 
+    def parse_network_message_header(self, message):
+        """ Decompresses only as much of the message as needed to read the user,
+        token and number of results at its start. Returns the token and number of
+        results, so that unwanted results can be dropped without parsing them. """
+
+        decompressor = zlib.decompressobj()
+        header = decompressor.decompress(message, 4)
+        header += decompressor.decompress(decompressor.unconsumed_tail, UINT32_STRUCT.unpack(header)[0] + 8)
+
+        pos, self.user = self.get_object(header, bytes)
+        pos, self.token = self.get_object(header, int, pos)
+        pos, numresults = self.get_object(header, int, pos)
+
+        return self.token, numresults
+
     def _parse_network_message(self, message):
         self.pos, self.user = self.get_object(message, bytes)
         self.pos, self.token = self.get_object(message, int, self.pos)
@@ -2015,22 +2145,22 @@ class UserInfoRequest(PeerMessage):
     """ We ask the other peer to send us their user information, picture
     and all."""
 
+    pack_fields = ()
+    unpack_fields = ()
+
     def __init__(self, conn):
         self.conn = conn
 
-    def make_network_message(self):
-        return b""
-
-    def parse_network_message(self, message):
-        # Empty message
-        pass
-
 
 class UserInfoReply(PeerMessage):
     """ Peer code: 16 """
     """ A peer responds with this when we've sent a UserInfoRequest. """
 
-    def __init__(self, conn, descr=None, pic=None, totalupl=None, queuesize=None, slotsavail=None, uploadallowed=None):
+    """ totalupl, queuesize, slotsavail and uploadallowed, which follow the
+    description and picture """
+    STATS_STRUCT = struct.Struct("<IIBI")
+
+    def __init__(self, conn, descr=None, pic=None, totalupl=None, queuesize=None, slotsavail=None, uploadallowed=None, header=None):
         self.conn = conn
         self.descr = descr
         self.pic = pic
@@ -2038,6 +2168,7 @@ class UserInfoReply(PeerMessage):
         self.queuesize = queuesize
         self.slotsavail = slotsavail
         self.uploadallowed = uploadallowed
+        self.header = header
 
     def parse_network_message(self, message):
         pos, self.descr = self.get_object(message, bytes)
@@ -2051,7 +2182,11 @@ class UserInfoReply(PeerMessage):
         if len(message[pos:]) >= 4:
             pos, self.uploadallowed = self.get_object(message, int, pos)
 
-    def make_network_message(self):
+    def make_header(self):
+        """ Packs the description and picture. These rarely change, so the
+        result can be passed as the header of later replies, which then only
+        pack their upload stats. """
+
         msg = bytearray()
         msg.extend(self.pack_object(self.descr))
 
@@ -2061,12 +2196,15 @@ class UserInfoReply(PeerMessage):
         else:
             msg.extend(bytes([0]))
 
-        msg.extend(self.pack_object(self.totalupl, unsignedint=True))
-        msg.extend(self.pack_object(self.queuesize, unsignedint=True))
-        msg.extend(bytes([self.slotsavail]))
-        msg.extend(self.pack_object(self.uploadallowed, unsignedint=True))
+        return bytes(msg)
 
-        return msg
+    def make_network_message(self):
+        header = self.header
+
+        if header is None:
+            header = self.make_header()
+
+        return header + self.STATS_STRUCT.pack(self.totalupl, self.queuesize, self.slotsavail, self.uploadallowed)
 
 
 class PMessageUser(PeerMessage):
@@ -2074,6 +2212,13 @@ class PMessageUser(PeerMessage):
     """ Chat phrase sent to someone or received by us in private.
     This is a Nicotine+ extension to the Soulseek protocol. """
 
+    unpack_fields = (
+        ("msgid", UINT32),
+        ("timestamp", UINT32),
+        ("user", STRING),
+        ("msg", STRING)
+    )
+
     def __init__(self, conn=None, user=None, msg=None):
         self.conn = conn
         self.user = user
@@ -2085,17 +2230,16 @@ class PMessageUser(PeerMessage):
                 self.pack_object(self.user) +
                 self.pack_object(self.msg))
 
-    def parse_network_message(self, message):
-        pos, self.msgid = self.get_object(message, int)
-        pos, self.timestamp = self.get_object(message, int, pos)
-        pos, self.user = self.get_object(message, bytes, pos)
-        pos, self.msg = self.get_object(message, bytes, pos)
-
 
 class FolderContentsRequest(PeerMessage):
     """ Peer code: 36 """
     """ We ask the peer to send us the contents of a single folder. """
 
+    unpack_fields = (
+        ("something", UINT32),
+        ("dir", STRING)
+    )
+
     def __init__(self, conn, directory=None):
         self.conn = conn
         self.dir = directory
@@ -2107,20 +2251,17 @@ class FolderContentsRequest(PeerMessage):
 
         return msg
 
-    def parse_network_message(self, message):
-        pos, self.something = self.get_object(message, int)
-        pos, self.dir = self.get_object(message, bytes, pos)
-
 
 class FolderContentsResponse(PeerMessage):
     """ Peer code: 37 """
     """ A peer responds with the contents of a particular folder
     (with all subfolders) when we've sent a FolderContentsRequest. """
 
-    def __init__(self, conn, directory=None, shares=None):
+    def __init__(self, conn, directory=None, shares=None, built=None):
         self.conn = conn
         self.dir = directory
         self.list = shares
+        self.built = built
 
     def parse_network_message(self, message):
         try:
@@ -2137,35 +2278,16 @@ class FolderContentsResponse(PeerMessage):
         for h in range(nfolders):
             pos, folder = self.get_object(message, bytes, pos)
 
-            shares[folder] = {}
-
-            pos, ndir = self.get_object(message, int, pos)
-
-            for i in range(ndir):
-                pos, directory = self.get_object(message, bytes, pos)
-                pos, nfiles = self.get_object(message, int, pos)
-
-                shares[folder][directory] = []
-
-                for j in range(nfiles):
-                    pos, code = pos + 1, message[pos]
-                    pos, name = self.get_object(message, bytes, pos, printerror=False)
-                    pos, size = self.get_object(message, int, pos, getunsignedlonglong=True, printerror=False)
-                    pos, ext = self.get_object(message, bytes, pos, printerror=False)
-                    pos, numattr = self.get_object(message, int, pos, printerror=False)
-
-                    attrs = []
-
-                    for k in range(numattr):
-                        pos, attrnum = self.get_object(message, int, pos, printerror=False)
-                        pos, attr = self.get_object(message, int, pos, printerror=False)
-                        attrs.append(attr)
-
-                    shares[folder][directory].append((code, name, size, ext, attrs))
+            shares[folder] = FileListIndex(message, pos)
+            pos = shares[folder].end
 
         self.list = shares
 
     def make_network_message(self):
+        # Shares keeps the compressed contents of recently requested folders
+        if self.built is not None:
+            return self.built
+
         msg = bytearray()
         msg.extend(self.pack_object(1))
         msg.extend(self.pack_object(self.dir))
@@ -2248,16 +2370,13 @@ class PlaceholdUpload(PeerMessage):
     """ Peer code: 42 """
     """ DEPRECATED """
 
+    pack_fields = (("file", STRING),)
+    unpack_fields = (("file", STRING),)
+
     def __init__(self, conn, file=None):
         self.conn = conn
         self.file = file
 
-    def make_network_message(self):
-        return self.pack_object(self.file)
-
-    def parse_network_message(self, message):
-        pos, self.file = self.get_object(message, bytes)
-
 
 class QueueUpload(PlaceholdUpload):
     """ Peer code: 43 """
@@ -2267,22 +2386,20 @@ class QueueUpload(PlaceholdUpload):
 class PlaceInQueue(PeerMessage):
     """ Peer code: 44 """
 
+    pack_fields = (
+        ("filename", STRING),
+        ("place", UINT32)
+    )
+    unpack_fields = (
+        ("filename", STRING),
+        ("place", UINT32)
+    )
+
     def __init__(self, conn, filename=None, place=None):
         self.conn = conn
         self.filename = filename
         self.place = place
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.filename))
-        msg.extend(self.pack_object(self.place, unsignedint=True))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.filename = self.get_object(message, bytes)
-        pos, self.place = self.get_object(message, int, pos)
-
 
 class UploadFailed(PlaceholdUpload):
     """ Peer code: 46 """
@@ -2292,22 +2409,20 @@ class UploadFailed(PlaceholdUpload):
 class QueueFailed(PeerMessage):
     """ Peer code: 50 """
 
+    pack_fields = (
+        ("file", STRING),
+        ("reason", STRING)
+    )
+    unpack_fields = (
+        ("file", STRING),
+        ("reason", STRING)
+    )
+
     def __init__(self, conn, file=None, reason=None):
         self.conn = conn
         self.file = file
         self.reason = reason
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_object(self.file))
-        msg.extend(self.pack_object(self.reason))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.file = self.get_object(message, bytes)
-        pos, self.reason = self.get_object(message, bytes, pos)
-
 
 class PlaceInQueueRequest(PlaceholdUpload):
     """ Peer code: 51 """
@@ -2317,40 +2432,33 @@ class PlaceInQueueRequest(PlaceholdUpload):
 class UploadQueueNotification(PeerMessage):
     """ Peer code: 52 """
 
+    pack_fields = ()
+    unpack_fields = ()
+
     def __init__(self, conn):
         self.conn = conn
 
-    def make_network_message(self):
-        return b""
-
-    def parse_network_message(self, message):
-        return b""
-
 
 class UnknownPeerMessage(PeerMessage):
     """ Peer code: 12547 """
     """ UNKNOWN """
 
+    unpack_fields = ()
+
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        # Empty message
-        pass
-
 
 class FileRequest(PeerMessage):
     """ Request a file from peer, or tell a peer that we want to send a file to
     them. """
 
+    pack_fields = (("req", INT32),)
+
     def __init__(self, conn, req=None):
         self.conn = conn
         self.req = req
 
-    def make_network_message(self):
-        msg = self.pack_object(self.req)
-        return msg
-
 
 """
 Distributed Messages
@@ -2364,13 +2472,11 @@ class DistribMessage(SlskMessage):
 class DistribAlive(DistribMessage):
     """ Distrib code: 0 """
 
+    unpack_fields = ()
+
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        # Empty message
-        pass
-
 
 class DistribSearch(DistribMessage):
     """ Distrib code: 3 """
@@ -2406,34 +2512,31 @@ class DistribBranchLevel(DistribMessage):
     """ Distrib code: 4 """
     """ TODO: implement fully """
 
+    unpack_fields = (("value", UINT32),)
+
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
-
 
 class DistribBranchRoot(DistribMessage):
     """ Distrib code: 5 """
     """ TODO: implement fully """
 
+    unpack_fields = (("user", STRING),)
+
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        pos, self.user = self.get_object(message, bytes)
-
 
 class DistribChildDepth(DistribMessage):
     """ Distrib code: 7 """
     """ TODO: implement fully """
 
+    unpack_fields = (("value", UINT32),)
+
     def __init__(self, conn):
         self.conn = conn
 
-    def parse_network_message(self, message):
-        pos, self.value = self.get_object(message, int)
-
 
 class DistribServerSearch(DistribMessage):
     """ Distrib code: 93 """
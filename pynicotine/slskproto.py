@@ -22,6 +22,7 @@
 This module implements Soulseek networking protocol.
 """
 
+import heapq
 import selectors
 import socket
 import struct
@@ -29,9 +30,12 @@ import sys
 import threading
 import time
 
+from collections import OrderedDict
+from collections import deque
 from errno import EINTR
 from gettext import gettext as _
-from itertools import islice
+from itertools import count
+from queue import Queue
 from random import uniform
 
 from pynicotine.logfacility import log
@@ -59,6 +63,7 @@ from pynicotine.slskmessages import DistribChildDepth
 from pynicotine.slskmessages import DistribSearch
 from pynicotine.slskmessages import DistribServerSearch
 from pynicotine.slskmessages import DownloadFile
+from pynicotine.slskmessages import DropSearchResults
 from pynicotine.slskmessages import ExactFileSearch
 from pynicotine.slskmessages import FileError
 from pynicotine.slskmessages import FileRequest
@@ -148,6 +153,8 @@ from pynicotine.slskmessages import ServerPing
 from pynicotine.slskmessages import SetCurrentConnectionCount
 from pynicotine.slskmessages import SetDownloadLimit
 from pynicotine.slskmessages import SetGeoBlock
+from pynicotine.slskmessages import SetPeerPoolSize
+from pynicotine.slskmessages import SetIPBlockList
 from pynicotine.slskmessages import SetStatus
 from pynicotine.slskmessages import SetUploadLimit
 from pynicotine.slskmessages import SetWaitPort
@@ -170,27 +177,173 @@ from pynicotine.slskmessages import UserPrivileged
 from pynicotine.slskmessages import UserSearch
 from pynicotine.slskmessages import WishlistInterval
 from pynicotine.slskmessages import WishlistSearch
+from pynicotine.utils import IPAddressList
 
 
-# Set our actual file limit to the OS's hard limit as a failsafe
-# If this limit is set too close to our artificial MAXFILELIMIT
-# limit, Nicotine+ will freak out due to too many open files
+def raise_file_limit():
+    """ Raises our soft limit of open files as far as the OS allows, and returns it.
+    macOS reports an unlimited hard limit, but refuses soft limits above OPEN_MAX. """
+
+    import resource
+    softlimit, hardlimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    for limit in (hardlimit, 10240):
+        if softlimit != resource.RLIM_INFINITY and (limit == resource.RLIM_INFINITY or limit > softlimit):
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hardlimit))
+                break
+            except (OSError, ValueError):
+                pass
+
+    softlimit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+    if softlimit == resource.RLIM_INFINITY:
+        return 10240
+
+    return softlimit
+
+
+# Set our artificial socket limit. If this limit is set too close to the limit
+# of open files, Nicotine+ will freak out due to too many open files, since each
+# file transfer also keeps a file open.
 if sys.platform == "win32":
 
     # For Windows, FD_SETSIZE is set to 512 in Python
     MAXFILELIMIT = int(512 * 0.9)
 else:
-    import resource
-    softlimit, hardlimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    MAXFILELIMIT = max(int(raise_file_limit() * 0.75), 50)
+
+    if selectors.DefaultSelector is selectors.SelectSelector:
+        # select() can't handle file descriptors above FD_SETSIZE (1024)
+        MAXFILELIMIT = min(MAXFILELIMIT, 1024)
+
+# Part of the socket limit that peer connections for browsing, searching and
+# chatting can't use, to prevent bursts of such connections from starving
+# file transfers
+TRANSFER_SOCKET_RESERVE = max(MAXFILELIMIT // 4, 10)
+
+
+class TokenBucket:
+    """ Token bucket used for bandwidth shaping. Tokens are bytes, refilled at a rate
+    of 'rate' bytes per second based on a monotonic clock, and capped to a short burst.
+    A bucket can have a parent bucket (e.g. transfer -> global), in which case data is
+    only allowed through if every bucket in the chain has tokens left. A rate of None
+    means the bucket itself is unlimited. A capacity can be given to allow larger
+    bursts, e.g. when tokens are requests rather than bytes. """
+
+    __slots__ = "rate", "capacity", "tokens", "lastrefill", "parent"
+
+    BURST_TIME = 0.25
+
+    def __init__(self, rate=None, parent=None, capacity=None):
+        self.parent = parent
+        self.set_rate(rate, capacity)
+
+    def set_rate(self, rate, capacity=None):
+        self.rate = rate or None
+
+        if self.rate is None:
+            self.capacity = self.tokens = 0
+        else:
+            self.capacity = self.tokens = capacity or max(int(self.rate * self.BURST_TIME), 1)
+
+        self.lastrefill = time.monotonic()
+
+    def refill(self, curtime):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (curtime - self.lastrefill) * self.rate)
+
+        self.lastrefill = curtime
+
+    def get_tokens(self, curtime):
+        """ Returns the number of bytes that can be transferred right now, or None
+        if no bucket in the chain is limited """
+
+        tokens = None
+        bucket = self
+
+        while bucket is not None:
+            bucket.refill(curtime)
+
+            if bucket.rate is not None and (tokens is None or bucket.tokens < tokens):
+                tokens = bucket.tokens
+
+            bucket = bucket.parent
+
+        if tokens is None:
+            return None
+
+        return max(int(tokens), 0)
+
+    def get_wait_time(self, curtime):
+        """ Returns the number of seconds until every bucket in the chain is at least
+        half full. Waiting for this avoids waking up for tiny amounts of data. """
+
+        wait_time = 0
+        bucket = self
+
+        while bucket is not None:
+            if bucket.rate is not None:
+                bucket.refill(curtime)
+                missing = bucket.capacity / 2 - bucket.tokens
+
+                if missing > 0:
+                    wait_time = max(wait_time, missing / bucket.rate)
+
+            bucket = bucket.parent
+
+        return wait_time
+
+    def consume(self, num_bytes):
+        bucket = self
+
+        while bucket is not None:
+            if bucket.rate is not None:
+                bucket.tokens -= num_bytes
 
-    try:
-        resource.setrlimit(resource.RLIMIT_NOFILE, (hardlimit, hardlimit))
-    except Exception:
-        pass
+            bucket = bucket.parent
 
-    # Set our artificial file limit to prevent freezing the GUI
-    # The max is 1024, but can be lower if the hard limit is too low
-    MAXFILELIMIT = min(max(int(hardlimit * 0.75), 50), 1024)
+
+class EventBatch:
+    """ Collects the messages a networking thread sends to the UI thread during
+    one loop iteration, and delivers them with a single callback. A progress
+    message replaces an earlier one for the same connection that was not
+    delivered yet. """
+
+    __slots__ = "callback", "msgs", "progress"
+
+    PROGRESS_MESSAGES = (PeerTransfer, DownloadFile, UploadFile)
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.msgs = []
+        self.progress = {}
+
+    def add(self, msgs):
+
+        for msg in msgs:
+            if msg.__class__ in self.PROGRESS_MESSAGES:
+                key = (msg.__class__, msg.conn)
+                index = self.progress.get(key)
+
+                if index is not None:
+                    # Superseded by the new progress message
+                    self.msgs[index] = None
+
+                self.progress[key] = len(self.msgs)
+
+            self.msgs.append(msg)
+
+    def flush(self):
+
+        if not self.msgs:
+            return
+
+        msgs = [msg for msg in self.msgs if msg is not None]
+
+        self.msgs = []
+        self.progress.clear()
+        self.callback(msgs)
 
 
 class Connection:
@@ -198,15 +351,23 @@ class Connection:
     Holds data about a connection. conn is a socket object,
     addr is (ip, port) pair, ibuf and obuf are input and output msgBuffer,
     init is a PeerInit object (see slskmessages docstrings).
+    Large messages are queued separately in bulkbuf, so that they don't delay
+    the small messages in obuf. bulkframe is the remaining part of the large
+    message currently being sent. highwatertime is the time pending output
+    went above the high-water mark, or the last time any of it was sent since.
     """
 
-    __slots__ = "conn", "addr", "ibuf", "obuf", "init", "lastactive", "lastreadlength"
+    __slots__ = "conn", "addr", "ibuf", "obuf", "bulkbuf", "bulkframe", "init", "lastactive", "lastreadlength", \
+                "highwatertime"
 
     def __init__(self, conn=None, addr=None):
         self.conn = conn
         self.addr = addr
         self.ibuf = bytearray()
         self.obuf = bytearray()
+        self.bulkbuf = deque()
+        self.bulkframe = None
+        self.highwatertime = None
         self.init = None
         self.lastactive = time.time()
         self.lastreadlength = 100 * 1024
@@ -215,7 +376,7 @@ class Connection:
 class PeerConnection(Connection):
 
     __slots__ = "filereq", "filedown", "fileupl", "filereadbytes", "bytestoread", "piercefw", \
-                "lastcallback", "starttime", "sentbytes2", "readbytes2"
+                "lastcallback", "lastprogressbytes", "bucket", "parsejob"
 
     def __init__(self, conn=None, addr=None, init=None):
         Connection.__init__(self, conn, addr)
@@ -228,23 +389,601 @@ class PeerConnection(Connection):
         self.piercefw = None
         self.lastactive = time.time()
         self.lastcallback = time.time()
+        self.lastprogressbytes = 0
+        self.bucket = None  # Used for bandwidth management of transfers
+        self.parsejob = None  # Last message handed to a MessageParserPool
+
+
+class PeerConnectionInProgress:
+    """ As all p2p connect()s are non-blocking, this class is used to
+    hold data about a connection that is not yet established. msgObj is
+    a message to be sent after the connection has been established.
+    """
+    __slots__ = "conn", "msg_obj", "lastactive"
+
+    def __init__(self, conn=None, msg_obj=None):
+        self.conn = conn
+        self.msg_obj = msg_obj
+        self.lastactive = time.time()
+
+
+class ParseJob:
+    """ A peer message handed to a MessageParserPool. done is set once the parsed
+    message has been delivered to the UI thread. """
+
+    __slots__ = "done"
+
+    def __init__(self):
+        self.done = False
+
+
+class MessageParserPool:
+    """ Worker threads that decompress and parse large peer messages, such as
+    shared file lists and search results, so that the networking thread can keep
+    serving other sockets in the meantime. Parsed messages are delivered to the
+    UI thread directly. All messages of a connection are parsed by the same
+    worker, in the order they arrived. Events that must not overtake them, such
+    as the connection being closed, are delivered by that worker as well.
+    """
+
+    NUM_WORKERS = 2
+
+    def __init__(self, ui_callback, parse_callback):
+
+        self._ui_callback = ui_callback
+        self._parse_callback = parse_callback
+        self._queues = [Queue() for i in range(self.NUM_WORKERS)]
+
+        for queue in self._queues:
+            thread = threading.Thread(target=self._run, args=(queue,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def put(self, conn, msg, msgsize, data):
+        """ Called by SlskProtoThread to parse msg from data, the raw message
+        contents. Returns the ParseJob of the message. """
+
+        job = ParseJob()
+        self._queues[hash(conn) % self.NUM_WORKERS].put((job, conn, msg, msgsize, data))
+
+        return job
+
+    def put_events(self, conn, msgs):
+        """ Delivers msgs to the UI thread after the messages of conn that are
+        still being parsed. Returns the ParseJob of the events. """
+
+        job = ParseJob()
+        self._queues[hash(conn) % self.NUM_WORKERS].put((job, conn, None, None, msgs))
+
+        return job
+
+    def _run(self, queue):
+
+        jobs = []
+        msgs = []
+
+        while True:
+            job, conn, msg, msgsize, data = queue.get()
+
+            if job is None:
+                break
+
+            if msg is None:
+                # Events of the connection, such as ConnClose
+                msgs.extend(data)
+
+            else:
+                try:
+                    msgs.append(self._parse_callback(conn, msg, msgsize, data))
+
+                except Exception as error:
+                    msgs.append("Error in message function: %s" % error)
+
+            jobs.append(job)
+
+            if not queue.empty():
+                # Deliver messages parsed in a row together
+                continue
+
+            if msgs:
+                self._ui_callback(msgs)
+
+            for job in jobs:
+                job.done = True
+
+            jobs = []
+            msgs = []
+
+    def abort(self):
+        """ Call this to stop the worker threads """
+
+        for queue in self._queues:
+            queue.put((None, None, None, None, None))
+
+
+class TransferThread(threading.Thread):
+    """ This thread sends and receives the file data of uploads and downloads.
+    SlskProtoThread hands file transfer connections over to it once a transfer
+    starts, so that slow disk access and large amounts of transfer data don't
+    delay the server connection and peer messages. Transfer progress is reported
+    to the UI thread through the same callback as SlskProtoThread.
+    """
+
+    CONNECTION_MAX_IDLE = 60
+    IDLE_CHECK_INTERVAL = 1
+    SELECT_TIMEOUT = 0.2
+    MAX_READ_LENGTH = 1048576
+
+    def __init__(self, ui_callback, downloadlimit=0):
+
+        threading.Thread.__init__(self)
+
+        self._events = EventBatch(ui_callback)
+        self._ui_callback = self._events.add
+        self._queue = Queue()
+        self._wakeup = threading.Event()
+        self._want_abort = False
+
+        self._conns = {}
+        self._pending_input = set()
+        self._last_idle_check = time.time()
+
+        self._upload_bucket = TokenBucket()
+        self._upload_transfer_rate = None
+        self._download_bucket = TokenBucket(downloadlimit * 1024)
+        self._ulimits = {}
+        self._dlimits = {}
+        self.total_uploads = 0
+        self.total_downloads = 0
+
+        # Downloaded file data is received into this buffer, and written to disk from there
+        self._download_buffer = bytearray(self.MAX_READ_LENGTH)
+        self._download_view = memoryview(self._download_buffer)
+
+        self.setDaemon(True)
+
+    def put(self, msg_obj, conn_obj=None):
+        """ Called by SlskProtoThread to pass on a message concerning transfers. A
+        DownloadFile or UploadFile message comes with the connection of the transfer
+        it starts. """
+
+        self._queue.put((msg_obj, conn_obj))
+        self._wakeup.set()
+
+    def num_connections(self):
+        return len(self._conns)
+
+    def socket_still_active(self, conn):
+        try:
+            connection = self._conns[conn]
+        except KeyError:
+            return False
+
+        return len(connection.obuf) > 0 or len(connection.ibuf) > 0
+
+    def _is_upload(self, conn):
+        return conn.fileupl is not None
+
+    def _is_download(self, conn):
+        return conn.filedown is not None
+
+    def _get_bandwidth_share(self, bucket, num_transfers, curtime):
+        """ Returns the number of bytes each transfer can use from a global bucket in
+        the current loop iteration, so that all transfers get a fair share """
+
+        tokens = bucket.get_tokens(curtime)
+
+        if tokens is None:
+            return None
+
+        return max(tokens // max(num_transfers, 1), 1)
+
+    def _get_transfer_limit(self, conn, share, curtime):
+        """ Returns the number of bytes a transfer may send or receive right now,
+        None if unlimited, or 0 if it has to wait for its buckets to refill """
+
+        if conn.bucket.get_wait_time(curtime) > 0:
+            return 0
+
+        limit = conn.bucket.get_tokens(curtime)
+
+        if share is not None and (limit is None or share < limit):
+            limit = share
+
+        return limit
+
+    def _set_upload_limit(self, msg_obj):
+        limit = msg_obj.limit * 1024 if msg_obj.uselimit else None
+
+        if msg_obj.limitby:
+            # Limit total upload speed
+            self._upload_bucket.set_rate(limit)
+            self._upload_transfer_rate = None
+        else:
+            # Limit speed of each individual upload
+            self._upload_bucket.set_rate(None)
+            self._upload_transfer_rate = limit
+
+        for conn in self._conns.values():
+            if self._is_upload(conn):
+                conn.bucket.set_rate(self._upload_transfer_rate)
+
+    def close_connection(self, connection):
+        connection.close()
+        del self._conns[connection]
+
+    def close_blocked_connections(self, ipblocklist):
+
+        for connection in list(self._conns):
+            addr = self._conns[connection].addr
+
+            if addr[0] in ipblocklist:
+                log.add_conn("Blocking peer connection to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
+                self._ui_callback([ConnClose(connection, addr)])
+                self.close_connection(connection)
+
+    def close_idle_connections(self, curtime):
+
+        for connection in list(self._conns):
+            conn = self._conns[connection]
+
+            if curtime - conn.lastactive > self.CONNECTION_MAX_IDLE:
+                self._ui_callback([ConnClose(connection, conn.addr)])
+                self.close_connection(connection)
+
+    def process_queue(self):
+
+        conns = self._conns
+
+        while not self._queue.empty():
+            msg_obj, conn_obj = self._queue.get()
+
+            if msg_obj.__class__ is DownloadFile:
+                conns[msg_obj.conn] = conn_obj
+                conn_obj.filedown = msg_obj
+
+                conn_obj.obuf.extend(struct.pack("<Q", msg_obj.offset))
+                conn_obj.obuf.extend(struct.pack("<i", 0))
+
+                conn_obj.bytestoread = msg_obj.filesize - msg_obj.offset
+                conn_obj.bucket = TokenBucket(parent=self._download_bucket)
+
+                self._pending_input.add(msg_obj.conn)
+                self._ui_callback([DownloadFile(msg_obj.conn, 0, msg_obj.file)])
+
+            elif msg_obj.__class__ is UploadFile:
+                conns[msg_obj.conn] = conn_obj
+                conn_obj.fileupl = msg_obj
+                conn_obj.bucket = TokenBucket(self._upload_transfer_rate, parent=self._upload_bucket)
+                self._pending_input.add(msg_obj.conn)
+
+            elif msg_obj.__class__ is ConnClose and msg_obj.conn in conns:
+                self._ui_callback([ConnClose(msg_obj.conn, conns[msg_obj.conn].addr)])
+                self.close_connection(msg_obj.conn)
+
+            elif msg_obj.__class__ is SetIPBlockList:
+                self.close_blocked_connections(IPAddressList(msg_obj.ips))
+
+            elif msg_obj.__class__ is SetUploadLimit:
+                self._set_upload_limit(msg_obj)
+
+            elif msg_obj.__class__ is SetDownloadLimit:
+                self._download_bucket.set_rate(msg_obj.limit * 1024)
+
+    def process_file_input(self, conn, msg_buffer):
+        """ A transfer peer has sent us something. For downloads, this is file data,
+        and for uploads, the offset to start uploading the file from. """
+
+        if conn.filedown is not None:
+            leftbytes = self.write_download_data(conn, msg_buffer)
+            msg_buffer = msg_buffer[leftbytes:]
+
+        elif conn.fileupl is not None and conn.fileupl.offset is None:
+            offset = None
+
+            if len(msg_buffer) >= 8:
+                offset = struct.unpack("<Q", msg_buffer[:8])[0]
+                msg_buffer = msg_buffer[8:]
+
+            if offset is not None:
+                try:
+                    conn.fileupl.file.seek(offset)
+                except IOError as strerror:
+                    self._ui_callback([FileError(conn, conn.fileupl.file, strerror)])
+                except ValueError:
+                    pass
+
+                conn.fileupl.offset = offset
+                self._ui_callback([conn.fileupl])
+
+        conn.ibuf = msg_buffer
+
+    def write_download_data(self, conn, data):
+        """ Writes received file data to the file being downloaded, and returns the
+        number of bytes that were still left to read before the write. data can be a
+        memoryview, in which case it is written to the file without being copied. """
+
+        leftbytes = conn.bytestoread - conn.filereadbytes
+        addedbytes = data[:leftbytes]
+
+        if leftbytes > 0:
+            try:
+                conn.filedown.file.write(addedbytes)
+            except IOError as strerror:
+                self._ui_callback([FileError(conn, conn.filedown.file, strerror)])
+            except ValueError:
+                pass
+
+        addedbyteslen = len(addedbytes)
+        curtime = time.time()
+
+        """ Depending on the number of active downloads, the cooldown for UI callbacks
+        can be up to 15 seconds per transfer. We use a bit of randomness to give the
+        illusion that downloads are updated often. """
+        cooldown = max(1.0, min(self.total_downloads * uniform(0.8, 1.0), 15))
+
+        if (leftbytes - addedbyteslen) == 0 or \
+                (curtime - conn.lastcallback) > cooldown:
+
+            """ We save resources by not sending data back to the UI every time
+            a part of a file is downloaded """
+
+            self._ui_callback([DownloadFile(conn.conn, addedbyteslen, conn.filedown.file)])
+            conn.lastcallback = curtime
+
+        conn.filereadbytes += addedbyteslen
+        return leftbytes
+
+    def write_data(self, i):
+
+        if i in self._ulimits:
+            limit = self._ulimits[i]
+        else:
+            limit = None
+
+        conn = self._conns[i]
+
+        conn.lastactive = time.time()
+        i.setblocking(0)
+
+        if limit is None:
+            bytes_send = i.send(conn.obuf)
+        else:
+            bytes_send = i.send(conn.obuf[:limit])
+
+        i.setblocking(1)
+        conn.obuf = conn.obuf[bytes_send:]
+
+        if conn.fileupl is not None and conn.fileupl.offset is not None:
+            conn.fileupl.sentbytes += bytes_send
+            conn.bucket.consume(bytes_send)
+
+            totalsentbytes = conn.fileupl.offset + conn.fileupl.sentbytes + len(conn.obuf)
+
+            try:
+                size = conn.fileupl.size
+
+                if totalsentbytes < size:
+                    bytestoread = bytes_send * 2 - len(conn.obuf) + 10 * 4024
+
+                    if bytestoread > 0:
+                        read = conn.fileupl.file.read(bytestoread)
+                        conn.obuf.extend(read)
+
+            except IOError as strerror:
+                self._ui_callback([FileError(conn, conn.fileupl.file, strerror)])
+
+            except ValueError:
+                pass
+
+            if bytes_send <= 0:
+                return
+
+            curtime = time.time()
+
+            """ Depending on the number of active uploads, the cooldown for UI callbacks
+            can be up to 15 seconds per transfer. We use a bit of randomness to give the
+            illusion that uploads are updated often. """
+            cooldown = max(1.0, min(self.total_uploads * uniform(0.8, 1.0), 15))
+
+            if totalsentbytes == size or \
+                    (curtime - conn.lastcallback) > cooldown:
+
+                """ We save resources by not sending data back to the UI every time
+                a part of a file is uploaded """
+
+                self._ui_callback([conn.fileupl])
+                conn.lastcallback = curtime
+
+    def read_data(self, i):
+        # Check for a download limit
+        if i in self._dlimits:
+            limit = self._dlimits[i]
+        else:
+            limit = None
+
+        conn = self._conns[i]
+
+        conn.lastactive = time.time()
+
+        if self._is_download(conn) and not conn.ibuf:
+            self.read_download_data(i, limit)
+            return
+
+        if limit is None:
+            data = i.recv(conn.lastreadlength)
+        else:
+            data = i.recv(limit)
+            conn.bucket.consume(len(data))
+
+        conn.ibuf.extend(data)
+
+        if not data:
+            self._ui_callback([ConnClose(i, conn.addr)])
+            self.close_connection(i)
+
+    def read_download_data(self, i, limit):
+        """ Receives file data of a download into our preallocated buffer, and writes
+        it to the file directly, instead of passing it through the input buffer. """
+
+        conn = self._conns[i]
+
+        if limit is None:
+            readlength = conn.lastreadlength
+        else:
+            readlength = limit
+
+        readlength = min(readlength, self.MAX_READ_LENGTH)
+        leftbytes = conn.bytestoread - conn.filereadbytes
+
+        if leftbytes > 0:
+            readlength = min(readlength, leftbytes)
+
+        bytes_read = i.recv_into(self._download_view, readlength)
+
+        if not bytes_read:
+            self._ui_callback([ConnClose(i, conn.addr)])
+            self.close_connection(i)
+            return
+
+        conn.bucket.consume(bytes_read)
+
+        if limit is None and bytes_read >= readlength // 2:
+            conn.lastreadlength = min(conn.lastreadlength * 2, self.MAX_READ_LENGTH)
+
+        self.write_download_data(conn, self._download_view[:bytes_read])
+
+    def select_connections(self, curtime):
+        """ Registers the connections that can send or receive data with a selector.
+        Returns the selector, and the time to wait for at most until a throttled
+        transfer can continue. """
+
+        conns = self._conns
+        selector = selectors.DefaultSelector()
+        timeout = self.SELECT_TIMEOUT
+
+        self._ulimits = {}
+        self._dlimits = {}
+
+        self.total_uploads = sum(1 for conn in conns.values() if self._is_upload(conn))
+        self.total_downloads = sum(1 for conn in conns.values() if self._is_download(conn))
+
+        upload_share = self._get_bandwidth_share(self._upload_bucket, self.total_uploads, curtime)
+        download_share = self._get_bandwidth_share(self._download_bucket, self.total_downloads, curtime)
+
+        for i in conns:
+            conn = conns[i]
+            event_masks = selectors.EVENT_READ
+
+            if self._is_download(conn):
+                limit = self._get_transfer_limit(conn, download_share, curtime)
+
+                if limit == 0:
+                    # Out of tokens, wake up when the buckets have refilled
+                    event_masks = 0
+                    timeout = min(timeout, conn.bucket.get_wait_time(curtime))
+                else:
+                    self._dlimits[i] = limit
+
+            if len(conn.obuf) > 0 or (self._is_upload(conn) and conn.fileupl.offset is not None):
+                if self._is_upload(conn):
+                    limit = self._get_transfer_limit(conn, upload_share, curtime)
+
+                    if limit == 0:
+                        timeout = min(timeout, conn.bucket.get_wait_time(curtime))
+                    else:
+                        self._ulimits[i] = limit
+                        event_masks |= selectors.EVENT_WRITE
+
+                else:
+                    event_masks |= selectors.EVENT_WRITE
+
+            if event_masks:
+                selector.register(i, event_masks)
+
+        return selector, timeout
+
+    def run(self):
+        """ Transfer loop """
+
+        conns = self._conns
+
+        while not self._want_abort:
+
+            self.process_queue()
+
+            self._events.flush()
+
+            if not conns:
+                # Nothing to transfer, wait for new transfers
+                self._wakeup.wait(self.SELECT_TIMEOUT)
+                self._wakeup.clear()
+                continue
+
+            try:
+                selector, timeout = self.select_connections(time.monotonic())
+
+                if selector.get_map():
+                    key_events = selector.select(timeout)
+                else:
+                    # All transfers are throttled
+                    key_events = []
+                    time.sleep(timeout)
+
+                selector.close()
+
+            except OSError as error:
+                if len(error.args) == 2 and error.args[0] == EINTR:
+                    continue
+
+                print(time.strftime("%H:%M:%S"), "Transfer select OSError:", error)
+                time.sleep(self.SELECT_TIMEOUT)
+                continue
+
+            except ValueError as error:
+                # Possibly opened too many sockets
+                print(time.strftime("%H:%M:%S"), "Transfer select ValueError:", error)
+                time.sleep(self.SELECT_TIMEOUT)
+                continue
+
+            input_list = set(key.fileobj for key, event in key_events if event & selectors.EVENT_READ)
+            output_list = set(key.fileobj for key, event in key_events if event & selectors.EVENT_WRITE)
+
+            ready_conns = (input_list | output_list | self._pending_input).intersection(conns)
+            self._pending_input.clear()
+
+            for connection in ready_conns:
+                if connection not in conns:
+                    # Connection was closed while processing another one
+                    continue
+
+                conn_obj = conns[connection]
+
+                try:
+                    if connection in output_list:
+                        self.write_data(connection)
+
+                    if connection in input_list:
+                        self.read_data(connection)
 
-        self.starttime = None  # Used for upload bandwidth management
-        self.sentbytes2 = 0
-        self.readbytes2 = 0
+                except socket.error as err:
+                    self._ui_callback([ConnectError(conn_obj, err)])
+                    self.close_connection(connection)
+                    continue
 
+                if connection in conns and len(conn_obj.ibuf) > 0:
+                    self.process_file_input(conn_obj, conn_obj.ibuf)
 
-class PeerConnectionInProgress:
-    """ As all p2p connect()s are non-blocking, this class is used to
-    hold data about a connection that is not yet established. msgObj is
-    a message to be sent after the connection has been established.
-    """
-    __slots__ = "conn", "msg_obj", "lastactive"
+            curtime = time.time()
 
-    def __init__(self, conn=None, msg_obj=None):
-        self.conn = conn
-        self.msg_obj = msg_obj
-        self.lastactive = time.time()
+            if (curtime - self._last_idle_check) > self.IDLE_CHECK_INTERVAL:
+                self.close_idle_connections(curtime)
+                self._last_idle_check = curtime
+
+    def abort(self):
+        """ Call this to abort the thread """
+        self._want_abort = True
+        self._wakeup.set()
 
 
 class SlskProtoThread(threading.Thread):
@@ -371,6 +1110,35 @@ class SlskProtoThread(threading.Thread):
         UnknownPeerMessage: 12547
     }
 
+    """ Peer messages that can be large, and are sent after any pending smaller
+    messages on the same connection """
+
+    bulkmessages = {
+        SharedFileList,
+        FileSearchResult,
+        UserInfoReply,
+        FolderContentsResponse
+    }
+
+    """ Messages we search with, and the name of their search token attribute """
+
+    searchmessages = {
+        FileSearch: "searchid",
+        RoomSearch: "searchid",
+        UserSearch: "searchid",
+        WishlistSearch: "searchid",
+        FileSearchRequest: "requestid"
+    }
+
+    """ Peer messages that can take long to decompress and parse, and are parsed
+    in a MessageParserPool """
+
+    parsermessages = {
+        SharedFileList,
+        FileSearchResult,
+        FolderContentsResponse
+    }
+
     distribclasses = {
         0: DistribAlive,
         3: DistribSearch,
@@ -381,8 +1149,20 @@ class SlskProtoThread(threading.Thread):
     }
 
     IN_PROGRESS_STALE_AFTER = 5
-    CONNECTION_MAX_IDLE = 60
+    CONNECTION_MAX_IDLE = TransferThread.CONNECTION_MAX_IDLE
+    PEER_CONNECTION_MAX_IDLE = 600
+    PEER_CONNECTION_IDLE_BONUS = 10
+    PEER_POOL_SIZE = 100
+    PEER_USAGE_SIZE = 1000
+    SEARCH_RESULTS_MAX_AGE = 3600
     CONNCOUNT_UI_INTERVAL = 0.5
+    PEER_TRANSFER_UI_INTERVAL = 0.5
+    PEER_TRANSFER_UI_STEP = 0.01
+    OUTPUT_HIGH_WATER = 2097152
+    TOTAL_OUTPUT_HIGH_WATER = 67108864
+    OUTPUT_HIGH_WATER_TIMEOUT = 120
+    SELECT_TIMEOUT = 0.2
+    MAX_READ_LENGTH = TransferThread.MAX_READ_LENGTH
 
     def __init__(self, ui_callback, queue, bindip, port, config, eventprocessor):
         """ ui_callback is a UI callback function to be called with messages
@@ -391,7 +1171,9 @@ class SlskProtoThread(threading.Thread):
         """
         threading.Thread.__init__(self)
 
-        self._ui_callback = ui_callback
+        # Messages for the UI thread are delivered once per loop iteration
+        self._events = EventBatch(ui_callback)
+        self._ui_callback = self.add_events
         self._queue = queue
         self._want_abort = False
         self._bindip = bindip
@@ -411,12 +1193,41 @@ class SlskProtoThread(threading.Thread):
 
         self._conns = {}
         self._connsinprogress = {}
-        self._uploadlimit = (self._calc_upload_limit_none, 0)
-        self._downloadlimit = (self._calc_download_limit_by_total, self._config.sections["transfers"]["downloadlimit"])
-        self._ulimits = {}
-        self._dlimits = {}
-        self.total_uploads = 0
-        self.total_downloads = 0
+        self._num_file_sockets = 0
+        self._ipblocklist = IPAddressList()
+
+        # Heap of (deadline, id, socket, connection) entries, used to time out connections
+        self._deadlines = []
+        self._deadline_ids = count()
+
+        # Established 'P' connections, least recently used first
+        self._peer_pool = OrderedDict()
+        self._peer_pool_size = self.PEER_POOL_SIZE
+
+        # Number of recent messages exchanged with each user, used to keep their connections open longer,
+        # least recently used first
+        self._peer_usage = OrderedDict()
+
+        # Sockets with buffered input that needs processing, even if no new data arrives
+        self._pending_input = set()
+
+        # Bytes waiting to be sent to all connections, and search results dropped because
+        # of it since the last report
+        self._output_bytes = 0
+        self._dropped_search_results = 0
+
+        # Search results received for searches we no longer want, since the last report
+        self._unwanted_search_results = 0
+
+        # Number of results we still accept for each of our searches and the time the
+        # search was made, by search token, oldest search first
+        self._search_budgets = OrderedDict()
+
+        # File data of uploads and downloads is sent and received in a separate thread
+        self._transfers = TransferThread(ui_callback, self._config.sections["transfers"]["downloadlimit"])
+
+        # Large peer messages are parsed in worker threads
+        self._parsers = MessageParserPool(ui_callback, self.parse_peer_message)
 
         self.last_conncount_ui_update = time.time()
 
@@ -435,12 +1246,13 @@ class SlskProtoThread(threading.Thread):
                 listenport = None
             else:
                 self._p.listen(1)
-                self._ui_callback([IncPort(listenport)])
+                ui_callback([IncPort(listenport)])
                 break
 
         if listenport is not None:
             self.setDaemon(True)
             self.start()
+            self._transfers.start()
         else:
             short_message = _("Could not bind to a local port, aborting connection")
             long_message = _(
@@ -453,118 +1265,178 @@ class SlskProtoThread(threading.Thread):
                     "Note that part of your range lies below 1024, this is usually not allowed on"
                     " most operating systems with the exception of Windows."
                 )
-            self._ui_callback([PopupMessage(short_message, long_message)])
+            ui_callback([PopupMessage(short_message, long_message)])
 
-    def _is_upload(self, conn):
-        return conn.__class__ is PeerConnection and conn.fileupl is not None
+    def socket_still_active(self, conn):
+        try:
+            connection = self._conns[conn]
+        except KeyError:
+            return self._transfers.socket_still_active(conn)
 
-    def _is_download(self, conn):
-        return conn.__class__ is PeerConnection and conn.filedown is not None
+        return self._has_output(connection) or len(connection.ibuf) > 0
 
-    def _calc_transfer_speed(self, i):
-        curtime = time.time()
+    def _has_output(self, conn):
+        return len(conn.obuf) > 0 or conn.bulkframe is not None or len(conn.bulkbuf) > 0
 
-        if i.starttime is None:
-            i.starttime = curtime
+    def _get_output_size(self, conn):
 
-        elapsed = curtime - i.starttime
+        size = len(conn.obuf) + sum(len(frame) for frame in conn.bulkbuf)
 
-        if elapsed == 0:
-            return 0
-        elif self._is_upload(i):
-            return i.sentbytes2 / elapsed
-        else:
-            return i.readbytes2 / elapsed
+        if conn.bulkframe is not None:
+            size += len(conn.bulkframe)
 
-    def _calc_upload_limit_by_transfer(self, conns, i):
-        self.total_uploads = sum(1 for j in conns.values() if self._is_upload(j))
+        return size
 
-        return int(self._uploadlimit[1] * 1024.0)
+    def output_above_high_water(self, conn):
+        """ Search results are best-effort, and are dropped instead of being queued if
+        a peer doesn't receive data as fast as we send it, or if too much data is
+        waiting to be sent overall """
 
-    def _calc_upload_limit_by_total(self, conns, i):
-        max_limit = self._uploadlimit[1] * 1024.0
-        bw = 0.0
-        self.total_uploads = 1
+        return self._get_output_size(conn) > self.OUTPUT_HIGH_WATER or \
+            self._output_bytes > self.TOTAL_OUTPUT_HIGH_WATER
 
-        """ Skip first upload
-        If we have 2 or more uploads, we start reducing their individual speeds to
-        stay below the total limit """
+    def check_output_high_water(self, conn, output_size, curtime):
+        """ Returns True if a connection's pending output has stayed above the
+        high-water mark without any of it being sent for too long, and the
+        connection should be closed. Connections that drain slowly are kept. """
 
-        uploads = islice((j for j in conns.values() if self._is_upload(j)), 1, None)
-        for j in uploads:
-            bw += self._calc_transfer_speed(j)
-            self.total_uploads += 1
+        if output_size <= self.OUTPUT_HIGH_WATER:
+            conn.highwatertime = None
+            return False
 
-        limit = int(max(1024, max_limit - bw))  # 1 KB/s is the minimum upload speed per transfer
-        return limit
+        if conn.highwatertime is None:
+            conn.highwatertime = curtime
+            return False
+
+        return (curtime - conn.highwatertime) > self.OUTPUT_HIGH_WATER_TIMEOUT
+
+    def ip_blocked(self, address):
+        if address is None:
+            return True
+
+        return address in self._ipblocklist
+
+    def close_blocked_connections(self, conns, server_socket):
+        """ Closes established peer connections from IP addresses that were blocked
+        after the connection was made """
+
+        for connection in list(conns):
+            if connection is server_socket:
+                continue
+
+            addr = conns[connection].addr
+
+            if self.ip_blocked(addr[0]):
+                log.add_conn("Blocking peer connection to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
+                self._ui_callback([ConnClose(connection, addr)])
+                self.close_connection(conns, connection)
 
-    def _calc_upload_limit_none(self, conns, i):
-        self.total_uploads = sum(1 for j in conns.values() if self._is_upload(j))
+    def add_deadline(self, connection, conn_obj, timeout):
+        """ Schedules a timeout check for a connection. Activity on a connection only
+        updates its lastactive time, and the deadline is pushed back once it has passed. """
 
-        return None
+        heapq.heappush(
+            self._deadlines, (conn_obj.lastactive + timeout, next(self._deadline_ids), connection, conn_obj))
 
-    def _calc_download_limit_by_total(self, conns, i):
-        max_limit = self._downloadlimit[1] * 1024.0
-        bw = 0.0
-        self.total_downloads = 1
+    def process_deadlines(self, conns, connsinprogress, curtime):
+        """ Times out connections in progress that are stale, and established connections
+        that have been idle for too long. Only connections whose deadline has passed are
+        looked at. """
 
-        """ Skip first download
-        If we have 2 or more downloads, we start reducing their individual speeds to
-        stay below the total limit """
+        deadlines = self._deadlines
 
-        downloads = islice((j for j in conns.values() if self._is_download(j)), 1, None)
-        for j in downloads:
-            bw += self._calc_transfer_speed(j)
-            self.total_downloads += 1
+        while deadlines and deadlines[0][0] <= curtime:
+            deadline, deadline_id, connection, conn_obj = heapq.heappop(deadlines)
 
-        if max_limit == 0:
-            # Download limit disabled
-            limit = 0
+            if connsinprogress.get(connection) is conn_obj:
+                self._ui_callback([ConnectError(conn_obj.msg_obj)])
+                self.close_connection(connsinprogress, connection)
+
+            elif conns.get(connection) is conn_obj:
+                max_idle = self.get_max_idle_time(conn_obj)
+
+                if curtime - conn_obj.lastactive > max_idle:
+                    self.decay_peer_usage(conn_obj)
+                    self._ui_callback([ConnClose(connection, conn_obj.addr)])
+                    self.close_connection(conns, connection)
+                else:
+                    self.add_deadline(connection, conn_obj, max_idle)
+
+            # Otherwise the connection was closed or established in the meantime
+
+    def _is_peer_message_init(self, init):
+        return init is not None and init.type == 'P'
+
+    def get_max_idle_time(self, conn_obj):
+        """ 'P' connections to users we exchange messages with often are kept open
+        for longer, to avoid setting up a new connection for every request """
+
+        if not self._is_peer_message_init(conn_obj.init):
+            return self.CONNECTION_MAX_IDLE
+
+        usage = self._peer_usage.get(conn_obj.init.user, 0)
+        return min(self.CONNECTION_MAX_IDLE + usage * self.PEER_CONNECTION_IDLE_BONUS, self.PEER_CONNECTION_MAX_IDLE)
+
+    def decay_peer_usage(self, conn_obj):
+
+        if not self._is_peer_message_init(conn_obj.init):
+            return
+
+        user = conn_obj.init.user
+        usage = self._peer_usage.get(user, 0) // 2
+
+        if usage:
+            self._peer_usage[user] = usage
         else:
-            limit = int(max(1024, max_limit - bw))  # 1 KB/s is the minimum download speed per transfer
+            self._peer_usage.pop(user, None)
 
-        return limit
+    def use_peer_connection(self, conn_obj):
+        """ Marks a 'P' connection as recently used when a message is sent or received
+        through it. If there are too many idle 'P' connections, the least recently
+        used ones are closed. """
 
-    def socket_still_active(self, conn):
-        try:
-            connection = self._conns[conn]
-        except KeyError:
-            return False
+        if not self._is_peer_message_init(conn_obj.init):
+            return
 
-        return len(connection.obuf) > 0 or len(connection.ibuf) > 0
+        user = conn_obj.init.user
+        peer_usage = self._peer_usage
+        usage = peer_usage.get(user, 0)
 
-    def ip_blocked(self, address):
-        if address is None:
-            return True
+        if usage * self.PEER_CONNECTION_IDLE_BONUS < self.PEER_CONNECTION_MAX_IDLE:
+            usage += 1
 
-        ips = self._config.sections["server"]["ipblocklist"]
-        s_address = address.split(".")
+        peer_usage[user] = usage
+        peer_usage.move_to_end(user)
 
-        for ip in ips:
-            # No Wildcard in IP
-            if "*" not in ip:
-                if address == ip:
-                    return True
-                continue
+        while len(peer_usage) > self.PEER_USAGE_SIZE:
+            peer_usage.popitem(last=False)
 
-            # Wildcard in IP
-            parts = ip.split(".")
-            seg = 0
+        pool = self._peer_pool
+        pool[conn_obj.conn] = conn_obj
+        pool.move_to_end(conn_obj.conn)
 
-            for part in parts:
-                # Stop if there's no wildcard or matching string number
-                if part != s_address[seg] and part != "*":
-                    break
+        self.evict_peer_connections()
 
-                seg += 1
+    def evict_peer_connections(self):
 
-                # Last time around
-                if seg == 4:
-                    # Wildcard blocked
-                    return True
+        pool = self._peer_pool
+        conns = self._conns
+
+        while len(pool) > self._peer_pool_size:
+            connection, conn_obj = pool.popitem(last=False)
+
+            if conns.get(connection) is not conn_obj or conn_obj.conn is None:
+                # Connection was already closed
+                continue
 
-        # Not blocked
-        return False
+            if self._has_output(conn_obj) or conn_obj.ibuf:
+                # Connection is busy, keep it open for now
+                pool[connection] = conn_obj
+                break
+
+            self.decay_peer_usage(conn_obj)
+            self._ui_callback([ConnClose(connection, conn_obj.addr)])
+            self.close_connection(conns, connection)
 
     def parse_file_req(self, conn, msg_buffer):
         msg = None
@@ -577,15 +1449,6 @@ class SlskProtoThread(threading.Thread):
 
         return msg, msg_buffer
 
-    def parse_offset(self, conn, msg_buffer):
-        offset = None
-
-        if len(msg_buffer) >= 8:
-            offset = struct.unpack("<Q", msg_buffer[:8])[0]
-            msg_buffer = msg_buffer[8:]
-
-        return offset, msg_buffer
-
     def process_server_input(self, msg_buffer):
         """ Server has sent us something, this function retrieves messages
         from the msg_buffer, creates message objects and returns them and the rest
@@ -616,7 +1479,8 @@ class SlskProtoThread(threading.Thread):
         """ We have a "F" connection (filetransfer), peer has sent us
         something, this function retrieves messages
         from the msg_buffer, creates message objects and returns them
-        and the rest of the msg_buffer.
+        and the rest of the msg_buffer. Once the transfer starts, the
+        connection is handed over to the transfer thread.
         """
         msgs = []
 
@@ -627,55 +1491,124 @@ class SlskProtoThread(threading.Thread):
                 msgs.append(filereq)
                 conn.filereq = filereq
 
-        elif conn.filedown is not None:
-            leftbytes = conn.bytestoread - conn.filereadbytes
-            addedbytes = msg_buffer[:leftbytes]
+        conn.ibuf = msg_buffer
+        return msgs, conn
 
-            if leftbytes > 0:
-                try:
-                    conn.filedown.file.write(addedbytes)
-                except IOError as strerror:
-                    self._ui_callback([FileError(conn, conn.filedown.file, strerror)])
-                except ValueError:
-                    pass
+    def report_peer_transfer(self, conn, msgsize, msgbytes, msgtype):
+        """ Reports the progress of a peer message that is being received. While a
+        large message such as a shared file list arrives, progress is reported at
+        most every PEER_TRANSFER_UI_INTERVAL seconds, and only if a further
+        PEER_TRANSFER_UI_STEP of the message was received since the last report.
+        Fully received messages are always reported. """
 
-            addedbyteslen = len(addedbytes)
+        if msgbytes < msgsize:
             curtime = time.time()
 
-            """ Depending on the number of active downloads, the cooldown for UI callbacks
-            can be up to 15 seconds per transfer. We use a bit of randomness to give the
-            illusion that downloads are updated often. """
-            cooldown = max(1.0, min(self.total_downloads * uniform(0.8, 1.0), 15))
+            if (curtime - conn.lastcallback) < self.PEER_TRANSFER_UI_INTERVAL or \
+                    (msgbytes - conn.lastprogressbytes) < msgsize * self.PEER_TRANSFER_UI_STEP:
+                return
 
-            if (leftbytes - addedbyteslen) == 0 or \
-                    (curtime - conn.lastcallback) > cooldown:
+            conn.lastcallback = curtime
+            conn.lastprogressbytes = msgbytes
 
-                """ We save resources by not sending data back to the UI every time
-                a part of a file is downloaded """
+        else:
+            conn.lastprogressbytes = 0
 
-                self._ui_callback([DownloadFile(conn.conn, addedbyteslen, conn.filedown.file)])
-                conn.lastcallback = curtime
+        self._ui_callback([PeerTransfer(conn, msgsize, msgbytes, self.peerclasses.get(msgtype, None))])
 
-            conn.filereadbytes += addedbyteslen
-            msg_buffer = msg_buffer[leftbytes:]
+    def add_events(self, msgs):
+        """ Queues msgs for the UI thread. A connection that is closed or fails
+        while its messages are still being parsed is reported by the parser
+        worker, so that the parsed messages arrive first. """
 
-        elif conn.fileupl is not None:
-            if conn.fileupl.offset is None:
-                offset, msg_buffer = self.parse_offset(conn, msg_buffer)
+        conns = self._conns
+        events = []
 
-                if offset is not None:
-                    try:
-                        conn.fileupl.file.seek(offset)
-                    except IOError as strerror:
-                        self._ui_callback([FileError(conn, conn.fileupl.file, strerror)])
-                    except ValueError:
-                        pass
+        for msg in msgs:
+            if msg.__class__ is ConnClose:
+                conn_obj = conns.get(msg.conn)
 
-                    conn.fileupl.offset = offset
-                    self._ui_callback([conn.fileupl])
+            elif msg.__class__ is ConnectError:
+                conn_obj = conns.get(getattr(msg.connobj, "conn", None))
 
-        conn.ibuf = msg_buffer
-        return msgs, conn
+            else:
+                conn_obj = None
+
+            if conn_obj is not None and conn_obj.parsejob is not None and not conn_obj.parsejob.done:
+                conn_obj.parsejob = self._parsers.put_events(conn_obj, [msg])
+                continue
+
+            events.append(msg)
+
+        self._events.add(events)
+
+    def add_search_token(self, msg_obj):
+
+        token = getattr(msg_obj, self.searchmessages[msg_obj.__class__])
+        budgets = self._search_budgets
+        curtime = time.time()
+
+        # Searches made long ago don't get results anymore
+        while budgets and next(iter(budgets.values()))[1] < curtime - self.SEARCH_RESULTS_MAX_AGE:
+            budgets.popitem(last=False)
+
+        budgets.pop(token, None)
+        budgets[token] = (self._config.sections["searches"]["max_stored_results"], curtime)
+
+    def search_result_wanted(self, msg, data):
+        """ Reads the token and number of results of a FileSearchResult, without
+        decompressing the rest of the message. Results for searches we didn't make,
+        or no longer want results for, are not wanted. """
+
+        try:
+            token, numresults = msg.parse_network_message_header(data)
+
+        except Exception:
+            # The error is reported once the whole message is parsed
+            return True
+
+        try:
+            budget, searchtime = self._search_budgets[token]
+
+        except KeyError:
+            return False
+
+        if searchtime < time.time() - self.SEARCH_RESULTS_MAX_AGE:
+            del self._search_budgets[token]
+            return False
+
+        if budget <= numresults:
+            # The search got all the results it can use
+            del self._search_budgets[token]
+        else:
+            self._search_budgets[token] = (budget - numresults, searchtime)
+
+        return True
+
+    def parse_peer_message(self, conn, msg, msgsize, data):
+        """ Parses a peer message from data, its raw contents. Returns the message,
+        or a debug message if it couldn't be parsed. Also called from the worker
+        threads of a MessageParserPool. """
+
+        try:
+            msg.parse_network_message(data)
+
+        except Exception as error:
+            host = port = _("unknown")
+            msgname = str(msg.__class__).split(".")[-1]
+            print("Error parsing %s:" % msgname, error)
+
+            import traceback
+            for line in traceback.format_tb(error.__traceback__):
+                print(line)
+
+            if conn.addr is not None:
+                host = conn.addr[0]
+                port = conn.addr[1]
+
+            return _("There was an error while unpacking Peer message type %(type)s size %(size)i contents %(msg_buffer)s from user: %(user)s, %(host)s:%(port)s") % {'type': msgname, 'size': msgsize - 4, 'msg_buffer': data.__repr__(), 'user': conn.init.user, 'host': host, 'port': port}
+
+        return msg
 
     def process_peer_input(self, conn, msg_buffer):
         """ We have a "P" connection (p2p exchange), peer has sent us
@@ -690,7 +1623,7 @@ class SlskProtoThread(threading.Thread):
 
             if len(msg_buffer) >= 8:
                 msgtype = struct.unpack("<i", msg_buffer[4:8])[0]
-                self._ui_callback([PeerTransfer(conn, msgsize, len(msg_buffer) - 4, self.peerclasses.get(msgtype, None))])
+                self.report_peer_transfer(conn, msgsize, len(msg_buffer) - 4, msgtype)
 
             if msgsize + 4 > len(msg_buffer):
                 break
@@ -740,30 +1673,31 @@ class SlskProtoThread(threading.Thread):
                 if msgtype in self.peerclasses:
                     try:
                         msg = self.peerclasses[msgtype](conn)
+                        data = msg_buffer[8:msgsize + 4]
 
-                        # Parse Peer Message and handle exceptions
-                        try:
-                            msg.parse_network_message(msg_buffer[8:msgsize + 4])
+                        if msg.__class__ is FileSearchResult and not self.search_result_wanted(msg, data):
+                            # Skip results for searches we no longer want without parsing them
+                            self._unwanted_search_results += 1
+                            msg_buffer = msg_buffer[msgsize + 4:]
+                            continue
 
-                        except Exception as error:
-                            host = port = _("unknown")
-                            msgname = str(self.peerclasses[msgtype]).split(".")[-1]
-                            print("Error parsing %s:" % msgname, error)
+                        if msg.__class__ in self.parsermessages or \
+                                (conn.parsejob is not None and not conn.parsejob.done):
+                            # Parse in a worker thread. Earlier messages from the connection
+                            # are delivered first, later ones are parsed by the same worker.
+                            self._ui_callback(msgs)
+                            self._events.flush()
+                            msgs = []
 
-                            import traceback
-                            for line in traceback.format_tb(error.__traceback__):
-                                print(line)
+                            conn.parsejob = self._parsers.put(conn, msg, msgsize, data)
+                            self.use_peer_connection(conn)
 
-                            if "addr" in conn.__dict__:
-                                if conn.addr is not None:
-                                    host = conn.addr[0]
-                                    port = conn.addr[1]
-                            debugmessage = _("There was an error while unpacking Peer message type %(type)s size %(size)i contents %(msg_buffer)s from user: %(user)s, %(host)s:%(port)s") % {'type': msgname, 'size': msgsize - 4, 'msg_buffer': msg_buffer[8:msgsize + 4].__repr__(), 'user': conn.init.user, 'host': host, 'port': port}
-                            msgs.append(debugmessage)
+                        else:
+                            msg = self.parse_peer_message(conn, msg, msgsize, data)
 
-                            del msg
+                            if not isinstance(msg, str):
+                                self.use_peer_connection(conn)
 
-                        else:
                             msgs.append(msg)
 
                     except Exception as error:
@@ -840,18 +1774,6 @@ class SlskProtoThread(threading.Thread):
         conn.ibuf = msg_buffer
         return msgs, conn
 
-    def _reset_counters(self, conns):
-        curtime = time.time()
-
-        for i in conns.values():
-            if self._is_upload(i):
-                i.starttime = curtime
-                i.sentbytes2 = 0
-
-            if self._is_download(i):
-                i.starttime = curtime
-                i.sentbytes2 = 0
-
     def set_server_socket_keepalive(self, server_socket, idle=10, interval=4, count=10):
         """ Ensure we are disconnected from the server in case of connectivity issues,
         by sending TCP keepalive pings. Assuming default values are used, once we reach
@@ -893,6 +1815,25 @@ class SlskProtoThread(threading.Thread):
     def close_connection(self, connection_list, connection):
         connection.close()
         del connection_list[connection]
+        self._peer_pool.pop(connection, None)
+
+    def _is_file_init(self, init):
+        return init is not None and init.type == 'F'
+
+    def can_open_socket(self, init, numsockets, numfilesockets, maxsockets):
+        """ File transfers can use the whole socket limit, while other peer connections
+        have to leave a part of it to file transfers """
+
+        if maxsockets == -1:
+            return True
+
+        if numsockets >= maxsockets:
+            return False
+
+        if self._is_file_init(init):
+            return True
+
+        return numsockets - numfilesockets < maxsockets - TRANSFER_SOCKET_RESERVE
 
     def process_queue(self, queue, conns, connsinprogress, server_socket, maxsockets=MAXFILELIMIT):
         """ Processes messages sent by UI thread. server_socket is a server connection
@@ -902,12 +1843,16 @@ class SlskProtoThread(threading.Thread):
 
         msg_list = []
         needsleep = False
-        numsockets = len(conns) + len(connsinprogress)
+        numsockets = len(conns) + len(connsinprogress) + self._transfers.num_connections()
+        numfilesockets = self._num_file_sockets
 
         while not queue.empty():
             msg_list.append(queue.get())
 
         for msg_obj in msg_list:
+            if msg_obj.__class__ in self.searchmessages:
+                self.add_search_token(msg_obj)
+
             if issubclass(msg_obj.__class__, ServerMessage):
                 try:
                     msg = msg_obj.make_network_message()
@@ -962,10 +1907,25 @@ class SlskProtoThread(threading.Thread):
                             if (cc == "-" and self._geoip[0]) or (cc != "-" and self._geoip[1][0].find(cc) >= 0):
                                 checkuser = 0
 
+                        if checkuser and msg_obj.__class__ is FileSearchResult and \
+                                self.output_above_high_water(conns[msg_obj.conn]):
+                            checkuser = 0
+                            self._dropped_search_results += 1
+
                         if checkuser:
                             msg = msg_obj.make_network_message()
-                            conns[msg_obj.conn].obuf.extend(struct.pack("<ii", len(msg) + 4, self.peercodes[msg_obj.__class__]))
-                            conns[msg_obj.conn].obuf.extend(msg)
+                            self._output_bytes += len(msg) + 8
+
+                            if msg_obj.__class__ in self.bulkmessages:
+                                # Large message, send it once pending small messages are sent
+                                frame = bytearray(struct.pack("<ii", len(msg) + 4, self.peercodes[msg_obj.__class__]))
+                                frame.extend(msg)
+                                conns[msg_obj.conn].bulkbuf.append(frame)
+                            else:
+                                conns[msg_obj.conn].obuf.extend(struct.pack("<ii", len(msg) + 4, self.peercodes[msg_obj.__class__]))
+                                conns[msg_obj.conn].obuf.extend(msg)
+
+                            self.use_peer_connection(conns[msg_obj.conn])
 
                 else:
                     if msg_obj.__class__ not in [PeerInit, PierceFireWall, FileSearchResult]:
@@ -973,38 +1933,42 @@ class SlskProtoThread(threading.Thread):
 
             elif issubclass(msg_obj.__class__, InternalMessage):
                 if msg_obj.__class__ is ServerConn:
-                    if maxsockets == -1 or numsockets < maxsockets:
-                        try:
-                            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    # The server connection is always allowed, regardless of the socket limit
+                    try:
+                        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-                            # Detect if our connection to the server is still alive
-                            self.set_server_socket_keepalive(server_socket)
+                        # Detect if our connection to the server is still alive
+                        self.set_server_socket_keepalive(server_socket)
 
-                            if self._bindip:
-                                server_socket.bind((self._bindip, 0))
+                        if self._bindip:
+                            server_socket.bind((self._bindip, 0))
 
-                            server_socket.setblocking(0)
-                            server_socket.connect_ex(msg_obj.addr)
-                            server_socket.setblocking(1)
+                        server_socket.setblocking(0)
+                        server_socket.connect_ex(msg_obj.addr)
+                        server_socket.setblocking(1)
 
-                            connsinprogress[server_socket] = PeerConnectionInProgress(server_socket, msg_obj)
+                        connsinprogress[server_socket] = PeerConnectionInProgress(server_socket, msg_obj)
+                        self.add_deadline(server_socket, connsinprogress[server_socket], self.IN_PROGRESS_STALE_AFTER)
 
-                            numsockets += 1
+                        numsockets += 1
 
-                        except socket.error as err:
+                    except socket.error as err:
 
-                            self._ui_callback([ConnectError(msg_obj, err)])
-                            server_socket.close()
+                        self._ui_callback([ConnectError(msg_obj, err)])
+                        server_socket.close()
 
-                elif msg_obj.__class__ is ConnClose and msg_obj.conn in conns:
-                    self._ui_callback([ConnClose(msg_obj.conn, conns[msg_obj.conn].addr)])
-                    self.close_connection(conns, msg_obj.conn)
+                elif msg_obj.__class__ is ConnClose:
+                    if msg_obj.conn in conns:
+                        self._ui_callback([ConnClose(msg_obj.conn, conns[msg_obj.conn].addr)])
+                        self.close_connection(conns, msg_obj.conn)
+                    else:
+                        self._transfers.put(msg_obj)
 
                 elif msg_obj.__class__ is OutConn:
                     if msg_obj.addr[1] == 0:
                         self._ui_callback([ConnectError(msg_obj, (0, "Port cannot be zero"))])
 
-                    elif maxsockets == -1 or numsockets < maxsockets:
+                    elif self.can_open_socket(msg_obj.init, numsockets, numfilesockets, maxsockets):
                         try:
                             conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
@@ -1016,9 +1980,13 @@ class SlskProtoThread(threading.Thread):
                             conn.setblocking(1)
 
                             connsinprogress[conn] = PeerConnectionInProgress(conn, msg_obj)
+                            self.add_deadline(conn, connsinprogress[conn], self.IN_PROGRESS_STALE_AFTER)
 
                             numsockets += 1
 
+                            if self._is_file_init(msg_obj.init):
+                                numfilesockets += 1
+
                         except socket.error as err:
 
                             self._ui_callback([ConnectError(msg_obj, err)])
@@ -1026,131 +1994,72 @@ class SlskProtoThread(threading.Thread):
                     else:
                         self._ui_callback([ConnectError(msg_obj)])
 
-                elif msg_obj.__class__ is DownloadFile and msg_obj.conn in conns:
-                    conns[msg_obj.conn].filedown = msg_obj
+                elif msg_obj.__class__ in (DownloadFile, UploadFile) and msg_obj.conn in conns:
+                    # The transfer starts, hand the connection over to the transfer thread
+                    conn_obj = conns.pop(msg_obj.conn)
+                    self._peer_pool.pop(msg_obj.conn, None)
+                    self._transfers.put(msg_obj, conn_obj)
 
-                    conns[msg_obj.conn].obuf.extend(struct.pack("<Q", msg_obj.offset))
-                    conns[msg_obj.conn].obuf.extend(struct.pack("<i", 0))
-
-                    conns[msg_obj.conn].bytestoread = msg_obj.filesize - msg_obj.offset
-
-                    self._ui_callback([DownloadFile(msg_obj.conn, 0, msg_obj.file)])
-
-                elif msg_obj.__class__ is UploadFile and msg_obj.conn in conns:
-                    conns[msg_obj.conn].fileupl = msg_obj
-                    self._reset_counters(conns)
+                elif msg_obj.__class__ is SetIPBlockList:
+                    self._ipblocklist = IPAddressList(msg_obj.ips)
+                    self.close_blocked_connections(conns, server_socket)
+                    self._transfers.put(msg_obj)
 
                 elif msg_obj.__class__ is SetGeoBlock:
                     self._geoip = msg_obj.config
 
-                elif msg_obj.__class__ is SetUploadLimit:
-                    if msg_obj.uselimit:
-                        if msg_obj.limitby:
-                            cb = self._calc_upload_limit_by_total
-                        else:
-                            cb = self._calc_upload_limit_by_transfer
-
-                    else:
-                        cb = self._calc_upload_limit_none
+                elif msg_obj.__class__ in (SetUploadLimit, SetDownloadLimit):
+                    self._transfers.put(msg_obj)
 
-                    self._reset_counters(conns)
-                    self._uploadlimit = (cb, msg_obj.limit)
+                elif msg_obj.__class__ is SetPeerPoolSize:
+                    self._peer_pool_size = max(msg_obj.size, 0)
+                    self.evict_peer_connections()
 
-                elif msg_obj.__class__ is SetDownloadLimit:
-                    self._downloadlimit = (self._calc_download_limit_by_total, msg_obj.limit)
+                elif msg_obj.__class__ is DropSearchResults:
+                    self._search_budgets.pop(msg_obj.token, None)
 
         if needsleep:
             time.sleep(1)
 
         return conns, connsinprogress, server_socket
 
-    def write_data(self, server_socket, conns, i):
-
-        if i in self._ulimits:
-            limit = self._ulimits[i]
-        else:
-            limit = None
+    def write_data(self, conns, i):
 
         conn = conns[i]
 
         conn.lastactive = time.time()
         i.setblocking(0)
 
-        if limit is None:
+        if conn.bulkframe is None and (conn.obuf or not conn.bulkbuf):
             bytes_send = i.send(conn.obuf)
-        else:
-            bytes_send = i.send(conn.obuf[:limit])
-
-        i.setblocking(1)
-        conn.obuf = conn.obuf[bytes_send:]
-
-        if i is not server_socket:
-            if conn.fileupl is not None and conn.fileupl.offset is not None:
-                conn.fileupl.sentbytes += bytes_send
-                conn.sentbytes2 += bytes_send
-
-                totalsentbytes = conn.fileupl.offset + conn.fileupl.sentbytes + len(conn.obuf)
-
-                try:
-                    size = conn.fileupl.size
-
-                    if totalsentbytes < size:
-                        bytestoread = bytes_send * 2 - len(conn.obuf) + 10 * 4024
-
-                        if bytestoread > 0:
-                            read = conn.fileupl.file.read(bytestoread)
-                            conn.obuf.extend(read)
-
-                except IOError as strerror:
-                    self._ui_callback([FileError(conn, conn.fileupl.file, strerror)])
-
-                except ValueError:
-                    pass
-
-                if bytes_send <= 0:
-                    return
-
-                curtime = time.time()
+            conn.obuf = conn.obuf[bytes_send:]
 
-                """ Depending on the number of active uploads, the cooldown for UI callbacks
-                can be up to 15 seconds per transfer. We use a bit of randomness to give the
-                illusion that uploads are updated often. """
-                cooldown = max(1.0, min(self.total_uploads * uniform(0.8, 1.0), 15))
+        else:
+            # Small messages in obuf are sent between large messages, but once a large
+            # message is partly sent, the rest of it has to follow first
+            if conn.bulkframe is None:
+                conn.bulkframe = memoryview(conn.bulkbuf.popleft())
 
-                if totalsentbytes == size or \
-                        (curtime - conn.lastcallback) > cooldown:
+            bytes_send = i.send(conn.bulkframe)
+            conn.bulkframe = conn.bulkframe[bytes_send:] or None
 
-                    """ We save resources by not sending data back to the UI every time
-                    a part of a file is uploaded """
+        if bytes_send and conn.highwatertime is not None:
+            # The peer is still receiving data, restart the high-water timeout
+            conn.highwatertime = conn.lastactive
 
-                    self._ui_callback([conn.fileupl])
-                    conn.lastcallback = curtime
+        i.setblocking(1)
 
     def read_data(self, conns, i):
-        # Check for a download limit
-        if i in self._dlimits:
-            limit = self._dlimits[i]
-        else:
-            limit = None
 
         conn = conns[i]
 
         conn.lastactive = time.time()
 
-        if limit is None:
-            # Unlimited download data
-            data = i.recv(conn.lastreadlength)
-            conn.ibuf.extend(data)
-
-            if len(data) >= conn.lastreadlength // 2:
-                conn.lastreadlength = conn.lastreadlength * 2
+        data = i.recv(conn.lastreadlength)
+        conn.ibuf.extend(data)
 
-        else:
-            # Speed Limited Download data (transfers)
-            data = i.recv(conn.lastreadlength)
-            conn.ibuf.extend(data)
-            conn.lastreadlength = limit
-            conn.readbytes2 += len(data)
+        if len(data) >= conn.lastreadlength // 2:
+            conn.lastreadlength = min(conn.lastreadlength * 2, self.MAX_READ_LENGTH)
 
         if not data:
             self._ui_callback([ConnClose(i, conn.addr)])
@@ -1175,41 +2084,55 @@ class SlskProtoThread(threading.Thread):
                 conns, connsinprogress, server_socket = self.process_queue(queue, conns, connsinprogress, server_socket)
                 self._server_socket = server_socket
 
-            self._ulimits = {}
-            self._dlimits = {}
-
             try:
                 # Select Networking Input and Output sockets
                 selector = selectors.DefaultSelector()
 
-                timeout = -1
+                timeout = self.SELECT_TIMEOUT
+                num_file_sockets = self._transfers.num_connections()
+                output_bytes = 0
+                stalled_conns = []
+                curtime = time.time()
 
                 for i in conns:
                     conn = conns[i]
                     event_masks = selectors.EVENT_READ
 
-                    if len(conn.obuf) > 0 or (i is not server_socket and conn.fileupl is not None and conn.fileupl.offset is not None):
-                        if self._is_upload(conn):
-                            limit = self._uploadlimit[0](conns, conn)
+                    if self._is_file_init(conn.init):
+                        num_file_sockets += 1
 
-                            if limit is not None:
-                                limit = int(limit * 0.2)  # limit is per second, we loop 5 times a second
+                    if self._has_output(conn):
+                        output_size = self._get_output_size(conn)
+                        output_bytes += output_size
 
-                            if limit is None or limit > 0:
-                                self._ulimits[i] = limit
-                                event_masks |= selectors.EVENT_WRITE
+                        if i is not server_socket and self.check_output_high_water(conn, output_size, curtime):
+                            stalled_conns.append(i)
+                            continue
 
-                        else:
-                            event_masks |= selectors.EVENT_WRITE
+                        event_masks |= selectors.EVENT_WRITE
+
+                    elif conn.highwatertime is not None:
+                        conn.highwatertime = None
 
                     selector.register(i, event_masks)
 
+                self._output_bytes = output_bytes
+
                 for i in connsinprogress:
                     event_masks = selectors.EVENT_READ | selectors.EVENT_WRITE
                     selector.register(i, event_masks)
 
+                    if self._is_file_init(connsinprogress[i].msg_obj.init):
+                        num_file_sockets += 1
+
+                self._num_file_sockets = num_file_sockets
+
                 selector.register(p, selectors.EVENT_READ)
 
+                if self._deadlines:
+                    timeout = min(timeout, max(self._deadlines[0][0] - time.time(), 0))
+
+                self._events.flush()
                 key_events = selector.select(timeout)
                 input_list = set(key.fileobj for key, event in key_events if event & selectors.EVENT_READ)
                 output_list = set(key.fileobj for key, event in key_events if event & selectors.EVENT_WRITE)
@@ -1237,11 +2160,32 @@ class SlskProtoThread(threading.Thread):
 
             if (curtime - self.last_conncount_ui_update) > self.CONNCOUNT_UI_INTERVAL:
                 # Avoid sending too many updates to the UI at once, if there are a lot of connections
-                numsockets = len(conns) + len(connsinprogress)
+                numsockets = len(conns) + len(connsinprogress) + self._transfers.num_connections()
 
                 self._ui_callback([SetCurrentConnectionCount(numsockets)])
                 self.last_conncount_ui_update = curtime
 
+                if self._dropped_search_results:
+                    log.add_conn(_("Dropped %(num)i search results, peers are not receiving data fast enough"), {
+                        'num': self._dropped_search_results
+                    })
+                    self._dropped_search_results = 0
+
+                if self._unwanted_search_results:
+                    log.add_conn(_("Ignored %(num)i search results for searches that have enough results"), {
+                        'num': self._unwanted_search_results
+                    })
+                    self._unwanted_search_results = 0
+
+            # Close connections that have not been receiving the data we send for too long
+            for connection in stalled_conns:
+                if connection in conns:
+                    log.add_conn("Closing connection to slow peer at IP: %(ip)s Port: %(port)s", {
+                        "ip": conns[connection].addr[0], "port": conns[connection].addr[1]
+                    })
+                    self._ui_callback([ConnClose(connection, conns[connection].addr)])
+                    self.close_connection(conns, connection)
+
             # Listen / Peer Port
             if p in input_list:
                 try:
@@ -1256,22 +2200,18 @@ class SlskProtoThread(threading.Thread):
                         })
                     else:
                         conns[incconn] = PeerConnection(conn=incconn, addr=incaddr)
+                        self.add_deadline(incconn, conns[incconn], self.CONNECTION_MAX_IDLE)
                         self._ui_callback([IncConn(incconn, incaddr)])
 
-            # Manage Connections
-            curtime = time.time()
+            # Timeout Connections
+            self.process_deadlines(conns, connsinprogress, time.time())
 
-            for connection_in_progress in connsinprogress.copy():
+            # Manage Connections
+            for connection_in_progress in (input_list | output_list).intersection(connsinprogress):
 
                 conn_obj = connsinprogress[connection_in_progress]
                 msg_obj = conn_obj.msg_obj
 
-                if (curtime - conn_obj.lastactive) > self.IN_PROGRESS_STALE_AFTER:
-
-                    self._ui_callback([ConnectError(msg_obj)])
-                    self.close_connection(connsinprogress, connection_in_progress)
-                    continue
-
                 try:
                     if connection_in_progress in input_list:
                         connection_in_progress.recv(0)
@@ -1296,53 +2236,34 @@ class SlskProtoThread(threading.Thread):
                                 connection_in_progress.close()
                             else:
                                 conns[connection_in_progress] = PeerConnection(conn=connection_in_progress, addr=addr, init=msg_obj.init)
+                                self.add_deadline(connection_in_progress, conns[connection_in_progress], self.CONNECTION_MAX_IDLE)
                                 self._ui_callback([OutConn(connection_in_progress, addr)])
 
                         del connsinprogress[connection_in_progress]
 
             # Process Data
-            curtime = time.time()
+            ready_conns = (input_list | output_list | self._pending_input).intersection(conns)
+            self._pending_input.clear()
+
+            for connection in ready_conns:
+                if connection not in conns:
+                    # Connection was closed while processing another one
+                    continue
 
-            for connection in conns.copy():
                 conn_obj = conns[connection]
 
                 if connection in output_list:
                     # Write Output
 
                     try:
-                        self.write_data(server_socket, conns, connection)
+                        self.write_data(conns, connection)
 
                     except socket.error as err:
                         self._ui_callback([ConnectError(conn_obj, err)])
                         self.close_connection(conns, connection)
                         continue
 
-                if connection is not server_socket:
-                    addr = conn_obj.addr
-
-                    if connection is not p:
-                        # Timeout Connections
-
-                        if curtime - conn_obj.lastactive > self.CONNECTION_MAX_IDLE:
-                            self._ui_callback([ConnClose(connection, addr)])
-                            self.close_connection(conns, connection)
-                            continue
-
-                    if self.ip_blocked(addr[0]):
-                        log.add_conn("Blocking peer connection to IP: %(ip)s Port: %(port)s", {"ip": addr[0], "port": addr[1]})
-                        self.close_connection(conns, connection)
-                        continue
-
                 if connection in input_list:
-                    if self._is_download(conn_obj):
-                        limit = self._downloadlimit[0](conns, connection)
-
-                        if limit is not None:
-                            limit = int(limit * 0.2)  # limit is per second, we loop 5 times a second
-
-                        if limit is None or limit > 0:
-                            self._dlimits[connection] = limit
-
                     try:
                         self.read_data(conns, connection)
 
@@ -1375,15 +2296,16 @@ class SlskProtoThread(threading.Thread):
                 except KeyError:
                     pass
 
-            # Don't exhaust the CPU
-            time.sleep(0.2)
-
         # Close Server Port
         if server_socket is not None:
             server_socket.close()
 
+        self._events.flush()
+
         # Networking thread aborted
 
     def abort(self):
         """ Call this to abort the thread """
         self._want_abort = True
+        self._transfers.abort()
+        self._parsers.abort()
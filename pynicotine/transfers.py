@@ -34,7 +34,6 @@ import os.path
 import re
 import shutil
 import stat
-import threading
 import time
 
 from gettext import gettext as _
@@ -42,6 +41,7 @@ from time import sleep
 
 from pynicotine import slskmessages
 from pynicotine.logfacility import log
+from pynicotine.scheduler import scheduler
 from pynicotine.slskmessages import new_id
 from pynicotine.utils import execute_command
 from pynicotine.utils import clean_file
@@ -190,9 +190,6 @@ class Transfers:
         self.privusersqueued = {}
         self.geoip = self.eventprocessor.geoip
 
-        # Check for failed downloads if option is enabled (1 min delay)
-        self.start_check_download_queue_timer()
-
     def set_transfer_views(self, downloads, uploads):
         self.downloadsview = downloads
         self.uploadsview = uploads
@@ -312,11 +309,9 @@ class Transfers:
 
     def upload_failed(self, msg):
 
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-                break
-        else:
+        user = self.peerconns.get_username(msg.conn.conn)
+
+        if user is None:
             return
 
         for i in self.downloads:
@@ -472,11 +467,9 @@ class Transfers:
         user = response = None
 
         if msg.conn is not None:
-            for i in self.peerconns:
-                if i.conn is msg.conn.conn:
-                    user = i.username
-                    conn = msg.conn.conn
-                    addr = msg.conn.addr[0]
+            user = self.peerconns.get_username(msg.conn.conn)
+            conn = msg.conn.conn
+            addr = msg.conn.addr[0]
         elif msg.tunneleduser is not None:
             user = msg.tunneleduser
             conn = None
@@ -516,9 +509,7 @@ class Transfers:
                 if i.transfertimer is not None:
                     i.transfertimer.cancel()
 
-                i.transfertimer = threading.Timer(30.0, transfertimeout.timeout)
-                i.transfertimer.setDaemon(True)
-                i.transfertimer.start()
+                i.transfertimer = scheduler.schedule(30.0, transfertimeout.timeout)
                 response = slskmessages.TransferResponse(conn, 1, req=i.req)
                 self.downloadsview.update(i)
                 break
@@ -627,9 +618,7 @@ class Transfers:
         )
 
         self._append_upload(user, msg.file, transferobj)
-        transferobj.transfertimer = threading.Timer(30.0, transfertimeout.timeout)
-        transferobj.transfertimer.setDaemon(True)
-        transferobj.transfertimer.start()
+        transferobj.transfertimer = scheduler.schedule(30.0, transfertimeout.timeout)
         self.uploadsview.update(transferobj)
         return response
 
@@ -675,10 +664,7 @@ class Transfers:
     def queue_upload(self, msg):
         """ Peer remotely(?) queued a download (upload here) """
 
-        user = None
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
+        user = self.peerconns.get_username(msg.conn.conn)
 
         if user is None:
             return
@@ -742,12 +728,7 @@ class Transfers:
 
     def upload_queue_notification(self, msg):
 
-        username = None
-
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                username = i.username
-                break
+        username = self.peerconns.get_username(msg.conn.conn)
 
         if username is None:
             return
@@ -800,10 +781,10 @@ class Transfers:
 
     def queue_failed(self, msg):
 
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-                break
+        user = self.peerconns.get_username(msg.conn.conn)
+
+        if user is None:
+            return
 
         for i in self.downloads:
             if i.user == user and i.filename == msg.file and i.status not in ["Aborted", "Paused"]:
@@ -1483,11 +1464,7 @@ class Transfers:
             self.eventprocessor.config.sections["server"]["banlist"].append(user)
             self.eventprocessor.config.write_configuration()
             self.eventprocessor.config.write_download_queue()
-
-    def start_check_download_queue_timer(self):
-        timer = threading.Timer(60.0, self.check_download_queue)
-        timer.setDaemon(True)
-        timer.start()
+            self.eventprocessor.update_user_access()
 
     # Find failed or stuck downloads and attempt to queue them.
     # Also ask for the queue position of downloads.
@@ -1503,8 +1480,6 @@ class Transfers:
             elif transfer.status == "Queued":
                 self.eventprocessor.process_request_to_peer(transfer.user, slskmessages.PlaceInQueueRequest(None, transfer.filename))
 
-        self.start_check_download_queue_timer()
-
     # Find next file to upload
     def check_upload_queue(self):
 
@@ -1551,9 +1526,7 @@ class Transfers:
 
     def place_in_queue_request(self, msg):
 
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
+        user = self.peerconns.get_username(msg.conn.conn)
 
         def list_users():
             users = []
@@ -1812,11 +1785,7 @@ class Transfers:
     def place_in_queue(self, msg):
         """ The server tells us our place in queue for a particular transfer."""
 
-        username = None
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                username = i.username
-                break
+        username = self.peerconns.get_username(msg.conn.conn)
 
         if username:
             for i in self.downloads:
@@ -1859,11 +1828,7 @@ class Transfers:
         """ When we got a contents of a folder, get all the files in it, but
         skip the files in subfolders"""
 
-        username = None
-        for i in self.peerconns:
-            if i.conn is conn:
-                username = i.username
-                break
+        username = self.peerconns.get_username(conn)
 
         if username is None:
             return
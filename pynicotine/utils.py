@@ -26,11 +26,14 @@ This module contains utility functions.
 """
 
 import gettext
+import ipaddress
 import locale
 import os
+import socket
 import sys
 import time
 
+from bisect import bisect_right
 from codecs import encode, decode
 from gettext import gettext as _
 from subprocess import PIPE
@@ -460,6 +463,105 @@ def write_log(logsdir, fn, msg, timestamp_format="%Y-%m-%d %H:%M:%S"):
         print(_("Couldn't write to log file \"%s\": %s") % (fn, error))
 
 
+class IPAddressList:
+    """ Compiled list of IP address patterns, used for fast lookups in the IP block
+    and ignore lists. Patterns can be single addresses (1.2.3.4), wildcards
+    (1.2.*.*) or CIDR notation (1.2.0.0/16). Patterns that cover a contiguous
+    range of addresses are merged into sorted integer ranges, which are searched
+    with a binary search. Wildcards in the middle of an address (1.*.3.4) are
+    rare, and matched part by part. """
+
+    def __init__(self, patterns=()):
+
+        ranges = []
+        self.wildcards = []
+
+        for pattern in patterns:
+            try:
+                iprange = self.parse_pattern(pattern)
+            except ValueError:
+                # Invalid pattern
+                continue
+
+            if iprange is None:
+                self.wildcards.append(pattern.split("."))
+            else:
+                ranges.append(iprange)
+
+        ranges.sort()
+        self.starts = []
+        self.ends = []
+
+        for start, end in ranges:
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+                continue
+
+            self.starts.append(start)
+            self.ends.append(end)
+
+    @staticmethod
+    def parse_pattern(pattern):
+        """ Returns the first and last address covered by a pattern as integers, or
+        None if the pattern is a wildcard that doesn't cover a contiguous range.
+        Raises ValueError for invalid patterns. """
+
+        if "/" in pattern:
+            network = ipaddress.IPv4Network(pattern, strict=False)
+            return int(network.network_address), int(network.broadcast_address)
+
+        parts = pattern.split(".")
+
+        if len(parts) != 4:
+            raise ValueError("Invalid IP address pattern %s" % pattern)
+
+        if "*" not in parts:
+            address = int(ipaddress.IPv4Address(pattern))
+            return address, address
+
+        num_fixed = parts.index("*")
+
+        if any(part != "*" for part in parts[num_fixed:]):
+            return None
+
+        start = 0
+
+        for part in parts[:num_fixed]:
+            if not part.isdigit() or int(part) > 255:
+                raise ValueError("Invalid IP address pattern %s" % pattern)
+
+            start = (start << 8) | int(part)
+
+        num_wildcard_bits = 8 * (4 - num_fixed)
+        start <<= num_wildcard_bits
+
+        return start, start + (1 << num_wildcard_bits) - 1
+
+    def __contains__(self, address):
+
+        try:
+            value = int.from_bytes(socket.inet_aton(address), "big")
+        except (OSError, TypeError):
+            return False
+
+        index = bisect_right(self.starts, value) - 1
+
+        if index >= 0 and value <= self.ends[index]:
+            return True
+
+        if self.wildcards:
+            s_address = address.split(".")
+
+            for parts in self.wildcards:
+                if all(part in (s_part, "*") for part, s_part in zip(parts, s_address)):
+                    return True
+
+        return False
+
+    def __len__(self):
+        return len(self.starts) + len(self.wildcards)
+
+
 """ Debugging """
 
 
@@ -0,0 +1,45 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest.mock import Mock, MagicMock
+
+import pytest
+
+from pynicotine.slskproto import SlskProtoThread
+
+
+@pytest.fixture
+def proto():
+    """ A SlskProtoThread that is never started, for testing its methods """
+
+    config = MagicMock()
+    config.sections = {
+        'server': {'portrange': (1, 2)}, 'transfers': {'downloadlimit': 10}, 'searches': {'max_stored_results': 3}
+    }
+    proto = SlskProtoThread(
+        ui_callback=Mock(), queue=Mock(), bindip='',
+        port=None, config=config, eventprocessor=Mock()
+    )
+
+    # Drop the messages sent while starting up
+    proto._events.flush()
+
+    yield proto
+
+    proto.abort()
+    proto._parsers.abort()
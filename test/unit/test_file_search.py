@@ -18,8 +18,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import struct
+import zlib
+
+from unittest.mock import Mock
 
 from pynicotine.slskmessages import FileSearch
+from pynicotine.slskmessages import FileSearchResult
+from pynicotine.slskmessages import PeerInit
+from pynicotine.slskproto import PeerConnection
 from pynicotine.slskproto import SlskProtoThread
 
 # "Magic" values confirmed to work with nicotine+ 1.4.2
@@ -53,3 +59,34 @@ def test_sent_out_message():
     msg = search.make_network_message()
     out_msg = struct.pack("<ii", len(msg) + 4, SlskProtoThread.servercodes[search.__class__]) + msg
     assert [b for b in out_msg] == SEARCH_OUT_MSG
+
+
+def search_result(token, numresults):
+    user = b"user1"
+    return zlib.compress(struct.pack("<I", len(user)) + user + struct.pack("<II", token, numresults))
+
+
+def test_search_budget(proto):
+    proto.add_search_token(FileSearch(requestid=SEARCH_ID, text=SEARCH_TEXT))
+    assert proto.search_result_wanted(FileSearchResult(None), search_result(SEARCH_ID, 2))
+
+    # The budget is dropped once the search has enough results
+    assert proto.search_result_wanted(FileSearchResult(None), search_result(SEARCH_ID, 2))
+    assert SEARCH_ID not in proto._search_budgets
+    assert not proto.search_result_wanted(FileSearchResult(None), search_result(SEARCH_ID, 1))
+
+    # Unwanted results are skipped before parsing, and counted
+    conn = PeerConnection(Mock(), init=PeerInit(None, "user1", "P", 0))
+    result = search_result(SEARCH_ID, 1)
+    msgs, conn = proto.process_peer_input(conn, bytearray(struct.pack("<II", len(result) + 4, 9) + result))
+
+    assert msgs == []
+    assert not conn.ibuf
+    assert proto._unwanted_search_results == 1
+
+    # Old searches are dropped when a new search is made
+    proto.add_search_token(FileSearch(requestid=SEARCH_ID, text=SEARCH_TEXT))
+    proto._search_budgets[SEARCH_ID] = (3, 0)
+    proto.add_search_token(FileSearch(requestid=SEARCH_ID + 1, text=SEARCH_TEXT))
+
+    assert list(proto._search_budgets) == [SEARCH_ID + 1]
@@ -0,0 +1,45 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine.utils import IPAddressList
+
+
+def test_ip_address_patterns():
+    ips = IPAddressList(["1.2.3.4", "10.1.*.*", "192.168.0.0/16", "5.*.7.8"])
+
+    assert "1.2.3.4" in ips
+    assert "1.2.3.5" not in ips
+
+    assert "10.1.0.0" in ips
+    assert "10.1.255.255" in ips
+    assert "10.2.0.0" not in ips
+
+    assert "192.168.40.2" in ips
+    assert "192.169.0.1" not in ips
+
+    assert "5.6.7.8" in ips
+    assert "5.6.7.9" not in ips
+
+
+def test_overlapping_ranges():
+    ips = IPAddressList(["10.0.0.0/8", "10.1.*.*", "11.0.0.0/8", "invalid", "1.2.3"])
+
+    assert len(ips) == 1
+    assert "11.255.255.255" in ips
+    assert "12.0.0.0" not in ips
+    assert "invalid" not in ips
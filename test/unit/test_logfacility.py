@@ -0,0 +1,40 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine.logfacility import Logger
+
+
+def test_lazy_msg_args():
+    logger = Logger()
+    logged = []
+    calls = []
+
+    def msg_args():
+        calls.append(True)
+        return ("contents",)
+
+    logger.add_listener(lambda timestamp_format, level, msg: logged.append(msg))
+    logger.set_log_levels((0, 1))
+
+    logger.add_msg_contents("%s", msg_args)
+    assert not calls
+    assert not logged
+
+    logger.set_log_levels((4,))
+    logger.add_msg_contents("%s", msg_args)
+    assert logged == ["contents"]
@@ -0,0 +1,80 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from unittest.mock import Mock
+
+from pynicotine.slskmessages import ConnClose
+from pynicotine.slskproto import MessageParserPool
+from pynicotine.slskproto import PeerConnection
+
+
+def test_parse_order():
+    delivered = []
+
+    def parse(conn, msg, msgsize, data):
+        # Earlier messages take longer to parse
+        time.sleep(0.01 * (5 - msg))
+        return (conn, msg)
+
+    pool = MessageParserPool(delivered.extend, parse)
+    jobs = [pool.put(conn, msg, 0, b"") for msg in range(5) for conn in ("a", "b")]
+
+    for i in range(100):
+        if all(job.done for job in jobs):
+            break
+
+        time.sleep(0.05)
+
+    pool.abort()
+
+    assert [msg for conn, msg in delivered if conn == "a"] == list(range(5))
+    assert [msg for conn, msg in delivered if conn == "b"] == list(range(5))
+
+
+def test_close_during_parse(proto):
+    delivered = []
+    parsing = threading.Event()
+
+    def parse(conn, msg, msgsize, data):
+        parsing.wait(5)
+        return msg
+
+    proto._parsers.abort()
+    proto._parsers = MessageParserPool(delivered.extend, parse)
+    proto._events.callback = delivered.extend
+
+    sock = Mock()
+    conn = proto._conns[sock] = PeerConnection(sock)
+    conn.parsejob = proto._parsers.put(conn, "shares", 0, b"")
+
+    # The connection closes before its shared file list is parsed
+    close = ConnClose(sock, None)
+    proto._ui_callback([close])
+    proto._events.flush()
+    parsing.set()
+
+    for i in range(100):
+        if conn.parsejob.done:
+            break
+
+        time.sleep(0.05)
+
+    assert delivered == ["shares", close]
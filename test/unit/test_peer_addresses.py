@@ -0,0 +1,136 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from queue import Queue
+from unittest.mock import Mock
+
+from pynicotine import slskmessages
+from pynicotine.config import Config
+from pynicotine.pynicotine import NetworkEventProcessor
+from pynicotine.pynicotine import PeerConnections
+from pynicotine.slskmessages import PeerInit
+from pynicotine.slskproto import Connection
+
+
+def network_event_processor(tmpdir):
+    """ A NetworkEventProcessor with only what handling peer addresses needs """
+
+    np = NetworkEventProcessor.__new__(NetworkEventProcessor)
+    np.config = Config(str(tmpdir.join("config")), str(tmpdir))
+    np.config.sections["server"]["login"] = "me"
+    np.config.sections["server"]["firewalled"] = 1
+    np.queue = Queue()
+    np.peerconns = PeerConnections()
+    np.users = {}
+    np.user_addr_requested = set()
+    np.transfers = None
+    np.userinfo = Mock()
+    np.events = {slskmessages.UserInfoReply: np.user_info_reply}
+    np.peer_addresses = {}
+
+    return np
+
+
+def test_saved_peer_address(tmpdir):
+    np = network_event_processor(tmpdir)
+    np.peer_addresses = {
+        "user1": ("10.0.0.1", 2234, None, time.time()),
+        "user2": ("10.0.0.2", 2234, None, time.time())
+    }
+
+    # Harmless requests go to the saved address right away
+    np.process_request_to_peer("user1", slskmessages.UserInfoRequest(None))
+    guess = np.peerconns.by_username("user1")[0]
+
+    assert guess.guessed
+    assert np.queue.get(0).addr == ("10.0.0.1", 2234)
+
+    # Anything else waits for the server to tell us the current address
+    np.process_request_to_peer("user1", slskmessages.QueueUpload(None, "file"))
+
+    assert not np.peerconns.by_username("user1")[1].guessed
+    assert np.queue.get(0).user == "user1"
+
+    # Replies from a saved address are held until the server confirms it's still the user's
+    sock = object()
+    np.out_conn(slskmessages.OutConn(sock, ("10.0.0.1", 2234)))
+    reply = slskmessages.UserInfoReply(Connection(sock))
+    np.user_info_reply(reply)
+
+    # The server was already asked for the address above
+    assert [np.queue.get(0).__class__ for i in range(2)] == [PeerInit, slskmessages.UserInfoRequest]
+    assert not np.userinfo.show_info.called
+
+    np.confirm_peer_address("user1", "10.0.0.1", 2234)
+
+    assert not guess.guessed
+    np.userinfo.show_info.assert_called_once_with("user1", reply)
+
+    # Replies from a saved address that belongs to someone else now are dropped
+    np.process_request_to_peer("user2", slskmessages.UserInfoRequest(None))
+    np.queue.get(0)
+    sock = object()
+    np.out_conn(slskmessages.OutConn(sock, ("10.0.0.2", 2234)))
+    np.user_info_reply(slskmessages.UserInfoReply(Connection(sock)))
+    np.confirm_peer_address("user2", "10.0.0.3", 2234)
+
+    assert np.userinfo.show_info.call_count == 1
+    assert [np.queue.get(0).__class__ for i in range(4)][-1] is slskmessages.ConnClose
+
+    # Someone else connecting from a saved address means it's no longer that user's
+    np.forget_other_peer_addresses("user3", ("10.0.0.2", 50000))
+
+    assert list(np.peer_addresses) == ["user1"]
+
+
+def test_save_peer_addresses(tmpdir):
+    np = network_event_processor(tmpdir)
+    np.PEER_ADDRESS_MAX = 2
+    now = time.time()
+    np.peer_addresses = {
+        "user1": ("10.0.0.1", 2234, None, now - 10),
+        "user2": ("10.0.0.2", 2234, "yes", now),
+        "user3": ("10.0.0.3", 2234, None, now - 20),
+        "user4": ("10.0.0.4", 2234, None, now - np.PEER_ADDRESS_TTL - 1)
+    }
+
+    # Only the most recently seen addresses that haven't expired are saved
+    np.save_peer_addresses()
+
+    assert np.config.read_peer_addresses() == {
+        "user1": ("10.0.0.1", 2234, None, now - 10),
+        "user2": ("10.0.0.2", 2234, "yes", now)
+    }
+
+    np.PEER_ADDRESS_MAX = 10
+    np.save_peer_addresses()
+
+    assert sorted(np.config.read_peer_addresses()) == ["user1", "user2", "user3"]
+
+
+def test_peer_address_round_trip(tmpdir):
+    config = Config(str(tmpdir.join("config")), str(tmpdir))
+
+    assert config.read_peer_addresses() == {}
+
+    config.write_peer_addresses({"user1": ("10.0.0.1", 2234, None, 1.5)})
+
+    assert config.read_peer_addresses() == {"user1": ("10.0.0.1", 2234, None, 1.5)}
+    assert tmpdir.listdir(lambda path: path.ext == ".tmp") == []
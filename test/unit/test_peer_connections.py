@@ -0,0 +1,57 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine.pynicotine import PeerConnection
+from pynicotine.pynicotine import PeerConnections
+from pynicotine.slskmessages import PeerInit
+
+
+def test_lookup():
+    peerconns = PeerConnections()
+    browse = PeerConnection(username="user1", token=1, init=PeerInit(None, "user1", "P", 0))
+    download = PeerConnection(username="user1", addr=("10.0.0.1", 2234), init=PeerInit(None, "user1", "F", 0))
+
+    peerconns.append(browse)
+    peerconns.append(download)
+
+    assert list(peerconns) == [browse, download]
+    assert peerconns.by_username("user1") == (browse, download)
+    assert peerconns.by_token(1) == (browse,)
+    assert peerconns.by_addr(("10.0.0.1", 2234)) == (download,)
+    assert peerconns.by_type("F") == (download,)
+    assert peerconns.by_conn(None) == ()
+
+
+def test_reindex():
+    peerconns = PeerConnections()
+    peerconn = PeerConnection(username="user1", init=PeerInit(None, "user1", "P", 0))
+    sock = object()
+
+    peerconns.append(peerconn)
+    peerconns.set_conn(peerconn, sock)
+    peerconns.set_token(peerconn, 2)
+
+    assert peerconn.conn is sock
+    assert peerconns.get_username(sock) == "user1"
+    assert peerconns.by_token(2) == (peerconn,)
+
+    peerconns.remove(peerconn)
+
+    assert len(peerconns) == 0
+    assert peerconns.get_username(sock) is None
+    assert peerconns.by_username("user1") == ()
@@ -0,0 +1,33 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest.mock import Mock
+
+from pynicotine.slskproto import PeerConnection
+
+
+def test_peer_usage_is_bounded(proto):
+    proto.PEER_USAGE_SIZE = 2
+
+    for user in ("user1", "user2", "user1", "user3"):
+        conn_obj = PeerConnection(Mock(), init=Mock(type='P', user=user))
+        proto._conns[conn_obj.conn] = conn_obj
+        proto.use_peer_connection(conn_obj)
+
+    # The least recently seen user is forgotten first
+    assert list(proto._peer_usage.items()) == [("user1", 2), ("user3", 1)]
@@ -0,0 +1,69 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from pynicotine.config import Config
+from pynicotine.pynicotine import RequestAdmission
+
+
+def test_admission(tmpdir):
+    config = Config(str(tmpdir.join("config")), str(tmpdir))
+    config.sections["transfers"]["requestlimits"] = {"GetSharedFileList": (2, 60)}
+
+    admission = RequestAdmission(config)
+
+    assert admission.admit("user1", "GetSharedFileList")
+    assert admission.admit("user1", "GetSharedFileList")
+    assert not admission.admit("user1", "GetSharedFileList")
+
+    # Budgets are per user, and request types without a limit are always admitted
+    assert admission.admit("user2", "GetSharedFileList")
+    assert admission.admit("user1", "UserInfoRequest")
+
+    assert admission.recent_rejections("user1") == 1
+    assert admission.recent_rejections("user2") == 0
+    assert admission.rejected_types == {"GetSharedFileList": 1}
+
+    # A request is allowed again once its share of the period has passed
+    assert admission.buckets[("user1", "GetSharedFileList")].get_tokens(time.monotonic() + 30) == 1
+
+    # Changing the period of a limit applies to existing buckets
+    config.sections["transfers"]["requestlimits"] = {"GetSharedFileList": (2, 120)}
+
+    assert admission.admit("user1", "GetSharedFileList")
+    assert admission.buckets[("user1", "GetSharedFileList")].rate == 2 / 120
+
+
+def test_rejections_expire(tmpdir):
+    config = Config(str(tmpdir.join("config")), str(tmpdir))
+    config.sections["transfers"]["requestlimits"] = {"GetSharedFileList": (1, 60)}
+
+    admission = RequestAdmission(config)
+    admission.admit("user1", "GetSharedFileList")
+
+    assert not admission.admit("user1", "GetSharedFileList")
+    assert not admission.admit("user1", "GetSharedFileList")
+    assert admission.recent_rejections("user1") == 2
+
+    # Rejections only count towards an automatic ban within one period
+    admission.rejected_users["user1"] = (2, time.monotonic() - admission.REJECTION_PERIOD)
+    assert admission.recent_rejections("user1") == 0
+
+    assert not admission.admit("user1", "GetSharedFileList")
+    assert admission.recent_rejections("user1") == 1
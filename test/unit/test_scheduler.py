@@ -0,0 +1,37 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from pynicotine.scheduler import Scheduler
+
+
+def test_scheduler_order_and_cancel():
+    scheduler = Scheduler()
+    fired = []
+    done = threading.Event()
+
+    scheduler.schedule(0.1, fired.append, "late")
+    cancelled = scheduler.schedule(0.05, fired.append, "cancelled")
+    scheduler.schedule(0, fired.append, "first")
+    scheduler.schedule(0.15, done.set)
+
+    cancelled.cancel()
+
+    assert done.wait(5)
+    assert fired == ["first", "late"]
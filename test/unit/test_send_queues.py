@@ -0,0 +1,70 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest.mock import Mock
+
+from pynicotine.slskproto import Connection
+
+
+def test_write_empty_queues(proto):
+    sock = Mock()
+    sock.send = Mock(side_effect=len)
+    conns = {sock: Connection(sock)}
+
+    # New outgoing connections become writable before anything is queued
+    proto.write_data(conns, sock)
+
+    sock.send.assert_called_once_with(bytearray())
+    assert conns[sock].bulkframe is None
+
+
+def test_write_small_before_bulk(proto):
+    sock = Mock()
+    sock.send = Mock(side_effect=len)
+    conn = Connection(sock)
+    conn.bulkbuf.append(b"large")
+    conn.obuf.extend(b"small")
+    conns = {sock: conn}
+
+    proto.write_data(conns, sock)
+    proto.write_data(conns, sock)
+
+    assert [bytes(call[0][0]) for call in sock.send.call_args_list] == [b"small", b"large"]
+    assert not conn.obuf
+    assert not conn.bulkbuf
+    assert conn.bulkframe is None
+
+
+def test_close_stalled_output(proto):
+    sock = Mock()
+    sock.send = Mock(return_value=0)
+    conn = Connection(sock)
+    conn.bulkbuf.append(bytes(proto.OUTPUT_HIGH_WATER * 2))
+    conns = {sock: conn}
+    timeout = proto.OUTPUT_HIGH_WATER_TIMEOUT
+
+    assert not proto.check_output_high_water(conn, proto._get_output_size(conn), 0)
+
+    # Connections that still drain are kept, even if their output stays above the high-water mark
+    sock.send.return_value = 1
+    proto.write_data(conns, sock)
+    assert not proto.check_output_high_water(conn, proto._get_output_size(conn), conn.lastactive + timeout)
+
+    sock.send.return_value = 0
+    proto.write_data(conns, sock)
+    assert proto.check_output_high_water(conn, proto._get_output_size(conn), conn.lastactive + timeout + 1)
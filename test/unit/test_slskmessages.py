@@ -0,0 +1,327 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import inspect
+import socket
+import struct
+import zlib
+
+import pytest
+
+from pynicotine import slskmessages
+from pynicotine.slskmessages import ConnectToPeer
+from pynicotine.slskmessages import FileSearch
+from pynicotine.slskmessages import FileSearchResult
+from pynicotine.slskmessages import IP
+from pynicotine.slskmessages import GlobalUserList
+from pynicotine.slskmessages import GetPeerAddress
+from pynicotine.slskmessages import Login
+from pynicotine.slskmessages import MessageCodec
+from pynicotine.slskmessages import FileListIndex
+from pynicotine.slskmessages import FolderContentsRequest
+from pynicotine.slskmessages import OPTIONAL
+from pynicotine.slskmessages import PeerInit
+from pynicotine.slskmessages import SharedFileList
+from pynicotine.slskmessages import SlskMessage
+from pynicotine.slskmessages import STRING
+from pynicotine.slskmessages import TransferRequest
+from pynicotine.slskmessages import UINT8
+from pynicotine.slskmessages import UINT64
+from pynicotine.slskmessages import UserInfoReply
+
+
+def pack_string(value):
+    value = value.encode("utf-8")
+    return struct.pack("<I", len(value)) + value
+
+
+def declared_messages(direction, method, custom=False):
+    """ Message classes that declare their fields for one direction. Only
+    classes that also use their own code for 'method' are returned if
+    custom is True, otherwise only classes that don't. """
+
+    classes = []
+
+    for name, cls in inspect.getmembers(slskmessages, inspect.isclass):
+        if not issubclass(cls, SlskMessage) or getattr(cls, direction) is None:
+            continue
+
+        if (getattr(cls, method) is not getattr(SlskMessage, method)) == custom:
+            classes.append(pytest.param(cls, id=name))
+
+    return classes
+
+
+def sample_message(cls, fields):
+    message = cls.__new__(cls)
+
+    for field in fields:
+        if field is OPTIONAL:
+            continue
+
+        attribute, field_type = field
+
+        if field_type is STRING:
+            value = "nicotine \u00e9 %s" % attribute
+        elif field_type is IP:
+            value = "10.0.0.1"
+        elif field_type == UINT8:
+            value = 1
+        elif field_type == UINT64:
+            value = 1 << 40
+        else:
+            value = 2234
+
+        setattr(message, attribute, value)
+
+    return message
+
+
+def field_values(message, fields):
+    return [getattr(message, field[0]) for field in fields if field is not OPTIONAL]
+
+
+@pytest.mark.parametrize("cls", declared_messages("pack_fields", "make_network_message"))
+def test_pack_round_trip(cls):
+    message = sample_message(cls, cls.pack_fields)
+    parsed = cls.__new__(cls)
+
+    data = message.make_network_message()
+    assert MessageCodec.get(cls.pack_fields).unpack(parsed, data) == len(data)
+    assert field_values(parsed, cls.pack_fields) == field_values(message, cls.pack_fields)
+
+
+@pytest.mark.parametrize("cls", declared_messages("unpack_fields", "parse_network_message"))
+def test_unpack_round_trip(cls):
+    message = sample_message(cls, cls.unpack_fields)
+    parsed = cls.__new__(cls)
+    parsed.parse_network_message(MessageCodec.get(cls.unpack_fields).pack(message))
+
+    assert field_values(parsed, cls.unpack_fields) == field_values(message, cls.unpack_fields)
+
+
+@pytest.mark.parametrize("cls", declared_messages("unpack_fields", "make_network_message", custom=True))
+def test_custom_pack_round_trip(cls):
+    # Messages packed by hand must still parse with their declared fields
+    message = sample_message(cls, cls.unpack_fields)
+    parsed = cls.__new__(cls)
+
+    data = message.make_network_message()
+    parsed.parse_network_message(data)
+
+    assert MessageCodec.get(cls.unpack_fields).pack(parsed) == data
+
+
+def test_pack_fields():
+    message = FileSearch(1234, "nicotine")
+
+    assert message.make_network_message() == struct.pack("<I", 1234) + pack_string("nicotine")
+
+
+def test_unpack_fields():
+    message = GetPeerAddress()
+    message.parse_network_message(
+        pack_string("user1") + bytes(reversed(socket.inet_aton("10.0.0.1"))) + struct.pack("<I", 2234)
+    )
+
+    assert message.user == "user1"
+    assert message.ip == "10.0.0.1"
+    assert message.port == 2234
+
+
+def test_round_trip():
+    message = PeerInit(None, "user1", "P", 42)
+
+    parsed = PeerInit(None)
+    parsed.parse_network_message(message.make_network_message())
+
+    assert (parsed.user, parsed.type, parsed.token) == ("user1", "P", 42)
+
+
+def test_folder_contents_request_round_trip():
+    message = FolderContentsRequest(None, "music\\a")
+
+    parsed = FolderContentsRequest(None)
+    parsed.parse_network_message(message.make_network_message())
+
+    assert parsed.dir == "music\\a"
+
+
+def test_optional_fields():
+    address = bytes(reversed(socket.inet_aton("10.0.0.1")))
+    data = pack_string("user1") + pack_string("P") + address + struct.pack("<II", 2234, 7)
+
+    # Privileged flag is missing from older servers
+    message = ConnectToPeer()
+    message.parse_network_message(data)
+
+    assert message.token == 7
+    assert not hasattr(message, "privileged") or message.privileged is None
+
+    message = ConnectToPeer()
+    message.parse_network_message(data + struct.pack("<B", 1))
+
+    assert message.privileged == 1
+
+
+def test_string_fallback():
+    # Strings that aren't valid UTF-8 are decoded as Latin-1
+    pos, value = SlskMessage().get_object(struct.pack("<I", 1) + b"\xe9", bytes)
+
+    assert (pos, value) == (5, "é")
+
+
+def pack_file(name, size, attrs):
+    data = b"\x01" + pack_string(name) + struct.pack("<Q", size) + pack_string("mp3") + struct.pack("<I", len(attrs))
+
+    for num, attr in enumerate(attrs):
+        data += struct.pack("<II", num, attr)
+
+    return data
+
+
+def test_file_list_index():
+    data = struct.pack("<I", 2)
+    data += pack_string("music\\a") + struct.pack("<I", 2)
+    data += pack_file("1.mp3", 1000, [320, 180]) + pack_file("2.mp3", 2000, [])
+    data += pack_string("music\\b") + struct.pack("<I", 0)
+
+    message = SharedFileList(None)
+    message.parse_network_message(zlib.compress(data))
+    shares = message.list
+
+    assert isinstance(shares, FileListIndex)
+    assert sorted(shares) == ["music\\a", "music\\b"]
+    assert shares.totalsize == 3000
+    assert shares.end == len(data)
+
+    assert shares["music\\a"] == [(1, "1.mp3", 1000, "mp3", [320, 180]), (1, "2.mp3", 2000, "mp3", [])]
+    assert shares["music\\b"] == []
+    assert shares.get("music\\c") is None
+
+
+def test_search_result_header():
+    data = pack_string("user1") + struct.pack("<II", 1234, 2)
+    data += pack_file("1.mp3", 1000, []) + pack_file("2.mp3", 2000, []) + struct.pack("<BIQ", 1, 0, 0)
+
+    message = FileSearchResult(None)
+
+    assert message.parse_network_message_header(zlib.compress(data)) == (1234, 2)
+    assert message.user == "user1"
+
+
+def test_user_info_reply_header():
+    header = UserInfoReply(None, "descr", b"pic").make_header()
+    message = UserInfoReply(None, "descr", b"pic", 5, 2, True, 1, header)
+
+    data = message.make_network_message()
+    assert data == UserInfoReply(None, "descr", b"pic", 5, 2, True, 1).make_network_message()
+
+    message = UserInfoReply(None)
+    message.parse_network_message(data)
+
+    assert (message.descr, message.pic) == ("descr", b"pic")
+    assert (message.totalupl, message.queuesize, message.slotsavail, message.uploadallowed) == (5, 2, 1, 1)
+
+
+def test_global_user_list_is_empty():
+    assert GlobalUserList().make_network_message() == b""
+
+
+# Messages packed by the hand-written code that declared fields replaced, to make
+# sure the wire format didn't change
+LOGIN_DATA = (
+    b"\x05\x00\x00\x00user1\x05\x00\x00\x00pass1\xa0\x00\x00\x00"
+    b"\x20\x00\x00\x00ca34ff7d9e295155b189c3591f8ca195\x01\x00\x00\x00"
+)
+LOGIN_REPLY_DATA = b"\x01\x06\x00\x00\x00banner\x01\x00\x00\x0a\x03\x00\x00\x00abc"
+PEER_INIT_DATA = b"\x05\x00\x00\x00user1\x01\x00\x00\x00P\x2a\x00\x00\x00"
+FILE_SEARCH_RESULT_DATA = (
+    b"\x05\x00\x00\x00user1\xd2\x04\x00\x00\x02\x00\x00\x00"
+    b"\x01\x0d\x00\x00\x00music\\a\\1.mp3\xe8\x03\x00\x00\x00\x00\x00\x00\x03\x00\x00\x00mp3"
+    b"\x03\x00\x00\x00\x00\x00\x00\x00\x40\x01\x00\x00\x01\x00\x00\x00\xb4\x00\x00\x00\x02\x00\x00\x00\x00\x00\x00\x00"
+    b"\x01\x0e\x00\x00\x00music\\a\\2.flac\xd0\x07\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+    b"\x01\xf4\x01\x00\x00\x07\x00\x00\x00\x00\x00\x00\x00"
+)
+USER_INFO_REPLY_DATA = (
+    b"\x05\x00\x00\x00descr\x01\x03\x00\x00\x00pic\x05\x00\x00\x00\x02\x00\x00\x00\x01\x01\x00\x00\x00"
+)
+TRANSFER_REQUEST_DATA = b"\x00\x00\x00\x00\x07\x00\x00\x00\x0d\x00\x00\x00music\\a\\1.mp3"
+TRANSFER_REQUEST_SIZE_DATA = (
+    b"\x01\x00\x00\x00\x07\x00\x00\x00\x0d\x00\x00\x00music\\a\\1.mp3\xe8\x03\x00\x00\x00\x00\x00\x00"
+)
+
+
+def test_login_fixture():
+    assert bytes(Login("user1", "pass1", 160, 1).make_network_message()) == LOGIN_DATA
+
+    message = Login()
+    message.parse_network_message(LOGIN_REPLY_DATA)
+
+    assert (message.success, message.banner, message.ip, message.checksum) == (1, "banner", "10.0.0.1", "abc")
+
+
+def test_peer_init_fixture():
+    assert bytes(PeerInit(None, "user1", "P", 42).make_network_message()) == PEER_INIT_DATA
+
+    message = PeerInit(None)
+    message.parse_network_message(PEER_INIT_DATA)
+
+    assert (message.user, message.type, message.token) == ("user1", "P", 42)
+
+
+def test_file_search_result_fixture():
+    fileindex = {
+        repr(0): ("music\\a\\1.mp3", 1000, (320, 0), 180),
+        repr(1): ("music\\a\\2.flac", 2000, None, None)
+    }
+    message = FileSearchResult(None, "user1", None, 1234, [0, 1], fileindex, 1, 500, (7,), None, 2)
+
+    assert zlib.decompress(message.make_network_message()) == FILE_SEARCH_RESULT_DATA
+
+    message = FileSearchResult(None)
+    message.parse_network_message(zlib.compress(FILE_SEARCH_RESULT_DATA))
+
+    assert (message.user, message.token, message.freeulslots, message.ulspeed, message.inqueue) == ("user1", 1234, 1, 500, 7)
+    assert message.list == [
+        (1, "music\\a\\1.mp3", 1000, "mp3", [320, 180, 0]),
+        (1, "music\\a\\2.flac", 2000, "", [])
+    ]
+
+
+def test_user_info_reply_fixture():
+    assert bytes(UserInfoReply(None, "descr", b"pic", 5, 2, 1, 1).make_network_message()) == USER_INFO_REPLY_DATA
+
+    message = UserInfoReply(None)
+    message.parse_network_message(USER_INFO_REPLY_DATA)
+
+    assert (message.descr, message.pic) == ("descr", b"pic")
+    assert (message.totalupl, message.queuesize, message.slotsavail, message.uploadallowed) == (5, 2, 1, 1)
+
+
+@pytest.mark.parametrize("direction, filesize, data", [
+    pytest.param(0, None, TRANSFER_REQUEST_DATA, id="download"),
+    pytest.param(1, 1000, TRANSFER_REQUEST_SIZE_DATA, id="upload")
+])
+def test_transfer_request_fixture(direction, filesize, data):
+    assert bytes(TransferRequest(None, direction, 7, "music\\a\\1.mp3", filesize).make_network_message()) == data
+
+    message = TransferRequest(None)
+    message.parse_network_message(data)
+
+    assert (message.direction, message.req, message.file, message.filesize) == (direction, 7, "music\\a\\1.mp3", filesize)
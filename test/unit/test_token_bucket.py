@@ -0,0 +1,55 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine.slskproto import TokenBucket
+
+
+def test_unlimited_bucket():
+    bucket = TokenBucket()
+
+    assert bucket.get_tokens(bucket.lastrefill) is None
+    assert bucket.get_wait_time(bucket.lastrefill) == 0
+
+
+def test_bucket_refill():
+    bucket = TokenBucket(1000)
+    start = bucket.lastrefill = 0
+
+    # Bursts are limited to a quarter of a second of data
+    assert bucket.get_tokens(start) == 250
+
+    bucket.consume(250)
+    assert bucket.get_tokens(start) == 0
+    assert bucket.get_wait_time(start) == 0.125
+
+    assert bucket.get_tokens(start + 0.125) == 125
+    assert bucket.get_tokens(start + 10) == 250
+
+
+def test_bucket_chain():
+    global_bucket = TokenBucket(1000)
+    transfer_bucket = TokenBucket(2000, parent=global_bucket)
+    start = global_bucket.lastrefill = transfer_bucket.lastrefill = 0
+
+    # The most restrictive bucket in the chain decides
+    assert transfer_bucket.get_tokens(start) == 250
+
+    transfer_bucket.consume(200)
+    assert global_bucket.get_tokens(start) == 50
+    assert transfer_bucket.get_tokens(start) == 50
+    assert transfer_bucket.get_wait_time(start) == 0.075